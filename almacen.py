@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Almacén de archivos generados (FILES_DIR)
+#
+# - Los archivos nuevos van a FILES_DIR/<AAAAMMDD>/<hh>/<nombre>, con <hh> =
+#   prefijo del sha1 del nombre sin extensión (DOCX y PDF quedan juntos).
+# - Un índice SQLite nombre -> ruta mantiene vivas las URLs /files/<nombre>.
+#   Los archivos antiguos en la raíz se adoptan tal cual en el primer barrido.
+# - El índice y su lock viven fuera de FILES_DIR (STORAGE_STATE_DIR, por
+#   defecto <FILES_DIR>_estado): /files nunca puede servirlos.
+# - Un barrido en segundo plano (uno por contenedor, con flock) expira los DOCX
+#   a las STORAGE_DOCX_TTL_HOURS, el resto a los STORAGE_RETENTION_DAYS, y
+#   aplica la cuota STORAGE_QUOTA_BYTES desalojando lo menos usado.
+# Con varias réplicas, STORAGE_BACKEND=s3 usa almacen_s3.AlmacenS3 (misma
+# interfaz); crear() elige según el entorno.
+# -----------------------------------------------------------------------------
+import os, re, time, shutil, sqlite3, hashlib, logging, threading, datetime
+
+try:
+    import fcntl
+except Exception:
+    fcntl = None
+
+log = logging.getLogger("almacen")
+
+STORAGE_BACKEND     = (os.getenv("STORAGE_BACKEND", "local") or "local").strip().lower()   # local | s3
+
+STORAGE_DOCX_TTL    = float(os.getenv("STORAGE_DOCX_TTL_HOURS", "6")) * 3600
+STORAGE_RETENTION   = float(os.getenv("STORAGE_RETENTION_DAYS", "30")) * 86400
+STORAGE_QUOTA_BYTES = int(os.getenv("STORAGE_QUOTA_BYTES", str(2 * 1024 * 1024 * 1024)))
+STORAGE_SWEEP_EVERY = float(os.getenv("STORAGE_SWEEP_INTERVAL_SECONDS", "300"))
+STORAGE_STATE_DIR   = os.getenv("STORAGE_STATE_DIR", "")
+_TOUCH_EVERY = 60.0
+# Archivos planos de antes del índice que se siguen sirviendo aunque no estén indexados
+_NOMBRE_LEGADO = re.compile(r"^cotizacion_[\w-]+\.(pdf|docx)$")
+
+def nombre_publico(nombre: str) -> bool:
+    # Lo único que /files acepta en cualquier backend: nada vacío, oculto (ni "..") ni con separadores
+    return bool(nombre) and not nombre.startswith(".") and "/" not in nombre and "\\" not in nombre
+
+def dir_estado(base_dir: str) -> str:
+    # Estado interno (índices SQLite, locks) fuera del directorio que sirve /files
+    d = STORAGE_STATE_DIR or os.path.abspath(base_dir).rstrip(os.sep) + "_estado"
+    os.makedirs(d, exist_ok=True)
+    return d
+
+def mover_estado(viejo: str, nuevo: str):
+    # Índices que antes vivían dentro de FILES_DIR: se mudan una vez, con su WAL
+    if os.path.exists(nuevo) or not os.path.exists(viejo): return
+    for suf in ("", "-wal", "-shm"):
+        try: os.replace(viejo + suf, nuevo + suf)
+        except FileNotFoundError: pass
+    log.info("Índice movido fuera de FILES_DIR: %s -> %s", viejo, nuevo)
+
+class AlmacenArchivos:
+    remoto = False
+
+    def __init__(self, base_dir: str, estado_dir: str = ""):
+        self.base_dir = base_dir
+        estado_dir = estado_dir or dir_estado(base_dir)
+        self.db_path = os.path.join(estado_dir, "almacen.sqlite")
+        self.lock_path = os.path.join(estado_dir, "almacen.lock")
+        mover_estado(os.path.join(base_dir, ".almacen.sqlite"), self.db_path)
+        try: os.remove(os.path.join(base_dir, ".almacen.lock"))
+        except OSError: pass
+        self._local = threading.local()
+        self._tocados = {}
+        self._barrido_pid = None
+        self._detener = threading.Event()
+        self.ultimo_barrido = None
+        with self._db() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS archivos (
+                            nombre TEXT PRIMARY KEY, ruta TEXT NOT NULL, tipo TEXT NOT NULL,
+                            bytes INTEGER NOT NULL, creado REAL NOT NULL, usado REAL NOT NULL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_arch_usado ON archivos(usado)")
+            cols = {r[1] for r in db.execute("PRAGMA table_info(archivos)")}
+            if "sha256" not in cols:
+                db.execute("ALTER TABLE archivos ADD COLUMN sha256 TEXT")
+
+    def _db(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None or getattr(self._local, "pid", None) != os.getpid():
+            con = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            self._local.con, self._local.pid = con, os.getpid()
+        return con
+
+    # ---- escritura ----------------------------------------------------------
+    def ruta_nueva(self, nombre: str) -> str:
+        stem = os.path.splitext(nombre)[0]
+        shard = os.path.join(datetime.date.today().strftime("%Y%m%d"), hashlib.sha1(stem.encode("utf-8")).hexdigest()[:2])
+        os.makedirs(os.path.join(self.base_dir, shard), exist_ok=True)
+        return os.path.join(self.base_dir, shard, nombre)
+
+    def guardar(self, nombre: str, stream, tipo: str = ""):
+        # Copia en trozos desde un archivo abierto (p. ej. el de /upload)
+        path = self.ruta_nueva(nombre)
+        with open(path + ".tmp", "wb") as f: shutil.copyfileobj(stream, f, 1024 * 1024)
+        os.replace(path + ".tmp", path)
+        self.registrar(nombre, path)
+
+    def registrar(self, nombre: str, path: str = ""):
+        path = path or self.ruta(nombre)
+        if not path or not os.path.exists(path): return
+        rel = os.path.relpath(path, self.base_dir)
+        now = time.time()
+        self._db().execute("INSERT OR REPLACE INTO archivos (nombre, ruta, tipo, bytes, creado, usado) VALUES (?,?,?,?,?,?)",
+                           (nombre, rel, _tipo(nombre), os.path.getsize(path), now, now))
+
+    # ---- lectura ------------------------------------------------------------
+    def ruta(self, nombre: str):
+        # Ruta absoluta del archivo o None. Acepta nombres del índice y cotizaciones
+        # planas antiguas en FILES_DIR; nada oculto ni fuera de esos dos casos.
+        if not nombre_publico(nombre): return None
+        row = self._db().execute("SELECT ruta FROM archivos WHERE nombre=?", (nombre,)).fetchone()
+        if row:
+            p = os.path.join(self.base_dir, row[0])
+            if os.path.exists(p): return p
+        if not _NOMBRE_LEGADO.match(nombre): return None
+        p = os.path.join(self.base_dir, nombre)
+        return p if os.path.isfile(p) else None
+
+    def sha256(self, nombre: str, path: str = ""):
+        # Hash de contenido (para ETag fuerte); se calcula una vez y queda en el índice
+        row = self._db().execute("SELECT sha256 FROM archivos WHERE nombre=?", (nombre,)).fetchone()
+        if row and row[0]: return row[0]
+        path = path or self.ruta(nombre)
+        if not path: return None
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""): h.update(chunk)
+        digest = h.hexdigest()
+        if row:
+            self._db().execute("UPDATE archivos SET sha256=? WHERE nombre=?", (digest, nombre))
+        return digest
+
+    def tamano(self, nombre: str):
+        p = self.ruta(nombre)
+        try: return os.path.getsize(p) if p else None
+        except OSError: return None
+
+    def existe(self, nombre: str) -> bool:
+        return bool(nombre) and self.ruta(nombre) is not None
+
+    def tocar(self, nombre: str):
+        # Marca de uso para el desalojo LRU, a lo más una escritura por minuto y archivo
+        now = time.time()
+        if now - self._tocados.get(nombre, 0) < _TOUCH_EVERY: return
+        self._tocados[nombre] = now
+        if len(self._tocados) > 10000: self._tocados.clear()
+        try: self._db().execute("UPDATE archivos SET usado=? WHERE nombre=?", (now, nombre))
+        except Exception as e: log.debug("tocar %s: %s", nombre, e)
+
+    def borrar(self, nombre: str):
+        p = self.ruta(nombre)
+        self._db().execute("DELETE FROM archivos WHERE nombre=?", (nombre,))
+        if p:
+            try: os.remove(p)
+            except OSError: pass
+
+    # ---- barrido ------------------------------------------------------------
+    def _adoptar_planos(self, db):
+        for entry in os.scandir(self.base_dir):
+            if not entry.is_file() or entry.name.startswith("."): continue
+            st = entry.stat()
+            db.execute("INSERT OR IGNORE INTO archivos (nombre, ruta, tipo, bytes, creado, usado) VALUES (?,?,?,?,?,?)",
+                       (entry.name, entry.name, _tipo(entry.name), st.st_size, st.st_mtime, st.st_mtime))
+
+    def barrer(self) -> dict:
+        db = self._db()
+        self._adoptar_planos(db)
+        now = time.time()
+        vencidos = db.execute("SELECT nombre FROM archivos WHERE (tipo='docx' AND creado<?) OR (tipo<>'docx' AND creado<?)",
+                              (now - STORAGE_DOCX_TTL, now - STORAGE_RETENTION)).fetchall()
+        for (nombre,) in vencidos: self.borrar(nombre)
+        total = db.execute("SELECT COALESCE(SUM(bytes),0) FROM archivos").fetchone()[0]
+        desalojados = 0
+        if total > STORAGE_QUOTA_BYTES:
+            for nombre, size in db.execute("SELECT nombre, bytes FROM archivos ORDER BY usado ASC").fetchall():
+                if total <= STORAGE_QUOTA_BYTES: break
+                self.borrar(nombre); total -= size; desalojados += 1
+        self._limpiar_shards_vacios()
+        self.ultimo_barrido = {"time": datetime.datetime.utcnow().isoformat() + "Z", "expired": len(vencidos),
+                               "evicted": desalojados, "bytes": total}
+        return self.ultimo_barrido
+
+    def _limpiar_shards_vacios(self):
+        for root, dirs, files in os.walk(self.base_dir, topdown=False):
+            if root == self.base_dir: continue
+            if not dirs and not files:
+                try: os.rmdir(root)
+                except OSError: pass
+
+    def _loop(self):
+        while not self._detener.wait(STORAGE_SWEEP_EVERY):
+            try:
+                with open(self.lock_path, "a") as lf:
+                    if fcntl is not None:
+                        try: fcntl.flock(lf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except OSError: continue   # otro worker está barriendo
+                    r = self.barrer()
+                    if r["expired"] or r["evicted"]: log.info("Barrido de archivos: %s", r)
+            except Exception:
+                log.exception("Barrido de archivos falló")
+
+    def arrancar_barrido(self):
+        if self._barrido_pid == os.getpid(): return
+        self._barrido_pid = os.getpid()
+        threading.Thread(target=self._loop, name="almacen-sweeper", daemon=True).start()
+
+    def estado(self) -> dict:
+        try: n, total = self._db().execute("SELECT COUNT(*), COALESCE(SUM(bytes),0) FROM archivos").fetchone()
+        except Exception: n, total = -1, -1
+        return {"backend": "local", "files": n, "bytes": total, "quota": STORAGE_QUOTA_BYTES, "last_sweep": self.ultimo_barrido}
+
+def crear(base_dir: str, estado_dir: str = ""):
+    if STORAGE_BACKEND == "s3":
+        import almacen_s3
+        return almacen_s3.AlmacenS3(base_dir)
+    return AlmacenArchivos(base_dir, estado_dir)
+
+def mimetype(nombre: str) -> str:
+    ext = os.path.splitext(nombre)[1].lower()
+    if ext == ".pdf":  return "application/pdf"
+    if ext == ".docx": return "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    return "application/octet-stream"
+
+def _tipo(nombre: str) -> str:
+    ext = os.path.splitext(nombre)[1].lower().lstrip(".")
+    return ext or "otro"
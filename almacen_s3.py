@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Almacén de objetos S3 (STORAGE_BACKEND=s3): AWS S3, MinIO, R2, Spaces...
+#
+# Misma interfaz que almacen.AlmacenArchivos, así /generate, /upload y /files
+# funcionan igual con varias réplicas y los archivos sobreviven a un redeploy:
+# - Los archivos se arman en una copia de trabajo local (ruta_nueva) y
+#   registrar() la sube con un PUT en streaming y la borra.
+# - /files/<nombre> redirige a una URL prefirmada (S3_FILES_MODE=redirect) o
+#   transmite el objeto con Range/If-None-Match sin cargarlo en memoria (proxy).
+# - Con STORAGE_DIRECT_URLS=true los enlaces que salen por WhatsApp ya son
+#   prefirmados: ni Twilio ni el admin pasan por los workers.
+# - La expiración la hacen las reglas de ciclo de vida del bucket; el barrido
+#   local solo limpia copias de trabajo huérfanas.
+# Firma SigV4 propia sobre requests: boto3 cuesta ~300 ms de import por worker.
+# Para pruebas: python bench/fake_s3.py 9000 + S3_ENDPOINT_URL=http://127.0.0.1:9000
+# -----------------------------------------------------------------------------
+import os, time, hmac, hashlib, logging, threading, datetime
+from urllib.parse import quote, urlsplit
+from almacen import mimetype, nombre_publico
+
+log = logging.getLogger("almacen_s3")
+
+S3_BUCKET        = os.getenv("S3_BUCKET", "").strip()
+S3_ENDPOINT_URL  = (os.getenv("S3_ENDPOINT_URL", "") or "").strip().rstrip("/")
+S3_REGION        = os.getenv("S3_REGION") or os.getenv("AWS_REGION") or "us-east-1"
+S3_ACCESS_KEY    = os.getenv("S3_ACCESS_KEY_ID") or os.getenv("AWS_ACCESS_KEY_ID") or ""
+S3_SECRET_KEY    = os.getenv("S3_SECRET_ACCESS_KEY") or os.getenv("AWS_SECRET_ACCESS_KEY") or ""
+S3_SESSION_TOKEN = os.getenv("S3_SESSION_TOKEN") or os.getenv("AWS_SESSION_TOKEN") or ""
+S3_PREFIX        = (os.getenv("S3_PREFIX", "cotizaciones/") or "").lstrip("/")
+# MinIO y la mayoría de compatibles usan path-style; AWS, virtual-hosted
+S3_PATH_STYLE    = (os.getenv("S3_PATH_STYLE", "true" if S3_ENDPOINT_URL else "false").lower() == "true")
+S3_PRESIGN_SECONDS = min(int(os.getenv("S3_PRESIGN_SECONDS", "86400")), 7 * 86400)   # máximo de SigV4
+S3_TIMEOUT       = float(os.getenv("S3_TIMEOUT_SECONDS", "10"))
+S3_FILES_MODE    = (os.getenv("S3_FILES_MODE", "redirect") or "redirect").strip().lower()   # redirect | proxy
+S3_STAGING_TTL   = float(os.getenv("S3_STAGING_TTL_SECONDS", "3600"))
+TROZO = 64 * 1024
+_CONOCIDOS_MAX = 10000
+_SIN_FIRMA = "UNSIGNED-PAYLOAD"
+
+class ErrorAlmacen(Exception):
+    pass
+
+def _q(s: str, seguro: str = "-_.~") -> str:
+    return quote(s, safe=seguro)
+
+def _hmac(clave: bytes, msg: str) -> bytes:
+    return hmac.new(clave, msg.encode("utf-8"), hashlib.sha256).digest()
+
+def _amz(ahora=None) -> str:
+    return (ahora or datetime.datetime.utcnow()).strftime("%Y%m%dT%H%M%SZ")
+
+class FirmaV4:
+    def __init__(self, access_key: str, secret_key: str, region: str, token: str = ""):
+        self.access_key, self.secret_key, self.region, self.token = access_key, secret_key, region, token
+        self._clave_dia = ("", b"")
+
+    def _clave(self, dia: str) -> bytes:
+        if self._clave_dia[0] != dia:
+            k = _hmac(("AWS4" + self.secret_key).encode("utf-8"), dia)
+            for parte in (self.region, "s3", "aws4_request"): k = _hmac(k, parte)
+            self._clave_dia = (dia, k)
+        return self._clave_dia[1]
+
+    def _alcance(self, amz: str) -> str:
+        return f"{amz[:8]}/{self.region}/s3/aws4_request"
+
+    def _firma(self, metodo: str, ruta: str, query: dict, cabeceras: dict, amz: str) -> str:
+        nombres = sorted(cabeceras)
+        canonica = "\n".join([
+            metodo, ruta, "&".join(f"{_q(k)}={_q(v)}" for k, v in sorted(query.items())),
+            "".join(f"{k}:{str(cabeceras[k]).strip()}\n" for k in nombres), ";".join(nombres), _SIN_FIRMA])
+        a_firmar = "\n".join(["AWS4-HMAC-SHA256", amz, self._alcance(amz),
+                              hashlib.sha256(canonica.encode("utf-8")).hexdigest()])
+        return hmac.new(self._clave(amz[:8]), a_firmar.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def cabeceras(self, metodo: str, host: str, ruta: str, query: dict = None, ahora=None) -> dict:
+        # -> cabeceras firmadas para el request (Authorization y x-amz-*); host lo pone requests
+        amz = _amz(ahora)
+        firmadas = {"host": host, "x-amz-content-sha256": _SIN_FIRMA, "x-amz-date": amz}
+        if self.token: firmadas["x-amz-security-token"] = self.token
+        firma = self._firma(metodo, ruta, query or {}, firmadas, amz)
+        nombres = ";".join(sorted(firmadas))
+        firmadas.pop("host")
+        firmadas["Authorization"] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{self._alcance(amz)}, "
+                                     f"SignedHeaders={nombres}, Signature={firma}")
+        return firmadas
+
+    def query_prefirmada(self, metodo: str, host: str, ruta: str, segundos: int, ahora=None) -> str:
+        amz = _amz(ahora)
+        query = {"X-Amz-Algorithm": "AWS4-HMAC-SHA256", "X-Amz-Credential": f"{self.access_key}/{self._alcance(amz)}",
+                 "X-Amz-Date": amz, "X-Amz-Expires": str(int(segundos)), "X-Amz-SignedHeaders": "host"}
+        if self.token: query["X-Amz-Security-Token"] = self.token
+        firma = self._firma(metodo, ruta, query, {"host": host}, amz)
+        return "&".join(f"{_q(k)}={_q(v)}" for k, v in sorted(query.items())) + "&X-Amz-Signature=" + firma
+
+class AlmacenS3:
+    remoto = True
+
+    def __init__(self, base_dir: str, bucket: str = S3_BUCKET, endpoint: str = S3_ENDPOINT_URL,
+                 prefijo: str = S3_PREFIX, path_style: bool = S3_PATH_STYLE):
+        if not bucket: raise ErrorAlmacen("STORAGE_BACKEND=s3 requiere S3_BUCKET")
+        self.base_dir = base_dir
+        self.trabajo_dir = os.path.join(base_dir, ".s3_trabajo")
+        os.makedirs(self.trabajo_dir, exist_ok=True)
+        self.bucket, self.prefijo = bucket, prefijo
+        endpoint = endpoint or f"https://s3.{S3_REGION}.amazonaws.com"
+        partes = urlsplit(endpoint)
+        if path_style:
+            self.host, self._raiz = partes.netloc, f"/{_q(bucket)}"
+        else:
+            self.host, self._raiz = f"{bucket}.{partes.netloc}", ""
+        self.origen = f"{partes.scheme}://{self.host}"
+        self.firma = FirmaV4(S3_ACCESS_KEY, S3_SECRET_KEY, S3_REGION, S3_SESSION_TOKEN)
+        self._local = threading.local()
+        # nombre -> bytes de lo que este proceso subió o vio: los nombres son de escritura única
+        self._conocidos = {}
+        self._barrido_pid = None
+        self._detener = threading.Event()
+        self.subidas = self.errores = 0
+
+    def _sesion(self):
+        # Una sesión HTTP (keep-alive) por hilo y por proceso; requests se importa al primer uso
+        s = getattr(self._local, "s", None)
+        if s is None or getattr(self._local, "pid", None) != os.getpid():
+            import requests
+            s = requests.Session()
+            self._local.s, self._local.pid = s, os.getpid()
+        return s
+
+    def _ruta(self, nombre: str) -> str:
+        # Toda clave pasa por aquí: nada fuera de S3_PREFIX ni objetos ocultos
+        if not nombre_publico(nombre): raise ErrorAlmacen(f"Nombre no válido: {nombre!r}")
+        return f"{self._raiz}/{_q(self.prefijo + nombre, '/-_.~')}"
+
+    def _pedir(self, metodo: str, nombre: str, cabeceras: dict = None, **kw):
+        ruta = self._ruta(nombre)
+        h = dict(cabeceras or {})
+        h.update(self.firma.cabeceras(metodo, self.host, ruta))
+        try:
+            return self._sesion().request(metodo, self.origen + ruta, headers=h, timeout=(S3_TIMEOUT, S3_TIMEOUT), **kw)
+        except Exception as e:
+            self.errores += 1
+            raise ErrorAlmacen(f"S3 {metodo} {nombre}: {e}") from e
+
+    def _conocer(self, nombre: str, n: int):
+        if len(self._conocidos) > _CONOCIDOS_MAX: self._conocidos.clear()
+        self._conocidos[nombre] = n
+
+    # ---- escritura ----------------------------------------------------------
+    def ruta_nueva(self, nombre: str) -> str:
+        return os.path.join(self.trabajo_dir, nombre)
+
+    def guardar(self, nombre: str, stream, tipo: str = ""):
+        # Sube desde un archivo abierto (seekable) sin leerlo entero a memoria
+        inicio = stream.tell()
+        stream.seek(0, os.SEEK_END); n = stream.tell() - inicio; stream.seek(inicio)
+        r = self._pedir("PUT", nombre, {"Content-Length": str(n), "Content-Type": tipo or mimetype(nombre)}, data=stream)
+        if r.status_code >= 300:
+            self.errores += 1
+            raise ErrorAlmacen(f"S3 PUT {nombre}: HTTP {r.status_code} {r.text[:200]}")
+        self.subidas += 1
+        self._conocer(nombre, n)
+
+    def registrar(self, nombre: str, path: str = ""):
+        # Sube la copia de trabajo y la borra
+        path = path or self.ruta_nueva(nombre)
+        if not os.path.exists(path): return
+        with open(path, "rb") as f: self.guardar(nombre, f)
+        try: os.remove(path)
+        except OSError: pass
+
+    # ---- lectura ------------------------------------------------------------
+    def ruta(self, nombre: str):
+        return None     # sin ruta local: se sirve con url_firmada() o abrir()
+
+    def tamano(self, nombre: str):
+        if nombre in self._conocidos: return self._conocidos[nombre]
+        r = self._pedir("HEAD", nombre)
+        if r.status_code == 404: return None
+        if r.status_code >= 300: raise ErrorAlmacen(f"S3 HEAD {nombre}: HTTP {r.status_code}")
+        n = int(r.headers.get("Content-Length") or 0)
+        self._conocer(nombre, n)
+        return n
+
+    def existe(self, nombre: str) -> bool:
+        return nombre_publico(nombre) and self.tamano(nombre) is not None
+
+    def abrir(self, nombre: str, cabeceras: dict = None):
+        # -> respuesta de requests en streaming (Range, If-None-Match... pasan tal cual); cerrarla al terminar
+        return self._pedir("GET", nombre, cabeceras, stream=True)
+
+    def url_firmada(self, nombre: str, segundos: int = S3_PRESIGN_SECONDS) -> str:
+        ruta = self._ruta(nombre)
+        return f"{self.origen}{ruta}?{self.firma.query_prefirmada('GET', self.host, ruta, segundos)}"
+
+    def sha256(self, nombre: str, path: str = ""):
+        return None
+
+    def tocar(self, nombre: str):
+        pass
+
+    def borrar(self, nombre: str):
+        self._conocidos.pop(nombre, None)
+        r = self._pedir("DELETE", nombre)
+        if r.status_code >= 300 and r.status_code != 404:
+            raise ErrorAlmacen(f"S3 DELETE {nombre}: HTTP {r.status_code}")
+
+    # ---- barrido: solo copias de trabajo que quedaron (conversión fallida, worker muerto)
+    def barrer(self) -> dict:
+        limite, n = time.time() - S3_STAGING_TTL, 0
+        for entry in os.scandir(self.trabajo_dir):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < limite:
+                    os.remove(entry.path); n += 1
+            except OSError:
+                pass
+        return {"staging_removed": n}
+
+    def _loop(self):
+        while not self._detener.wait(min(S3_STAGING_TTL, 600)):
+            try: self.barrer()
+            except Exception: log.exception("Barrido de copias de trabajo falló")
+
+    def arrancar_barrido(self):
+        if self._barrido_pid == os.getpid(): return
+        self._barrido_pid = os.getpid()
+        threading.Thread(target=self._loop, name="almacen-s3-sweeper", daemon=True).start()
+
+    def estado(self) -> dict:
+        return {"backend": "s3", "bucket": self.bucket, "endpoint": self.origen, "prefix": self.prefijo,
+                "files_mode": S3_FILES_MODE, "uploads": self.subidas, "errors": self.errores}
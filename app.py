@@ -1,12 +1,26 @@
 # -*- coding: utf-8 -*-
-import os, re, time, unicodedata, datetime, json, shutil, subprocess, logging, uuid
+import os, io, re, time, datetime, json, shutil, subprocess, logging, threading, uuid
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, send_from_directory
-from twilio.rest import Client
-from twilio.twiml.messaging_response import MessagingResponse
-from docxtpl import DocxTemplate
+from flask import Flask, g, request, jsonify, send_file, Response, stream_with_context
 from werkzeug.utils import secure_filename
-import redis
+import conversor_lo
+import trabajos
+import plantillas
+import pdf_nativo
+import cache_cotizaciones
+import idempotencia
+import almacen
+import despachador
+import flujo
+import twiml
+import sesiones
+import precios
+import clasificacion
+import cotizacion
+import etapas
+import metricas
+import conexiones
 
 logging.basicConfig(level=logging.INFO)
 load_dotenv(override=False)
@@ -19,6 +33,19 @@ ALLOWED_ORIGIN  = os.getenv("CORS_ALLOW_ORIGIN", "*")
 ALLOWED_METHODS = "GET, POST, OPTIONS"
 ALLOWED_HEADERS = "Content-Type, ngrok-skip-browser-warning, Authorization, X-Upload-Token"
 
+# Cada request es una etapa "http:<endpoint>" (histograma, en curso y errores 5xx en /metrics)
+@app.before_request
+def _medir_request():
+    metricas.instalar()     # prometheus_client se importa en el worker, al primer request
+    g.etapa_http = "http:" + (request.endpoint or "not_found")
+    g.t_http = etapas.entrar(g.etapa_http)
+
+@app.after_request
+def _fin_medir_request(resp):
+    if "t_http" in g:
+        etapas.salir(g.etapa_http, g.pop("t_http"), resp.status_code < 500, str(resp.status_code))
+    return resp
+
 @app.after_request
 def add_cors_headers(resp):
     resp.headers["Access-Control-Allow-Origin"]  = ALLOWED_ORIGIN
@@ -41,47 +68,20 @@ def _obtener_redis_url():
     return None
 
 REDIS_URL = _obtener_redis_url()
-_r = None
-
-def _conectar_redis():
-    url = (REDIS_URL or "").strip()
-    if not url:
-        app.logger.info("REDIS_URL no definida. Continuando sin Redis.")
-        return None
-    try:
-        cli = redis.from_url(url, decode_responses=True)
-        cli.ping()
-        app.logger.info("Conectado a Redis correctamente.")
-        return cli
-    except Exception as e:
-        app.logger.warning(f"No se pudo conectar a Redis ({url}): {e}. Continuando sin Redis.")
-        return None
+# Sin timeout un Redis colgado bloquea el webhook; el circuito de sesiones.py cubre el resto
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2"))
 
-_r = _conectar_redis()
+# Se conecta en cada worker al primer uso (ver conexiones.py), no al importar
+_r = conexiones.RedisPorProceso(REDIS_URL, REDIS_SOCKET_TIMEOUT) if REDIS_URL else None
+if _r is None: app.logger.info("REDIS_URL no definida. Continuando sin Redis.")
 
 def _sess_key(form: dict) -> str:
     waid = (form.get("WaId") or "").strip()
     if waid: return waid
     return (form.get("From") or "").replace("whatsapp:", "").strip()
 
-def _sess_get(key: str):
-    if not _r: return None
-    v = _r.get(f"sess:{key}")
-    return json.loads(v) if v else None
-
-def _sess_set(key: str, val: dict, ttl_sec: int = 60*60*12):
-    if not _r: return None
-    _r.set(f"sess:{key}", json.dumps(val), ex=ttl_sec)
-
-def _sess_exists(key: str) -> bool:
-    if not _r: return False
-    return _r.exists(f"sess:{key}") == 1
-
-DEDUP_TTL = 300
-def _dedup_should_process(msg_sid: str) -> bool:
-    if not _r or not msg_sid: return True
-    ok = _r.set(f"dedup:{msg_sid}", "1", nx=True, ex=DEDUP_TTL)
-    return bool(ok)
+# Dedup + carga en un viaje a Redis, guardado único por turno y respaldo en memoria
+_sesiones = sesiones.AlmacenSesiones(_r)
 
 # -----------------------------------------------------------------------------
 # Entorno / Twilio
@@ -98,170 +98,88 @@ BASE_DIR     = os.path.dirname(os.path.abspath(__file__))
 FILES_SUBDIR = (os.getenv("FILES_DIR", "out") or "out").strip()
 FILES_DIR    = os.path.join(BASE_DIR, FILES_SUBDIR)
 os.makedirs(FILES_DIR, exist_ok=True)
+# Disco local (FILES_DIR) o S3 compatible con STORAGE_BACKEND=s3 (ver almacen.crear)
+_almacen = almacen.crear(FILES_DIR)
+# Con S3: enlaces prefirmados directos al bucket en vez de /files/<nombre>
+STORAGE_DIRECT_URLS = (os.getenv("STORAGE_DIRECT_URLS", "false").lower() == "true")
 
 # Plantillas (sin bucles Jinja)
 TEMPLATE_PLAGAS   = os.path.join(BASE_DIR, "templates", "templatescotizacion_plagas.docx")
 TEMPLATE_PISCINAS = os.path.join(BASE_DIR, "templates", "templatescotizacion_piscinas.docx")
 TEMPLATE_CAMARAS  = os.path.join(BASE_DIR, "templates", "templatescotizacion_camaras.docx")
 
+# Con TEMPLATE_PRELOAD=true (y gunicorn --preload) las plantillas compiladas se
+# cargan en el master y los workers las comparten copy-on-write
+if plantillas.PLANTILLAS_PRELOAD:
+    plantillas.cache.precargar((TEMPLATE_PLAGAS, TEMPLATE_PISCINAS, TEMPLATE_CAMARAS))
+    pdf_nativo.calentar((TEMPLATE_PLAGAS, TEMPLATE_PISCINAS, TEMPLATE_CAMARAS))
+
 SEND_PDF    = (os.getenv("SEND_PDF_TO_CLIENT", "true").lower() == "true")
 SEND_DOC    = (os.getenv("SEND_DOC_TO_CLIENT", "false").lower() == "true")
-MEDIA_DELAY = float(os.getenv("MEDIA_DELAY_SECONDS", "1.0"))
+MEDIA_DELAY = float(os.getenv("MEDIA_DELAY_SECONDS", "1.0"))   # ya no se usa para dormir; el orden lo da el despachador
 SEND_COPY_TO_ADMIN = (os.getenv("SEND_COPY_TO_ADMIN", "true").lower() == "true")
+ADMIN_DOCX_LINK    = (os.getenv("ADMIN_DOCX_LINK", "true").lower() == "true")
+# auto: el DOCX se guarda solo si alguien lo va a abrir (SEND_DOC o el enlace al admin); always: siempre
+STORE_DOCX = (os.getenv("STORE_DOCX", "auto") or "auto").strip().lower()
 
-twilio = Client(TW_SID, TW_TOKEN) if (TW_SID and TW_TOKEN) else None
+# El cliente REST (import pesado) se crea por worker junto con el despachador
+TWILIO_CONFIGURED = bool(TW_SID and TW_TOKEN)
+# true: los handlers esperan el SID de Twilio (comportamiento antiguo); false: encolan y siguen
+OUTBOUND_WAIT = (os.getenv("OUTBOUND_WAIT", "false").lower() == "true")
 
 # -----------------------------------------------------------------------------
 # Precios y utilidades
 # -----------------------------------------------------------------------------
-TRAMOS = [(0,50),(51,100),(101,200),(201,300),(301,500),(501,1000),(1001,2000),(2001,9999999)]
-PRECIOS = {
-    "desinsectacion":[37500,47500,65000,80000,105000,165000,270000,440000],
-    "desratizacion": [34000,44000,60000,75000, 97500,150000,235000,375000],
-    "desinfeccion":  [30000,40000,55000,70000, 90000,140000,220000,350000],
-}
-TRAMOS_M3 = [(0,25),(26,50),(51,100),(101,999999)]
-PRECIOS_PISCINA = {
-    "piscina_plan_intermedio_m3":  [3900,3400,3100,2900],
-    "piscina_mantencion_bomba_m3": [3200,3000,2800,2600],
-    "piscina_shock_m3":            [1500,1300,1100,900],
-    "piscina_diagnostico_total":   [30000,35000,40000,45000],
-    "piscina_cambio_arena_total":  [90000,140000,200000,300000],
-}
-CAM_PRECIOS = {
-    "alambricas":   {"interior":70000,"exterior":90000},
-    "inalambricas": {"interior":60000,"exterior":80000},
-    "solares":      {"exterior":150000},
-    "dvr":          {"interior":75000,"exterior":95000},
-}
-
-def _fmt_money_clp(v:int)->str:
-    return f"${v:,}".replace(",", ".")
+# Tablas versionadas en precios.py (Redis / precios.json / incluidas), recarga en caliente
+_precios = precios.Precios(redis_cli=_r)
+
+_fmt_money_clp = cotizacion.fmt_clp
 
 def _descuento_por_cantidad(qty: int) -> float:
-    if qty >= 5: return 0.85
-    if qty >= 3: return 0.90
-    if qty == 2: return 0.95
-    return 1.00
+    return _precios.actual().descuento(qty)
 
 def _infer_area_from_text(txt: str, tipo_camara: str) -> str:
-    if (tipo_camara or "").lower().startswith("sola"): return "exterior"
-    t = (txt or "").lower()
-    exterior_words = ("exterior","patio","jardin","jardín","porton","portón","entrada","estacionamiento","perimetro","perímetro","terraza","muro")
-    return "exterior" if any(w in t for w in exterior_words) else "interior"
+    return "exterior" if clasificacion.clasificar("", tipo_camara, txt).exterior else "interior"
 
 def _canon_tipo_camara(s: str) -> str:
-    s = (s or "").strip().lower()
-    if "dvr" in s or "grabador" in s: return "dvr"
-    if "inalam" in s or "wi fi" in s or "wi-fi" in s or "wifi" in s: return "inalambricas"
-    if "sola" in s: return "solares"
-    return "alambricas"
-
-def _cantidad_aproximada(opcion: str) -> int:
-    t = (opcion or "").lower()
-    if "1" in t and "2" in t: return 2
-    if "3" in t and "5" in t: return 4
-    if "mas" in t or "más" in t or "5" in t: return 6
-    m = re.search(r"\d+", t)
-    return int(m.group(0)) if m else 1
+    return clasificacion.clasificar("", s).tipo_camara
+
+_cantidad_aproximada = cotizacion.cantidad_aproximada
 
 def calcular_total_camaras(tipo_camara_humano: str, area_vigilar: str, cantidad_opcion: str):
-    tipo = _canon_tipo_camara(tipo_camara_humano)
-    qty  = _cantidad_aproximada(cantidad_opcion)
-    area = _infer_area_from_text(area_vigilar, tipo)
-    tabla = CAM_PRECIOS.get(tipo, {})
-    if area not in tabla: area = next(iter(tabla.keys()), "exterior")
-    base_unit = int(tabla[area])
-    unit = int(round(base_unit * _descuento_por_cantidad(qty)))
-    return unit * qty, tipo, qty, unit, area
-
-def _strip_accents_and_symbols(text: str) -> str:
-    t = text or ""
-    t = re.sub(r"[\u2460-\u24FF\u2600-\u27BF\ufe0f\u200d]", "", t)
-    t = "".join(c for c in unicodedata.normalize("NFKD", t) if not unicodedata.combining(c))
-    return re.sub(r"[^a-zA-Z0-9\s]", " ", t).lower().strip()
-
-def _norm(s: str) -> str:
-    if not s: return ""
-    s = s.strip().lower()
-    s = re.sub(r"[\u2460-\u24FF\u2600-\u27BF\ufe0f\u200d]", "", s)
-    s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
-    return re.sub(r"\s+", " ", s).strip()
+    return cotizacion.total_camaras(_precios.actual(), clasificacion.clasificar("", tipo_camara_humano or "", area_vigilar or ""),
+                                    cantidad_opcion)
+
+# Normalización y palabras clave en clasificacion.py (una pasada, memoizado)
+_strip_accents_and_symbols = clasificacion.normalizar
 
 def _dominio_servicio(label: str) -> str:
-    s = _norm(label)
-    if "piscin" in s: return "piscinas"
-    if any(k in s for k in ("plaga","desratiz","desinsect","sanitiz")): return "plagas"
-    if "camar" in s: return "camaras"
-    return "otro"
+    return clasificacion.clasificar(label or "").dominio
 
 def _canon_servicio_para_precios(servicio_humano: str) -> str:
-    s = _strip_accents_and_symbols(servicio_humano)
-    if "desratiz" in s:  return "desratizacion"
-    if "desinfecc" in s: return "desinfeccion"
-    if "desinsect" in s: return "desinsectacion"
-    return "desinsectacion"
+    return clasificacion.clasificar(servicio_humano or "").servicio_precio
 
 def _canon_piscina_key(label: str) -> str:
-    s = _norm(label)
-    if "plan intermedio" in s or ("tratamient" in s and "limpiez" in s): return "piscina_plan_intermedio_m3"
-    if ("bomba" in s) or ("filtro" in s) or ("mantencion" in s):         return "piscina_mantencion_bomba_m3"
-    if ("shock" in s) or ("clor" in s):                                   return "piscina_shock_m3"
-    if ("diagn" in s):                                                    return "piscina_diagnostico_total"
-    if ("arena" in s) or ("carga" in s):                                  return "piscina_cambio_arena_total"
-    return ""
+    return clasificacion.clasificar(label or "").piscina_key
 
 def precio_por_tramo(servicio_precio: str, m2: float) -> int:
-    tabla = PRECIOS.get(servicio_precio)
-    if not tabla: return 0
-    m2n = int(float(m2) if m2 else 0)
-    for idx, (lo, hi) in enumerate(TRAMOS):
-        if lo <= m2n <= hi: return int(tabla[idx])
-    return int(tabla[-1])
-
-def _volumen_estimado_m3(info: dict) -> float:
-    for k in ("m3","volumen","volumen_m3"):
-        v = str(info.get(k, "") or "").strip()
-        if v:
-            try: return float(v.replace(",", "."))
-            except Exception: pass
-    try: m2 = float(info.get("m2") or 0)
-    except Exception: m2 = 0.0
-    try:
-        prof = float(str(info.get("profundidad") or "").replace(",", ".")) if info.get("profundidad") else None
-    except Exception:
-        prof = None
-    if m2 > 0 and prof is not None and prof > 0:
-        return round(m2 * prof, 1)
-    return 0.0
+    return _precios.actual().plaga(servicio_precio, m2)
+
+_volumen_estimado_m3 = cotizacion.volumen_estimado_m3
 
 def _precio_piscina_por_tramo(serv_key: str, m3: float) -> int:
-    if m3 <= 0 and serv_key.endswith("_m3"): return 0
-    tabla = PRECIOS_PISCINA.get(serv_key)
-    if not tabla: return 0
-    idx = len(TRAMOS_M3) - 1
-    for i, (lo, hi) in enumerate(TRAMOS_M3):
-        if lo <= m3 <= hi: idx = i; break
-    if serv_key.endswith("_m3"):
-        unit = tabla[idx]
-        if unit <= 0: return 0
-        return int(round(unit * m3))
-    return int(tabla[idx] or 0)
+    return _precios.actual().piscina(serv_key, m3)
+
+def _cotizacion(info: dict) -> cotizacion.Cotizacion:
+    # Una sola clasificación y consulta de precios por cotización; el resto son proyecciones
+    return cotizacion.calcular(info, _precios.actual())
 
 def precio_total(info: dict) -> int:
-    dominio = _dominio_servicio(info.get("servicio_label",""))
-    if dominio == "piscinas":
-        key = _canon_piscina_key(info.get("servicio_label",""))
-        m3 = _volumen_estimado_m3(info)
-        return _precio_piscina_por_tramo(key, m3)
-    if dominio == "plagas":
-        return precio_por_tramo(info.get("servicio_precio",""), info.get("m2") or 0)
-    if dominio == "camaras":
-        total, _, _, _, _ = calcular_total_camaras(
-            info.get("tipo_camara",""), info.get("area_vigilar",""), info.get("cantidad_camara","")
-        )
-        return total
-    return 0
+    return _cotizacion(info).total
+
+def cotizar(info: dict) -> dict:
+    # Total + líneas de detalle sin generar documentos (POST /price)
+    return _cotizacion(info).a_dict()
 
 def _safe(x):
     if x is None: return ""
@@ -278,8 +196,11 @@ def public_base_from_request():
     host  = request.headers.get("X-Forwarded-Host", request.host)
     return f"{proto}://{host}"
 
-def build_urls(filename_docx: str, filename_pdf: str):
-    public = public_base_from_request().rstrip("/")
+def build_urls(filename_docx: str, filename_pdf: str, public: str = ""):
+    # filename_docx vacío: la cotización se guardó sin DOCX (ver _docx_requerido)
+    if STORAGE_DIRECT_URLS and _almacen.remoto:
+        return (_almacen.url_firmada(filename_docx) if filename_docx else ""), _almacen.url_firmada(filename_pdf)
+    public = (public or public_base_from_request()).rstrip("/")
     docx_url = f"{public}/files/{filename_docx}"
     pdf_url  = f"{public}/files/{filename_pdf}"
     def _bypass(u: str) -> str:
@@ -287,74 +208,98 @@ def build_urls(filename_docx: str, filename_pdf: str):
             sep = "&" if "?" in u else "?"
             return f"{u}{sep}ngrok-skip-browser-warning=true"
         return u
-    return _bypass(docx_url), _bypass(pdf_url)
+    return (_bypass(docx_url) if filename_docx else ""), _bypass(pdf_url)
 
 # -----------------------------------------------------------------------------
 # DOCX -> PDF
 # -----------------------------------------------------------------------------
-try:
-    from docx2pdf import convert as docx2pdf_convert
-except Exception:
-    docx2pdf_convert = None
-try:
-    import pythoncom
-except Exception:
-    pythoncom = None
+# docx2pdf (Word vía COM) solo se usa en Windows; en Linux ni se intenta importar
+docx2pdf_convert = pythoncom = None
+if os.name == "nt":
+    try:
+        from docx2pdf import convert as docx2pdf_convert
+    except Exception:
+        docx2pdf_convert = None
+    try:
+        import pythoncom
+    except Exception:
+        pythoncom = None
 
 def _lo_bin():
-    for name in ("soffice", "libreoffice"):
-        if shutil.which(name):
-            return name
-    return None
+    return conversor_lo.lo_bin()
 
 def convertir_docx_a_pdf_con_lo(docx_path: str, pdf_path: str) -> None:
-    outdir = os.path.dirname(pdf_path)
-    bin_lo = _lo_bin()
-    if not bin_lo:
-        raise RuntimeError("LibreOffice no está disponible en el contenedor.")
-    cmd = [bin_lo, "--headless", "--convert-to", "pdf", "--outdir", outdir, docx_path]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    base_pdf = os.path.splitext(os.path.basename(docx_path))[0] + ".pdf"
-    generated = os.path.join(outdir, base_pdf)
-    if os.path.exists(generated) and generated != pdf_path:
-        os.replace(generated, pdf_path)
-    if not os.path.exists(pdf_path):
-        raise RuntimeError("LibreOffice no generó el PDF")
-
-def convertir_docx_a_pdf(docx_path: str, pdf_path: str) -> None:
-    if os.name == "nt" and docx2pdf_convert is not None:
+    # Instancias LibreOffice persistentes (ver conversor_lo.py); ya no un soffice por cotización
+    conversor_lo.obtener_pool().convertir(docx_path, pdf_path)
+
+def _docx2pdf_bytes(docx: bytes):
+    # Word vía COM necesita archivos: directorio de trabajo efímero, fuera de FILES_DIR
+    with conversor_lo.espacio_trabajo(len(docx)) as d:
+        entrada, salida = os.path.join(d, "cotizacion.docx"), os.path.join(d, "cotizacion.pdf")
+        with open(entrada, "wb") as f: f.write(docx)
         time.sleep(0.2)
         com_init = False
         try:
             if pythoncom is not None:
                 try: pythoncom.CoInitialize(); com_init = True
                 except Exception: pass
-            docx2pdf_convert(docx_path, pdf_path)
+            docx2pdf_convert(entrada, salida)
         finally:
             if com_init:
                 try: pythoncom.CoUninitialize()
                 except Exception: pass
-        if os.path.exists(pdf_path): return
-    convertir_docx_a_pdf_con_lo(docx_path, pdf_path)
+        if not os.path.exists(salida): return None
+        with open(salida, "rb") as f: return f.read()
+
+def convertir_docx_a_pdf(docx: bytes, solo_libre: bool = False) -> bytes:
+    # DOCX en memoria -> PDF en memoria; LibreOffice trabaja en tmpfs (ver conversor_lo.py).
+    # solo_libre: solo con un cupo libre ya, sin hacer cola (ConversorSaturado si no hay)
+    with etapas.medir("convert"):
+        if os.name == "nt" and docx2pdf_convert is not None:
+            pdf = _docx2pdf_bytes(docx)
+            if pdf: return pdf
+        return conversor_lo.obtener_pool().convertir_bytes(docx, solo_libre)
+
+def _pdf_nativo(tpl_path: str, ctx: dict):
+    # PDF del motor nativo (PDF_NATIVE_TEMPLATES), o None -> convertir el DOCX
+    if not pdf_nativo.activo(tpl_path): return None
+    try:
+        with etapas.medir("render_pdf"):
+            return pdf_nativo.generar_bytes(tpl_path, ctx)
+    except Exception as e:
+        logging.warning("PDF nativo falló (%s), se convierte el DOCX: %s", os.path.basename(tpl_path), e)
+        return None
+
+def convertir_lote_docx_a_pdf(docs) -> list:
+    # Un PDF (bytes) o la excepción por DOCX, en orden; una invocación del conversor por lote
+    docs = list(docs)
+    if os.name == "nt" and docx2pdf_convert is not None:
+        res = []
+        for docx in docs:
+            try: res.append(convertir_docx_a_pdf(docx))
+            except Exception as e: res.append(e)
+        return res
+    with etapas.medir("convert_batch"):
+        return conversor_lo.obtener_pool().convertir_lote_bytes(docs)
 
 # -----------------------------------------------------------------------------
 # Render DOCX (SIN BUCLES en las plantillas)
 # -----------------------------------------------------------------------------
-def _select_template_path(info: dict) -> str:
-    dom = _dominio_servicio(info.get("servicio_label",""))
+def _plantilla_dominio(dom: str) -> str:
     if dom == "plagas":   return TEMPLATE_PLAGAS
     if dom == "piscinas": return TEMPLATE_PISCINAS
     if dom == "camaras":  return TEMPLATE_CAMARAS
     return TEMPLATE_PLAGAS
 
-def generar_docx_desde_plantilla(path: str, info: dict)->None:
-    tpl_path = _select_template_path(info)
+def _select_template_path(info: dict) -> str:
+    return _plantilla_dominio(_dominio_servicio(info.get("servicio_label","")))
+
+def _contexto_plantilla(info: dict, q: cotizacion.Cotizacion = None):
+    q = q or _cotizacion(info)
+    tpl_path = _plantilla_dominio(q.dominio)
     if not os.path.exists(tpl_path):
         raise FileNotFoundError(f"Plantilla no encontrada: {tpl_path}")
 
-    dom = _dominio_servicio(info.get("servicio_label",""))
-    total_int = precio_total(info)
-
     # ====== Contexto base para plantillas SIN BUCLE ======
     ctx = {
         "fecha": info["fecha"],
@@ -371,93 +316,94 @@ def generar_docx_desde_plantilla(path: str, info: dict)->None:
         "linea_servicio": "",
         "linea_cantidad": "",
         "linea_total": "",
-        "total": _fmt_money_clp(total_int),
-        "precio": _fmt_money_clp(total_int),
+        "total": q.total_fmt,
+        "precio": q.total_fmt,
     }
 
-    if dom == "plagas":
-        try:
-            m2_val = float(info.get("m2", 0))
-            ctx["m2"] = str(int(m2_val)) if float(m2_val).is_integer() else str(m2_val)
-        except Exception:
-            ctx["m2"] = str(info.get("m2", ""))
-        ctx["descripcion"]   = f"{info['servicio_label']} — {ctx['m2']} m²" if ctx["m2"] else info["servicio_label"]
+    if q.dominio == "plagas":
+        ctx["m2"]             = q.m2_txt
+        ctx["descripcion"]    = f"{info['servicio_label']} — {ctx['m2']} m²" if ctx["m2"] else info["servicio_label"]
         ctx["linea_servicio"] = info["servicio_label"]
         ctx["linea_cantidad"] = "1"
-        ctx["linea_total"]    = _fmt_money_clp(total_int)
+        ctx["linea_total"]    = q.total_fmt
 
-    elif dom == "piscinas":
-        m3_val = _volumen_estimado_m3(info)
-        ctx["m3"] = str(int(m3_val)) if (m3_val and float(m3_val).is_integer()) else (str(m3_val) if m3_val else "")
-        if info.get("m2"):
-            try:
-                m2_val = float(info["m2"])
-                ctx["m2"] = str(int(m2_val)) if float(m2_val).is_integer() else str(m2_val)
-            except Exception:
-                ctx["m2"] = str(info.get("m2",""))
+    elif q.dominio == "piscinas":
+        ctx["m3"] = q.m3_txt
+        if info.get("m2"): ctx["m2"] = q.m2_txt
         ctx["descripcion"]    = f"{info['servicio_label']}" + (f" — {ctx['m2']} m²" if ctx["m2"] else "") + (f" — {ctx['m3']} m³" if ctx["m3"] else "")
         ctx["linea_servicio"] = info["servicio_label"]
         ctx["linea_cantidad"] = "1"
-        ctx["linea_total"]    = _fmt_money_clp(total_int)
-
-    elif dom == "camaras":
-        tot, tipo, qty, unit_ap, area = calcular_total_camaras(
-            info.get("tipo_camara",""), info.get("area_vigilar",""), info.get("cantidad_camara","")
-        )
-        ctx["camaras"]        = f"{info.get('tipo_camara','')} ({area}) x {qty} — {_fmt_money_clp(unit_ap)} c/u"
-        ctx["total"]          = _fmt_money_clp(tot)
-        ctx["precio"]         = _fmt_money_clp(tot)
-        ctx["descripcion"]    = f"{tipo} ({area}) x {qty}"
-        ctx["linea_servicio"] = f"Cámaras {tipo} ({area})"
-        ctx["linea_cantidad"] = str(qty)
-        ctx["linea_total"]    = _fmt_money_clp(qty * unit_ap)
+        ctx["linea_total"]    = q.total_fmt
+
+    elif q.dominio == "camaras":
+        ctx["camaras"]        = f"{info.get('tipo_camara','')} ({q.area}) x {q.cantidad} — {q.unitario_fmt} c/u"
+        ctx["descripcion"]    = f"{q.tipo_camara} ({q.area}) x {q.cantidad}"
+        ctx["linea_servicio"] = f"Cámaras {q.tipo_camara} ({q.area})"
+        ctx["linea_cantidad"] = str(q.cantidad)
+        ctx["linea_total"]    = q.total_fmt
 
     else:
         ctx["descripcion"]    = info["servicio_label"]
         ctx["linea_servicio"] = info["servicio_label"]
         ctx["linea_cantidad"] = "1"
-        ctx["linea_total"]    = _fmt_money_clp(total_int)
+        ctx["linea_total"]    = q.total_fmt
 
-    tpl = DocxTemplate(tpl_path)
-    tpl.render(ctx)
-    tpl.save(path)
+    return tpl_path, ctx
+
+def _render_docx(tpl_path: str, ctx: dict) -> bytes:
+    with etapas.medir("render"):
+        tpl = plantillas.docx_template(tpl_path)
+        tpl.render(ctx)
+        buf = io.BytesIO()
+        tpl.save(buf)
+        return buf.getvalue()
+
+def generar_docx_desde_plantilla(path: str, info: dict)->None:
+    tpl_path, ctx = _contexto_plantilla(info)
+    with open(path, "wb") as f: f.write(_render_docx(tpl_path, ctx))
 
 # -----------------------------------------------------------------------------
 # WhatsApp helpers
 # -----------------------------------------------------------------------------
+_desp = None
+
+def _despachador() -> despachador.Despachador:
+    global _desp
+    if _desp is None or _desp.pid != os.getpid():
+        _desp = despachador.Despachador(despachador.crear_cliente_twilio(TW_SID, TW_TOKEN))
+    return _desp
+
+def usar_despachador(d):
+    # asgi.py instala despachador.DespachadorAsync (mismo contrato encolar() -> Future)
+    global _desp
+    _desp = d
+
+def _resultado_envio(fut, clave_sid: str) -> dict:
+    if not OUTBOUND_WAIT: return {"queued": True}
+    try: return {clave_sid: fut.result(timeout=60)}
+    except Exception as e: return {"error": str(e)}
+
+# `delay` se mantiene por compatibilidad: el orden por destinatario y el rate limit
+# por remitente los maneja el despachador, ya no hay sleeps en el request.
 def send_whatsapp_text(to_wa: str, body: str, delay: float = 0.0):
-    result = {}
-    if not (twilio and TWILIO_ENABLED and to_wa and body):
-        result["warn"] = "twilio_or_params_missing_or_disabled"; return result
-    try:
-        time.sleep(max(0.0, delay))
-        msg = twilio.messages.create(from_=TW_FROM, to=to_wa, body=body)
-        result["sid"] = msg.sid
-    except Exception as e:
-        result["error"] = str(e)
-    return result
+    if not (TWILIO_CONFIGURED and TWILIO_ENABLED and to_wa and body):
+        return {"warn": "twilio_or_params_missing_or_disabled"}
+    return _resultado_envio(_despachador().encolar(TW_FROM, to_wa, body=body), "sid")
 
 def send_whatsapp_media_only_pdf(to_wa: str, caption: str, pdf_url: str, delay: float = 0.0):
-    result = {}
-    if not (twilio and TWILIO_ENABLED and to_wa and pdf_url):
-        result["warn"]="twilio_or_params_missing_or_disabled"; return result
-    try:
-        time.sleep(max(0.0, delay))
-        msg = twilio.messages.create(from_=TW_FROM, to=to_wa, body=caption, media_url=[pdf_url])
-        result["single_msg_sid"] = msg.sid
-    except Exception as e:
-        result["error"] = str(e)
-    return result
+    if not (TWILIO_CONFIGURED and TWILIO_ENABLED and to_wa and pdf_url):
+        return {"warn": "twilio_or_params_missing_or_disabled"}
+    return _resultado_envio(_despachador().encolar(TW_FROM, to_wa, body=caption, media_url=[pdf_url]), "single_msg_sid")
 
 def send_admin_copy(resumen_texto: str, pdf_url: str = "", docx_url: str = ""):
-    if not (ADMIN_WA and TWILIO_ENABLED and twilio):
+    if not (ADMIN_WA and TWILIO_ENABLED and TWILIO_CONFIGURED):
         return {"warn": "admin_or_twilio_not_configured"}
     sids = {}
     if resumen_texto:
         sids["admin_text"] = send_whatsapp_text(ADMIN_WA, "🧾 *Nueva cotización*\n\n" + resumen_texto, delay=0.0)
     if pdf_url:
         sids["admin_pdf"]  = send_whatsapp_media_only_pdf(ADMIN_WA, "📎 PDF de la cotización", pdf_url, delay=MEDIA_DELAY)
-    if docx_url:
+    if docx_url and ADMIN_DOCX_LINK:
         sids["admin_docx"] = send_whatsapp_text(ADMIN_WA, f"📄 DOCX: {docx_url}", delay=MEDIA_DELAY)
     return sids
 
@@ -512,52 +458,121 @@ def _read_payload_any():
     if request.form: return {k:v for k,v in request.form.items()}
     return {}
 
-def handle_generate():
-    payload = _read_payload_any()
-    info = normalize_payload(payload)
-    faltantes = [k for k in ("servicio_label","cliente","direccion","contacto") if not info.get(k)]
-    if faltantes:
-        return jsonify(ok=True, message="Campos mínimos faltantes; no se generan archivos",
-                       missing=faltantes, received=payload), 200
-
-    if not any(os.path.exists(p) for p in (TEMPLATE_PLAGAS, TEMPLATE_PISCINAS, TEMPLATE_CAMARAS)):
-        return jsonify(ok=False, error="template_missing", detail="No se encontraron plantillas DOCX en /templates"), 500
-
-    if (docx2pdf_convert is None) and (not _lo_bin()):
-        return jsonify(ok=False, error="pdf_engine_missing",
-                       detail="No hay Word/docx2pdf ni LibreOffice disponibles para convertir a PDF."), 500
+_cache_cot = cache_cotizaciones.CacheCotizaciones(FILES_DIR, _almacen)
+# Single-flight por cotización (misma clave de caché): quien llega mientras otro la genera
+# (la especulativa del webhook, otro worker) espera ese resultado en vez de convertir de nuevo
+_cot_en_curso = idempotencia.Idempotencia(redis_cli=_r, prefijo="cotgen:", ttl=60)
 
+def _nuevos_nombres():
     ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    uid = uuid.uuid4().hex[:6]
-    base = f"cotizacion_{ts}_{uid}"
-    docx_name, pdf_name = base + ".docx", base + ".pdf"
-    docx_path, pdf_path = os.path.join(FILES_DIR, docx_name), os.path.join(FILES_DIR, pdf_name)
+    base = f"cotizacion_{ts}_{uuid.uuid4().hex[:6]}"
+    return base + ".docx", base + ".pdf"
+
+def _clave_cotizacion(tpl_path: str, ctx: dict) -> str:
+    # El motor entra en la clave: cambiar PDF_NATIVE_TEMPLATES no devuelve PDFs del otro motor
+    motor = ":nativo" if pdf_nativo.activo(tpl_path) else ""
+    return cache_cotizaciones.clave_cotizacion(plantillas.hash_plantilla(tpl_path) + motor, ctx)
+
+def _docx_requerido() -> bool:
+    if STORE_DOCX == "always" or SEND_DOC: return True
+    return (ADMIN_DOCX_LINK and SEND_COPY_TO_ADMIN and bool(ADMIN_WA)
+            and TWILIO_ENABLED and TWILIO_CONFIGURED)
+
+def _buscar_cache(clave: str, con_docx: bool):
+    # Una entrada guardada sin DOCX no sirve si ahora hace falta el DOCX
+    hit = _cache_cot.buscar(clave)
+    return hit if hit and (hit[0] or not con_docx) else None
+
+def _guardar_cotizacion(clave: str, ctx: dict, pdf: bytes, docx=None):
+    # Única escritura de la cotización: el PDF y, si hace falta, el DOCX, directo desde memoria
+    docx_name, pdf_name = _nuevos_nombres()
+    with etapas.medir("store"):
+        _almacen.guardar(pdf_name, io.BytesIO(pdf))
+        if docx is None: docx_name = ""
+        else: _almacen.guardar(docx_name, io.BytesIO(docx))
+    _cache_cot.guardar(clave, docx_name, pdf_name, fecha=ctx.get("fecha", ""))
+    return docx_name, pdf_name
+
+def _generar_archivos(info: dict, progreso=None, q: cotizacion.Cotizacion = None, solo_libre: bool = False):
+    # Misma plantilla + mismo contexto (incluida la fecha) => mismos DOCX/PDF ya generados
+    tpl_path, ctx = _contexto_plantilla(info, q)
+    con_docx = _docx_requerido()
+    with etapas.medir("quote_cache"):
+        clave = _clave_cotizacion(tpl_path, ctx)
+        hit = _buscar_cache(clave, con_docx)
+    if hit:
+        if progreso: progreso("cache")
+        return hit
+
+    def _generar():
+        if progreso: progreso("render")
+        # Con motor nativo el DOCX solo se arma si se va a guardar
+        pdf = _pdf_nativo(tpl_path, ctx)
+        docx = _render_docx(tpl_path, ctx) if (pdf is None or con_docx) else None
+        if pdf is None:
+            if progreso: progreso("convert")
+            pdf = convertir_docx_a_pdf(docx, solo_libre)
+        return list(_guardar_cotizacion(clave, ctx, pdf, docx if con_docx else None))
+    if not idempotencia.IDEMPOTENCY_ENABLED: return tuple(_generar())
+    return tuple(_cot_en_curso.ejecutar(clave, _generar)[0])
+
+def _conversor_saturado(info: dict):
+    # -> segundos para Retry-After si la cotización necesita LibreOffice y no hay cupo ni lugar en cola
+    if pdf_nativo.activo(_select_template_path(info)) or (os.name == "nt" and docx2pdf_convert is not None):
+        return None
+    pool = conversor_lo.obtener_pool()
+    return None if (not pool.bin_lo or pool.hay_lugar()) else pool.admision.reintentar_en()
 
-    try:
-        generar_docx_desde_plantilla(docx_path, info)
-        convertir_docx_a_pdf(docx_path, pdf_path)
-    except Exception as e:
-        return jsonify(ok=False, error="doc_generate_failed", detail=str(e)), 500
+def _respuesta_saturado(segundos: float):
+    return (jsonify(ok=False, error="converter_busy", retry_after=int(segundos),
+                    detail="Hay muchas cotizaciones en proceso, reintenta en unos segundos."),
+            429, {"Retry-After": str(int(segundos))})
 
-    docx_url, pdf_url = build_urls(docx_name, pdf_name)
-    total_int = precio_total(info)
-    total = _fmt_money_clp(total_int)
+def _motor_no_disponible():
+    if not any(os.path.exists(p) for p in (TEMPLATE_PLAGAS, TEMPLATE_PISCINAS, TEMPLATE_CAMARAS)):
+        return "template_missing", "No se encontraron plantillas DOCX en /templates"
+    if (docx2pdf_convert is None) and (not _lo_bin()) and not pdf_nativo.algun_activo():
+        return "pdf_engine_missing", "No hay Word/docx2pdf ni LibreOffice disponibles para convertir a PDF."
+    return None
 
-    dominio = _dominio_servicio(info.get("servicio_label",""))
+_idem = idempotencia.Idempotencia(redis_cli=_r)
+
+def _clave_generate(info: dict, public: str):
+    # -> (clave, huella del pedido); clave None si la idempotencia está apagada
+    if not idempotencia.IDEMPOTENCY_ENABLED: return None, ""
+    huella = idempotencia.huella({"info": info, "public": public})
+    cabecera = request.headers.get("Idempotency-Key") or request.headers.get("X-Idempotency-Key") or ""
+    return idempotencia.clave_de(cabecera, {"huella": huella}), huella
+
+def _generar_idempotente(info: dict, public: str, clave, huella: str = "", progreso=None):
+    # Peticiones idénticas (reintentos, mismo pedido en otro worker/nodo) comparten una generación
+    # -> (resultado, repetido)
+    if not clave: return _procesar_generate(info, public, progreso), False
+    return _idem.ejecutar("generate:" + clave, lambda: _procesar_generate(info, public, progreso), huella,
+                          idempotencia.ttl_de(clave))
+
+def _cabeceras_idem(clave, repetido: bool) -> dict:
+    return {"Idempotent-Replayed": "true" if repetido else "false"} if clave else {}
+
+def _procesar_generate(info: dict, public: str, progreso=None) -> dict:
+    q = _cotizacion(info)
+    docx_name, pdf_name = _generar_archivos(info, progreso=progreso, q=q)
+    docx_url, pdf_url = build_urls(docx_name, pdf_name, public)
+    resumen = _resumen_generate(info, q)
+    if progreso: progreso("send")
+    sids = _enviar_generate(info, resumen, docx_url, pdf_url)
+    return {"resumen": resumen, "docx_url": docx_url, "pdf_url": pdf_url,
+            "to_wa": info.get("to_whatsapp",""), "twilio": sids}
+
+def _resumen_generate(info: dict, q: cotizacion.Cotizacion = None) -> str:
+    q = q or _cotizacion(info)
     medidas_line = ""; detalle_line = ""
-    if dominio == "piscinas":
-        try:
-            vol = _volumen_estimado_m3(info)
-            medidas_line = f"*Superficie:* {info.get('m2',0)} m²" + (f" | *Volumen:* {vol} m³" if vol > 0 else "") + "\n"
-        except Exception:
-            medidas_line = f"*Superficie:* {info.get('m2',0)} m²\n"
-    elif dominio == "plagas":
-        medidas_line = f"*Superficie tratada:* {info.get('m2',0)} m²\n"
-    elif dominio == "camaras":
-        tot, tipo, qty, unit_ap, area = calcular_total_camaras(
-            info.get("tipo_camara",""), info.get("area_vigilar",""), info.get("cantidad_camara","")
-        )
-        detalle_line = f"*Cámaras:* {info.get('tipo_camara','')} ({area}) x {qty} — unit: {_fmt_money_clp(unit_ap)}\n"
+    if q.dominio == "piscinas":
+        medidas_line = f"*Superficie:* {q.m2_txt} m²" + (f" | *Volumen:* {q.m3_txt} m³" if q.m3 > 0 else "") + "\n"
+    elif q.dominio == "plagas":
+        medidas_line = f"*Superficie tratada:* {q.m2_txt} m²\n"
+    elif q.dominio == "camaras":
+        detalle_line = f"*Cámaras:* {info.get('tipo_camara','')} ({q.area}) x {q.cantidad} — unit: {q.unitario_fmt}\n"
 
     partes = [
         "✅ *Nueva solicitud recibida*\n",
@@ -569,9 +584,10 @@ def handle_generate():
     ]
     if info.get("comuna"): partes.append(f"*Comuna:* {info['comuna']}\n")
     partes.extend([f"*Detalles:* {info.get('detalles','')}\n",
-                   f"*Contacto:* {info['contacto']} | {info['email']}\n", f"*Total:* {total}"])
-    resumen = "".join(partes)
+                   f"*Contacto:* {info['contacto']} | {info['email']}\n", f"*Total:* {q.total_fmt}"])
+    return "".join(partes)
 
+def _enviar_generate(info: dict, resumen: str, docx_url: str, pdf_url: str) -> dict:
     sids = {}
     if info.get("to_whatsapp") and SEND_PDF:
         sids["client_pdf"] = send_whatsapp_media_only_pdf(info["to_whatsapp"], "📎 Cotización adjunta", pdf_url, MEDIA_DELAY)
@@ -580,9 +596,179 @@ def handle_generate():
 
     if SEND_COPY_TO_ADMIN and ADMIN_WA:
         sids["admin"] = send_admin_copy(resumen, pdf_url, docx_url)
+    return sids
 
-    return jsonify(ok=True, resumen=resumen, docx_url=docx_url, pdf_url=pdf_url,
-                   to_wa=info.get("to_whatsapp",""), twilio=sids), 200
+GENERATE_MODE = (os.getenv("GENERATE_MODE", "async") or "async").strip().lower()   # async | sync
+
+def _generate_sincrono(request_args) -> bool:
+    if GENERATE_MODE == "sync": return True
+    return (request_args.get("sync") or request_args.get("wait") or "").lower() in ("1", "true", "yes")
+
+def handle_generate():
+    payload = _read_payload_any()
+    info = normalize_payload(payload)
+    faltantes = [k for k in ("servicio_label","cliente","direccion","contacto") if not info.get(k)]
+    if faltantes:
+        return jsonify(ok=True, message="Campos mínimos faltantes; no se generan archivos",
+                       missing=faltantes, received=payload), 200
+
+    falta_motor = _motor_no_disponible()
+    if falta_motor:
+        return jsonify(ok=False, error=falta_motor[0], detail=falta_motor[1]), 500
+
+    public = public_base_from_request()
+    clave, huella = _clave_generate(info, public)
+    if _generate_sincrono(request.args):
+        # Cola del conversor llena: rechazar antes de renderizar
+        espera = _conversor_saturado(info)
+        if espera: return _respuesta_saturado(espera)
+        try:
+            res, repetido = _generar_idempotente(info, public, clave, huella)
+        except conversor_lo.ConversorSaturado as e:
+            return _respuesta_saturado(e.reintentar_en)
+        except idempotencia.ClaveReutilizada:
+            return jsonify(ok=False, error="idempotency_key_reused",
+                           detail="La Idempotency-Key ya se usó con otro pedido."), 422
+        except idempotencia.EsperaAgotada:
+            return jsonify(ok=False, error="generation_in_progress",
+                           detail="Ya se está generando esta cotización, reintenta en unos segundos."), 409, {"Retry-After": "5"}
+        except Exception as e:
+            return jsonify(ok=False, error="doc_generate_failed", detail=str(e)), 500
+        return jsonify(ok=True, **res), 200, _cabeceras_idem(clave, repetido)
+
+    previo = _idem.obtener("generate:" + clave) if clave else None
+    if previo and previo.get("huella") and previo["huella"] != huella:
+        return jsonify(ok=False, error="idempotency_key_reused", detail="La Idempotency-Key ya se usó con otro pedido."), 422
+    try:
+        # Con clave, el id del trabajo sale de ella: un reintento recibe el mismo job_id
+        job = _cola_trabajos().encolar("generate", {"info": info, "public": public, "clave": clave, "huella": huella},
+                                       job_id=idempotencia.huella(clave)[:32] if clave else "",
+                                       ventana=idempotencia.ttl_de(clave) if clave else 0)
+    except trabajos.ColaLlena:
+        return jsonify(ok=False, error="queue_full", detail="Cola de cotizaciones llena, reintenta en unos segundos."), 503, {"Retry-After": "10"}
+    except trabajos.ColaNoDisponible:
+        return jsonify(ok=False, error="queue_unavailable", detail="Cola de cotizaciones no disponible, reintenta en unos segundos."), 503, {"Retry-After": "10"}
+    return jsonify(ok=True, job_id=job["id"], status=job["estado"],
+                   status_url=f"{public.rstrip('/')}/jobs/{job['id']}"), 202, _cabeceras_idem(clave, job.get("repetido", False))
+
+# -----------------------------------------------------------------------------
+# Lote: JSONL -> render en paralelo -> PDF por tandas (una invocación por tanda)
+# -----------------------------------------------------------------------------
+BATCH_CHUNK_SIZE     = max(1, int(os.getenv("BATCH_CHUNK_SIZE", "20")))
+BATCH_RENDER_WORKERS = max(1, int(os.getenv("BATCH_RENDER_WORKERS", "4")))
+
+def leer_jsonl(lineas):
+    for n, linea in enumerate(lineas, 1):
+        linea = (linea.decode("utf-8") if isinstance(linea, bytes) else linea).strip()
+        if not linea: continue
+        try: d = json.loads(linea)
+        except Exception as e:
+            yield n, None, f"invalid_json: {e}"; continue
+        if isinstance(d, dict): yield n, d, None
+        else: yield n, None, "not_an_object"
+
+def _resultado_lote(linea: int, info: dict, q: cotizacion.Cotizacion, docx_name: str, pdf_name: str,
+                    public: str, enviar: bool, cached: bool) -> dict:
+    docx_url, pdf_url = build_urls(docx_name, pdf_name, public)
+    res = {"line": linea, "ok": True, "cached": cached, "docx_url": docx_url, "pdf_url": pdf_url,
+           "total": q.total_fmt, "to_wa": info.get("to_whatsapp","")}
+    if enviar:
+        res["twilio"] = _enviar_generate(info, _resumen_generate(info, q), docx_url, pdf_url)
+    return res
+
+def _procesar_tanda(tanda, public: str, enviar: bool, pool: ThreadPoolExecutor):
+    # tanda: [(linea, info, q, tpl_path, ctx, clave)]; los documentos de la tanda viven en memoria
+    con_docx = _docx_requerido()
+    def _render(item):
+        tpl_path, ctx = item[3], item[4]
+        # Con motor nativo el PDF sale acá mismo y no entra al lote de LibreOffice
+        pdf = _pdf_nativo(tpl_path, ctx)
+        return pdf, (_render_docx(tpl_path, ctx) if (pdf is None or con_docx) else None)
+    renderizados = []
+    for item, fut in [(it, pool.submit(_render, it)) for it in tanda]:
+        try: renderizados.append((item, *fut.result()))
+        except Exception as e: yield {"line": item[0], "ok": False, "error": "doc_generate_failed", "detail": str(e)}
+    pendientes = [i for i, (_, pdf, _) in enumerate(renderizados) if pdf is None]
+    try:
+        convertidos = convertir_lote_docx_a_pdf(renderizados[i][2] for i in pendientes) if pendientes else []
+    except Exception as e:
+        convertidos = [e] * len(pendientes)
+    pdfs = dict(zip(pendientes, convertidos))
+    for i, ((linea, info, q, tpl_path, ctx, clave), pdf, docx) in enumerate(renderizados):
+        pdf = pdfs.get(i, pdf)
+        if isinstance(pdf, Exception):
+            yield {"line": linea, "ok": False, "error": "pdf_convert_failed", "detail": str(pdf)}; continue
+        try:
+            docx_name, pdf_name = _guardar_cotizacion(clave, ctx, pdf, docx if con_docx else None)
+        except Exception as e:
+            yield {"line": linea, "ok": False, "error": "store_failed", "detail": str(e)}; continue
+        yield _resultado_lote(linea, info, q, docx_name, pdf_name, public, enviar, cached=False)
+
+def generar_lote(items, public: str, enviar: bool = False, chunk_size: int = BATCH_CHUNK_SIZE,
+                 workers: int = BATCH_RENDER_WORKERS):
+    # items: (linea, payload, error) como los produce leer_jsonl; genera un dict por ítem
+    tanda = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-render") as pool:
+        for linea, payload, err in items:
+            if err:
+                yield {"line": linea, "ok": False, "error": err}; continue
+            info = normalize_payload(payload)
+            faltantes = [k for k in ("servicio_label","cliente","direccion","contacto") if not info.get(k)]
+            if faltantes:
+                yield {"line": linea, "ok": False, "error": "missing_fields", "missing": faltantes}; continue
+            try:
+                q = _cotizacion(info)
+                tpl_path, ctx = _contexto_plantilla(info, q)
+                clave = _clave_cotizacion(tpl_path, ctx)
+            except Exception as e:
+                yield {"line": linea, "ok": False, "error": "doc_generate_failed", "detail": str(e)}; continue
+            hit = _buscar_cache(clave, _docx_requerido())
+            if hit:
+                yield _resultado_lote(linea, info, q, hit[0], hit[1], public, enviar, cached=True); continue
+            tanda.append((linea, info, q, tpl_path, ctx, clave))
+            if len(tanda) >= chunk_size:
+                yield from _procesar_tanda(tanda, public, enviar, pool); tanda = []
+        if tanda:
+            yield from _procesar_tanda(tanda, public, enviar, pool)
+
+def handle_generate_batch():
+    falta_motor = _motor_no_disponible()
+    if falta_motor:
+        return jsonify(ok=False, error=falta_motor[0], detail=falta_motor[1]), 500
+    public = public_base_from_request()
+    enviar = (request.args.get("send") or "").lower() in ("1", "true", "yes")
+    if request.files:
+        f = next(iter(request.files.values()))
+        lineas = f.stream.read().splitlines()
+    else:
+        lineas = (request.get_data() or b"").splitlines()
+    def _stream():
+        for res in generar_lote(leer_jsonl(lineas), public, enviar=enviar):
+            yield json.dumps(res, ensure_ascii=False) + "\n"
+    return Response(stream_with_context(_stream()), mimetype="application/x-ndjson")
+
+# -----------------------------------------------------------------------------
+# Cola de trabajos (render + PDF + envío fuera del request)
+# -----------------------------------------------------------------------------
+_cola = None
+
+def _cola_trabajos() -> trabajos.ColaTrabajos:
+    global _cola
+    if _cola is None or _cola.pid != os.getpid():
+        # Cliente ya resuelto: si Redis no responde al arrancar el worker, cola local (como antes)
+        cli = _r.cliente() if _r is not None else None
+        # BLMOVE con su propio cliente: con REDIS_SOCKET_TIMEOUT el socket vencería antes que el comando
+        _cola = trabajos.ColaTrabajos(redis_cli=cli, redis_bloqueo=_r.bloqueante(trabajos.ESPERA_COLA).cliente() if cli is not None else None)
+        _cola.registrar("generate", lambda p, progreso: _generar_idempotente(
+            p["info"], p["public"], p.get("clave"), p.get("huella", ""), progreso)[0])
+        _cola.registrar("webhook_estimate", _trabajo_estimado_webhook)
+    return _cola
+
+@app.before_request
+def _arrancar_trabajos():
+    # Con JOBS_BACKEND=redis cada worker debe consumir aunque no haya encolado nada
+    _cola_trabajos().arrancar()
+    _almacen.arrancar_barrido()
 
 # -----------------------------------------------------------------------------
 # Rutas básicas
@@ -590,15 +776,106 @@ def handle_generate():
 @app.get("/")
 @app.get("/redis-ping")
 def redis_ping():
-    if not _r: return jsonify(ok=False, error="redis_disabled_or_unconfigured"), 503
+    if _r is None: return jsonify(ok=False, error="redis_disabled_or_unconfigured"), 503
     try: return jsonify(ok=True, pong=_r.ping()), 200
     except Exception as e: return jsonify(ok=False, error=str(e)), 500
 
+@app.get("/stages")
+def stages():
+    # Tiempos por etapa de este proceso (ver etapas.py); lo usa bench/carga.py
+    return jsonify(ok=True, pid=os.getpid(), stages=etapas.resumen()), 200
+
+@app.get("/metrics")
+def metrics():
+    # Formato de texto Prometheus, sumado entre workers de gunicorn (ver metricas.py)
+    if not metricas.disponible():
+        return jsonify(ok=False, error="prometheus_client_not_installed"), 503
+    return Response(metricas.exponer(), 200, {"Content-Type": metricas.CONTENT_TYPE})
+
+@app.post("/stages/reset")
+def stages_reset():
+    etapas.reiniciar()
+    return jsonify(ok=True, pid=os.getpid()), 200
+
 @app.get("/health")
-def health(): return jsonify(ok=True, service="smartplagas-bot", time=datetime.datetime.utcnow().isoformat()+"Z")
+def health():
+    pool = conversor_lo.obtener_pool()
+    pool.arrancar()
+    ready = pool.listo() or (os.name == "nt" and docx2pdf_convert is not None)
+    status = 503 if (request.args.get("ready") and not ready) else 200
+    return jsonify(ok=True, service="smartplagas-bot", time=datetime.datetime.utcnow().isoformat()+"Z",
+                   ready=ready, converter=pool.estado(), templates=plantillas.cache.estado(),
+                   quote_cache=_cache_cot.estado(), storage=_almacen.estado(),
+                   outbound=_despachador().estado(), sessions=_sesiones.estado(), idempotency=_idem.estado(),
+                   prices=_precios.estado(), speculative=_estado_especulativo()), status
+
+# Nombres de escritura única (cotizacion_<ts>_<uid>.*): nunca cambian de contenido -> immutable
+_NOMBRE_INMUTABLE = re.compile(r"^cotizacion_\d{8}_\d{6}_[0-9a-f]{6}\.(pdf|docx)$")
+FILES_MAX_AGE_IMMUTABLE = int(os.getenv("FILES_MAX_AGE_IMMUTABLE", str(60*60*24*30)))
+FILES_MAX_AGE           = int(os.getenv("FILES_MAX_AGE", "300"))
+# none | x-accel (nginx: X-Accel-Redirect) | x-sendfile (Apache/lighttpd: X-Sendfile)
+FILES_OFFLOAD       = (os.getenv("FILES_OFFLOAD", "none") or "none").strip().lower()
+FILES_ACCEL_PREFIX  = (os.getenv("FILES_ACCEL_PREFIX", "/_files_internal/") or "/").rstrip("/") + "/"
 
 @app.route("/files/<path:filename>")
-def files(filename): return send_from_directory(FILES_DIR, filename, as_attachment=False)
+def files(filename):
+    if _almacen.remoto: return _files_remoto(filename)
+    # El índice del almacén resuelve nombre -> shard; los archivos planos antiguos siguen sirviéndose
+    path = _almacen.ruta(filename)
+    if not path: return jsonify(ok=False, error="not_found"), 404
+    _almacen.tocar(filename)
+    etag = _almacen.sha256(filename, path)
+    inmutable = bool(_NOMBRE_INMUTABLE.match(os.path.basename(path)))
+
+    if etag and request.if_none_match.contains(etag):
+        # If-None-Match se evalúa antes que Range (RFC 9110 §13.2.2): 304 aunque pidan un rango
+        resp = Response(status=304)
+    elif FILES_OFFLOAD in ("x-accel", "x-sendfile"):
+        # El proxy entrega los bytes (y los rangos)
+        resp = Response(status=200)
+        if FILES_OFFLOAD == "x-accel":
+            rel = os.path.relpath(path, FILES_DIR).replace(os.sep, "/")
+            resp.headers["X-Accel-Redirect"] = FILES_ACCEL_PREFIX + rel
+        else:
+            resp.headers["X-Sendfile"] = path
+        resp.mimetype = almacen.mimetype(path)
+    else:
+        # send_file: Range/If-None-Match/If-Modified-Since; cuerpo vía wsgi.file_wrapper (sendfile en gunicorn)
+        resp = send_file(path, mimetype=almacen.mimetype(path), conditional=True, etag=etag or True)
+    if etag: resp.set_etag(etag)
+    return _cache_files(resp, inmutable)
+
+def _cache_files(resp, inmutable: bool):
+    resp.cache_control.no_cache = None
+    resp.cache_control.public = True
+    resp.cache_control.max_age = FILES_MAX_AGE_IMMUTABLE if inmutable else FILES_MAX_AGE
+    if inmutable: resp.cache_control.immutable = True
+    return resp
+
+_CABECERAS_S3 = ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges", "ETag", "Last-Modified")
+
+def _files_remoto(filename: str):
+    # S3: redirección a una URL prefirmada (los bytes no pasan por el worker) o proxy en streaming
+    import almacen_s3
+    if not almacen.nombre_publico(filename): return jsonify(ok=False, error="not_found"), 404
+    inmutable = bool(_NOMBRE_INMUTABLE.match(os.path.basename(filename)))
+    if almacen_s3.S3_FILES_MODE == "redirect":
+        if not _almacen.existe(filename): return jsonify(ok=False, error="not_found"), 404
+        resp = Response(status=302, headers={"Location": _almacen.url_firmada(filename)})
+        # La URL firmada vence: la redirección se cachea mucho menos que el archivo
+        resp.cache_control.private = True
+        resp.cache_control.max_age = min(FILES_MAX_AGE, almacen_s3.S3_PRESIGN_SECONDS // 2)
+        return resp
+    cond = {k: request.headers[k] for k in ("Range", "If-None-Match", "If-Modified-Since", "If-Range") if k in request.headers}
+    up = _almacen.abrir(filename, cond)
+    if up.status_code in (403, 404):
+        up.close(); return jsonify(ok=False, error="not_found"), 404
+    if up.status_code >= 400:
+        up.close(); return jsonify(ok=False, error="storage_error", status=up.status_code), 502
+    resp = Response(up.iter_content(almacen_s3.TROZO), status=up.status_code, direct_passthrough=True,
+                    headers={k: up.headers[k] for k in _CABECERAS_S3 if k in up.headers})
+    resp.call_on_close(up.close)
+    return _cache_files(resp, inmutable)
 
 # -----------------------------------------------------------------------------
 # /generate (REST)
@@ -606,6 +883,58 @@ def files(filename): return send_from_directory(FILES_DIR, filename, as_attachme
 @app.post("/generate")
 def generate(): return handle_generate()
 
+@app.post("/generate/batch")
+def generate_batch(): return handle_generate_batch()
+
+# -----------------------------------------------------------------------------
+# Precios al instante (sin documentos): un objeto, una lista o {"items": [...]}
+# -----------------------------------------------------------------------------
+PRICE_BATCH_MAX = int(os.getenv("PRICE_BATCH_MAX", "10000"))
+_CAMPOS_PRECIO = ("tipo_camara", "cantidad_camara", "area_vigilar", "m3", "volumen", "volumen_m3",
+                  "profundidad", "tamano_piscina")
+
+def _info_precio(payload: dict) -> dict:
+    info = normalize_payload(payload)
+    for k in _CAMPOS_PRECIO:
+        if payload.get(k) not in (None, ""): info[k] = _safe(payload[k])
+    if not info["m2"] and info.get("tamano_piscina"): info["m2"] = _parse_piscina_to_m2(info["tamano_piscina"])
+    return info
+
+def _precio_item(payload) -> dict:
+    if not isinstance(payload, dict): return {"ok": False, "error": "invalid_item"}
+    try: return {"ok": True, **cotizar(_info_precio(payload))}
+    except Exception as e: return {"ok": False, "error": "price_failed", "detail": str(e)}
+
+@app.post("/price")
+def price():
+    payload = request.get_json(silent=True)
+    if payload is None: payload = _read_payload_any()
+    lote = payload.get("items") if isinstance(payload, dict) else payload
+    if not isinstance(lote, list):
+        res = _precio_item(payload)
+        return jsonify(res), 200 if res["ok"] else 400
+    if len(lote) > PRICE_BATCH_MAX:
+        return jsonify(ok=False, error="batch_too_large", max=PRICE_BATCH_MAX), 413
+    res = [_precio_item(x) for x in lote]
+    return jsonify(ok=True, count=len(res), price_version=_precios.actual().version, results=res), 200
+
+@app.post("/reload-prices")
+def reload_prices():
+    try:
+        return jsonify(ok=True, **_precios.recargar(forzar=True).estado()), 200
+    except precios.TablasInvalidas as e:
+        return jsonify(ok=False, error="invalid_price_tables", details=e.errores), 400
+    except Exception as e:
+        return jsonify(ok=False, error=str(e)), 500
+
+@app.get("/jobs/<job_id>")
+def job_status(job_id):
+    job = _cola_trabajos().obtener(job_id)
+    if not job: return jsonify(ok=False, error="job_not_found"), 404
+    return jsonify(ok=True, job_id=job["id"], status=job.get("estado"), progress=job.get("progreso"),
+                   attempts=job.get("intentos"), result=job.get("resultado"), error=job.get("error"),
+                   created=job.get("creado"), updated=job.get("actualizado")), 200
+
 # -----------------------------------------------------------------------------
 # /upload único (con token)
 # -----------------------------------------------------------------------------
@@ -626,48 +955,50 @@ def upload_pdf():
     if not f or not f.filename:
         return jsonify(ok=False, error="missing file"), 400
 
-    os.makedirs(FILES_DIR, exist_ok=True)
     safe_name = secure_filename(f.filename or "archivo.pdf")
     ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     out_name = f"{ts}_{safe_name}"
-    out_path = os.path.join(FILES_DIR, out_name)
-    f.save(out_path)
+    try:
+        # Desde el archivo temporal de werkzeug al disco o al bucket, en trozos
+        _almacen.guardar(out_name, f.stream)
+    except Exception as e:
+        return jsonify(ok=False, error="storage_failed", detail=str(e)), 502
 
-    public = public_base_from_request().rstrip("/")
-    url = f"{public}/files/{out_name}"
+    if STORAGE_DIRECT_URLS and _almacen.remoto:
+        url = _almacen.url_firmada(out_name)
+    else:
+        url = f"{public_base_from_request().rstrip('/')}/files/{out_name}"
     return jsonify(ok=True, url=url, saved=out_name), 200
 
 # -----------------------------------------------------------------------------
-# Webhook Twilio (flujo) — sin cambios funcionales relevantes aquí
+# Webhook Twilio (flujo compilado, ver flujo.py)
 # -----------------------------------------------------------------------------
 FLOW_PATH = os.path.join(BASE_DIR, "chatbot-flujo.json")
 FLOW_ENABLED = True
 FLOW, FLOW_INDEX, FIRST_NODE_ID = [], {}, None
+FLUJO = flujo.Flujo({}, None)
 
 def _load_flow():
-    global FLOW, FLOW_INDEX, FIRST_NODE_ID
-    FLOW_INDEX.clear(); FLOW[:] = []
+    # Compila primero y reemplaza después: si el JSON es inválido se conserva el flujo anterior
+    global FLOW, FLOW_INDEX, FIRST_NODE_ID, FLUJO
+    raw = []
     if os.path.exists(FLOW_PATH):
-        with open(FLOW_PATH, "r", encoding="utf-8") as f: FLOW[:] = json.load(f)
-        for node in FLOW: FLOW_INDEX[str(node.get("id"))] = node
-        FIRST_NODE_ID = str(FLOW[0]["id"]) if FLOW else None
+        with open(FLOW_PATH, "r", encoding="utf-8") as f: raw = json.load(f)
+    compilado = flujo.compilar(raw)
+    FLOW = raw
+    FLOW_INDEX = {str(node.get("id")): node for node in raw}
+    FLUJO, FIRST_NODE_ID = compilado, compilado.primero
 _load_flow()
 
 def _render_template_text(text:str, data:dict)->str:
     def repl(m): return str(data.get(m.group(1).strip(),""))
     return re.sub(r"\{([^}]+)\}", repl, text or "")
 
-def _reply(resp: MessagingResponse, text:str):
+def _reply(resp: twiml.Respuesta, text:str):
     if text: resp.message(text)
 
 def _present_options(node):
-    opts = node.get("options",[]) or []
-    lines=[]
-    for i,opt in enumerate(opts,1):
-        t=(opt.get("text","") or "").strip()
-        if not re.match(r"^\d", t): t=f"{i}. {t}"
-        lines.append(t)
-    return "\n".join(lines)
+    return flujo.presentar_opciones(node.get("options",[]))
 
 def _clean_option_text(t:str)->str:
     t=t.strip(); t=re.sub(r"^[0-9\W_]+","",t).strip(); return t
@@ -687,6 +1018,11 @@ def _parse_piscina_to_m2(tamano:str)->float:
     a=float(m.group(1).replace(",", ".")); b=float(m.group(2).replace(",", "."))
     return round(a*b,1)
 
+# Variables del flujo que cambian el precio y las que, además, aparecen en el documento
+_VARS_PRECIO = frozenset(("servicio", "subservicio", "m2", "rango_m2", "tamano_piscina", "profundidad",
+                          "tipo_camara", "cantidad_camara", "area_vigilar"))
+_VARS_DOCUMENTO = _VARS_PRECIO | {"nombre", "direccion", "comuna", "email"}
+
 def _session_info_to_generator_fields(data:dict, from_wa:str)->dict:
     base=(data.get("servicio") or "").strip()
     sub =(data.get("subservicio") or "").strip()
@@ -719,73 +1055,219 @@ def _session_info_to_generator_fields(data:dict, from_wa:str)->dict:
     }
     return info
 
-def _send_estimate_and_files(resp, info, resumen_breve=""):
+def _send_estimate_and_files(resp, info, resumen_breve="", estimado_id: str = ""):
     if not any(os.path.exists(p) for p in (TEMPLATE_PLAGAS, TEMPLATE_PISCINAS, TEMPLATE_CAMARAS)):
         _reply(resp, "⚠️ No se encontraron plantillas de cotización."); return
-    if (docx2pdf_convert is None) and (not _lo_bin()):
+    if (docx2pdf_convert is None) and (not _lo_bin()) and not pdf_nativo.algun_activo():
         _reply(resp, "⚠️ No hay motor de PDF disponible (Word/docx2pdf o LibreOffice)."); return
-
-    ts=datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    base=f"cotizacion_{ts}"
-    docx_name, pdf_name = base+".docx", base+".pdf"
-    docx_path, pdf_path = os.path.join(FILES_DIR, docx_name), os.path.join(FILES_DIR, pdf_name)
+    # Respondemos a Twilio de inmediato; el estimado y el PDF salen por la API cuando estén listos
     try:
-        generar_docx_desde_plantilla(docx_path, info)
-        convertir_docx_a_pdf(docx_path, pdf_path)
-    except Exception as e:
-        _reply(resp, "⚠️ No pude generar tu documento: "+str(e)); return
-
-    docx_url, pdf_url = build_urls(docx_name, pdf_name)
-    total_int = precio_total(info); total_txt = _fmt_money_clp(total_int)
+        _cola_trabajos().encolar("webhook_estimate", {"info": info, "public": public_base_from_request(),
+                                                      "estimado": estimado_id})
+    except (trabajos.ColaLlena, trabajos.ColaNoDisponible):
+        _reply(resp, "⚠️ Tenemos mucha demanda en este momento. Escribe *reiniciar* en unos minutos."); return
+    if _conversor_saturado(info):
+        # El trabajo espera su turno en el conversor (trabajos.py no gasta intentos)
+        _reply(resp, "⏳ Tenemos muchas solicitudes en este momento. Tu cotización ya está en fila y te la envío apenas esté lista 🙏")
+        return
+    _reply(resp, "⏳ Estoy preparando tu cotización, te la envío en unos segundos…")
+
+def _procesar_estimado_webhook(info: dict, public: str, progreso=None) -> dict:
+    q = _cotizacion(info)
+    docx_name, pdf_name = _generar_archivos(info, progreso=progreso, q=q)
+    docx_url, pdf_url = build_urls(docx_name, pdf_name, public)
 
-    dominio = _dominio_servicio(info.get("servicio_label",""))
     medidas_txt = ""; detalle_line = ""
-    try:
-        if dominio == "piscinas":
-            prof = float(str(info.get("profundidad","") or "0").replace(",", ".")) if str(info.get("profundidad","")).strip() else 0.0
-            if prof > 0 and float(info.get("m2",0)) > 0:
-                vol_calc = round(float(info["m2"]) * prof, 1)
-                medidas_txt = f"💧 *Volumen estimado:* {vol_calc} m³\n🧱 *Superficie:* {info.get('m2', 0)} m²\n"
-            else:
-                medidas_txt = f"🧱 *Superficie:* {info.get('m2', 0)} m²\n"
-        elif dominio == "plagas":
-            medidas_txt = f"🏠 *Superficie tratada:* {info.get('m2', 0)} m²\n"
-        elif dominio == "camaras":
-            tot, tipo, qty, unit_ap, area = calcular_total_camaras(
-                info.get("tipo_camara",""), info.get("area_vigilar",""), info.get("cantidad_camara",""),
-            )
-            detalle_line = f"*Cámaras:* {info.get('tipo_camara','')} ({area}) x {qty}  — unit: {_fmt_money_clp(unit_ap)}\n"
-    except Exception:
-        pass
+    if q.dominio == "piscinas":
+        medidas_txt = (f"💧 *Volumen estimado:* {q.m3_txt} m³\n" if q.m3 > 0 else "") + f"🧱 *Superficie:* {q.m2_txt} m²\n"
+    elif q.dominio == "plagas":
+        medidas_txt = f"🏠 *Superficie tratada:* {q.m2_txt} m²\n"
+    elif q.dominio == "camaras":
+        detalle_line = f"*Cámaras:* {info.get('tipo_camara','')} ({q.area}) x {q.cantidad}  — unit: {q.unitario_fmt}\n"
 
     detalle_p=f"\n🧮 Tamaño piscina: {info['tamano_piscina']}" if info.get("tamano_piscina") else ""
     msg=(f"📄 He preparado tu estimado.\n"
          f"*Servicio:* {info['servicio_label']}{detalle_p}\n"
          f"{detalle_line}{medidas_txt}"
-         f"💵 *Estimado:* {total_txt} CLP\n"
+         f"💵 *Estimado:* {q.total_fmt} CLP\n"
          f"_Vigencia 7 días. Sujeto a visita técnica._\n\n"
          f"📎 *PDF:* {pdf_url}\n")
     if SEND_DOC: msg += f"📄 *DOCX:* {docx_url}\n\n"
-    _reply(resp, msg)
 
+    if progreso: progreso("send")
+    sids = {}
+    if info.get("to_whatsapp"):
+        sids["client_text"] = send_whatsapp_text(info["to_whatsapp"], msg)
     if SEND_PDF and info.get("to_whatsapp"):
-        send_whatsapp_media_only_pdf(info["to_whatsapp"], "📎 Cotización adjunta", pdf_url, MEDIA_DELAY)
+        sids["client_pdf"] = send_whatsapp_media_only_pdf(info["to_whatsapp"], "📎 Cotización adjunta", pdf_url, MEDIA_DELAY)
         if SEND_DOC: send_whatsapp_text(info["to_whatsapp"], f"📄 DOCX: {docx_url}", delay=MEDIA_DELAY)
 
-    if dominio == "piscinas": medida_admin = f" | m²: {info.get('m2',0)}"
-    elif dominio == "plagas":  medida_admin = f" | m² tratados: {info.get('m2',0)}"
-    elif dominio == "camaras":
-        tot, tipo, qty, unit_ap, area = calcular_total_camaras(
-            info.get("tipo_camara",""), info.get("area_vigilar",""), info.get("cantidad_camara",""),
-        )
-        medida_admin = f" | cámaras: {info.get('tipo_camara','')} ({area}) x {qty} unit:{_fmt_money_clp(unit_ap)}"
+    if q.dominio == "piscinas": medida_admin = f" | m²: {q.m2_txt}"
+    elif q.dominio == "plagas":  medida_admin = f" | m² tratados: {q.m2_txt}"
+    elif q.dominio == "camaras":
+        medida_admin = f" | cámaras: {info.get('tipo_camara','')} ({q.area}) x {q.cantidad} unit:{q.unitario_fmt}"
     else: medida_admin = ""
     resumen_admin=(f"👤 Cliente: {info.get('contacto','')} | {info.get('email','')} | {info.get('telefono','')}\n"
                    f"🧰 Servicio: {info['servicio_label']}{medida_admin}\n"
                    f"📍 Ubicación: {info.get('direccion','')}, {info.get('comuna','')}\n"
-                   f"💵 Total (estimado): {total_txt}")
+                   f"💵 Total (estimado): {q.total_fmt}")
     if SEND_COPY_TO_ADMIN and ADMIN_WA:
-        send_admin_copy(resumen_admin, pdf_url, docx_url)
+        sids["admin"] = send_admin_copy(resumen_admin, pdf_url, docx_url)
+    return {"docx_url": docx_url, "pdf_url": pdf_url, "twilio": sids}
+
+def _trabajo_estimado_webhook(p: dict, progreso) -> dict:
+    # La clave es el cierre de esa conversación (estimate_id de la sesión), no el contenido:
+    # el mismo trabajo corrido dos veces envía una vez, pero el cliente que repite el flujo
+    # con las mismas respuestas recibe su cotización de nuevo
+    info, public, estimado = p["info"], p["public"], p.get("estimado", "")
+    if not (idempotencia.IDEMPOTENCY_ENABLED and estimado): return _procesar_estimado_webhook(info, public, progreso)
+    return _idem.ejecutar("estimate:" + estimado, lambda: _procesar_estimado_webhook(info, public, progreso))[0]
+
+# -----------------------------------------------------------------------------
+# Cotización especulativa: apenas la sesión tiene todo lo que va en el documento,
+# el PDF se genera en segundo plano mientras el cliente responde lo que falta
+# (el teléfono no aparece en el documento), así que al cerrar el flujo la
+# cotización ya está en la caché o en curso (_cot_en_curso) y el trabajo final
+# solo envía. Si una respuesta cambia el documento se lanza otra (la más nueva
+# gana: las que no alcanzaron a empezar se descartan).
+#   final (por defecto): con el documento completo, una por conversación
+#   eager: desde que el precio está completo; cada respuesta que cambia el documento
+#          guarda otro PDF (hasta ~4 por conversación) | off
+# La conversión toma un cupo del conversor solo si está libre en ese momento (sin
+# hacer cola) y lo retiene hasta terminar: nunca hace esperar a una cotización real.
+# -----------------------------------------------------------------------------
+SPECULATIVE_QUOTES  = (os.getenv("SPECULATIVE_QUOTES", "final") or "final").strip().lower()
+SPECULATIVE_WORKERS = max(1, int(os.getenv("SPECULATIVE_WORKERS", "1")))
+_espec_ultima = sesiones.MemoriaTTL(5000, 1800)     # sesión -> clave de la última especulación
+_espec_stats = {"launched": 0, "superseded": 0, "skipped_busy": 0, "failed": 0}
+_espec_lock = threading.Lock()     # hilos quote-spec y de petición cuentan a la vez
+_especulador = None
+
+def _contar_espec(campo: str):
+    with _espec_lock: _espec_stats[campo] += 1
+
+def _pool_especulativo() -> ThreadPoolExecutor:
+    global _especulador
+    if _especulador is None:
+        _especulador = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="quote-spec")
+    return _especulador
+
+def _trabajo_especulativo(skey: str, clave: str, info: dict, q: cotizacion.Cotizacion):
+    if _espec_ultima.get(skey) != clave:
+        _contar_espec("superseded"); return
+    tpl_path = _plantilla_dominio(q.dominio)
+    necesita_lo = not pdf_nativo.activo(tpl_path) and not (os.name == "nt" and docx2pdf_convert is not None)
+    if necesita_lo:
+        pool = conversor_lo.obtener_pool()
+        pool.arrancar()
+        if not pool.libre():
+            _contar_espec("skipped_busy"); return
+    try: _generar_archivos(info, q=q, solo_libre=True)
+    except conversor_lo.ConversorSaturado:
+        _contar_espec("skipped_busy")     # el cupo se ocupó entre el sondeo y la conversión
+    except Exception as e:
+        _contar_espec("failed")
+        logging.info("Cotización especulativa falló (%s): %s", skey, e)
+
+def _especular(sess: dict, skey: str, nodo: flujo.Nodo):
+    # Llamado cada vez que el flujo se detiene a esperar una respuesta
+    if SPECULATIVE_QUOTES not in ("eager", "final"): return
+    faltan = nodo.por_guardar & (_VARS_DOCUMENTO if SPECULATIVE_QUOTES == "final" else _VARS_PRECIO)
+    if faltan: return
+    info = _session_info_to_generator_fields(sess.get("data", {}), sess.get("from_wa", ""))
+    q = _cotizacion(info)
+    tpl_path, ctx = _contexto_plantilla(info, q)
+    clave = _clave_cotizacion(tpl_path, ctx)
+    if sess.get("espec") == clave: return       # la respuesta no cambió el documento
+    sess["espec"] = clave
+    _espec_ultima.set(skey, clave)
+    _contar_espec("launched")
+    _pool_especulativo().submit(_trabajo_especulativo, skey, clave, info, q)
+
+def _estado_especulativo() -> dict:
+    with _espec_lock: return {"mode": SPECULATIVE_QUOTES, **_espec_stats}
+
+def _texto_nodo(nodo: flujo.Nodo, data: dict) -> str:
+    return _render_template_text(nodo.menu, data) if nodo.personalizado else nodo.menu
+
+def _advance_flow_until_input(resp, sess, skey):
+    # Avanza por los nodo `mensaje` hasta el próximo que espera respuesta; al salir del
+    # último nodo se genera y envía la cotización.
+    fl = FLUJO
+    data = sess.setdefault("data", {})
+    nodo = fl.nodo(sess.get("node_id"))
+    for _ in range(len(fl) + 1):
+        if nodo is None:
+            sess.update(node_id=None, last_question=None, awaiting_option_for=None, finished=True,
+                        estimate_id=uuid.uuid4().hex)
+            _send_estimate_and_files(resp, _session_info_to_generator_fields(data, sess.get("from_wa","")),
+                                     estimado_id=sess["estimate_id"])
+            return
+        if nodo.tipo == "mensaje":
+            resp.agregar(nodo.respuesta.render(data))
+            nodo = fl.nodo(nodo.next_id); continue
+        sess["node_id"] = nodo.id
+        sess["last_question"] = nodo.id if nodo.tipo == "pregunta" else None
+        sess["awaiting_option_for"] = nodo.id if nodo.tipo == "condicional" else None
+        resp.agregar(nodo.respuesta.render(data))
+        try: _especular(sess, skey, nodo)
+        except Exception as e: logging.warning("No se pudo lanzar la cotización especulativa: %s", e)
+        return
+    logging.error("Flujo con ciclo de nodos 'mensaje' desde %s", sess.get("node_id"))
+
+def _procesar_respuesta(resp, sess, skey, body: str):
+    if sess.get("finished"):
+        _reply(resp, "✅ Ya recibimos tu solicitud. Escribe *reiniciar* para una nueva cotización."); return
+    nodo = FLUJO.nodo(sess.get("node_id"))
+    if nodo is None:
+        _reply(resp, "🤖 No entendí tu mensaje. Escribe *reiniciar* para comenzar nuevamente."); return
+    data = sess.setdefault("data", {})
+    if nodo.tipo == "condicional":
+        op = FLUJO.buscar_opcion(nodo, body)
+        if op is None:
+            _reply(resp, "❗ No reconocí esa opción. Responde con el número:\n" + _texto_nodo(nodo, data))
+            return
+        if op.save_as: data[op.save_as] = op.valor
+        sess["node_id"] = op.next_id
+    else:
+        if nodo.tipo == "pregunta" and nodo.variable:
+            data[nodo.variable] = body
+        sess["node_id"] = nodo.next_id
+    _advance_flow_until_input(resp, sess, skey)
+
+_SALUDOS = {"hola","buenas","hey","buenos dias","buenas tardes","buenas noches"}
+
+_XML = {"Content-Type": "application/xml"}
+
+def _turno_webhook(data: dict, sess):
+    # Un turno del flujo, sin E/S de sesión (la comparte asgi.py)
+    # -> (TwiML en bytes, sesión a guardar o None si no hay que guardar)
+    body = (data.get("Body") or "").strip()
+    body_lc = body.lower()
+    msg_sid = (data.get("MessageSid") or "").strip()
+    from_wa = data.get("From","").strip()
+    skey = _sess_key(data)
+    resp = twiml.Respuesta()
+
+    if body_lc in _SALUDOS or body_lc == "reiniciar" or sess is None:
+        sess = {"node_id": FIRST_NODE_ID, "data": {}, "last_question": None, "pending_next_id": None,
+                "awaiting_option_for": None, "last_msg_sid": msg_sid, "from_wa": from_wa}
+        if body_lc == "reiniciar": _reply(resp, "🔄 Flujo reiniciado. Iniciando atención…")
+        _advance_flow_until_input(resp, sess, skey)
+    elif msg_sid and sess.get("last_msg_sid") == msg_sid:
+        return twiml.VACIA, None
+    else:
+        sess["last_msg_sid"] = msg_sid
+        if from_wa: sess["from_wa"] = from_wa
+        _procesar_respuesta(resp, sess, skey, body)
+    return resp.bytes(), sess
+
+def _error_webhook(e: Exception) -> bytes:
+    logging.exception("❌ Error en webhook")
+    etapas.fallo("http:webhook", type(e).__name__)
+    resp = twiml.Respuesta()
+    resp.message("Lo siento, ocurrió un error inesperado. Escribe *reiniciar* para empezar de nuevo.")
+    return resp.bytes()
 
 @app.route("/webhook", methods=["GET", "POST", "HEAD"])
 def webhook():
@@ -793,55 +1275,26 @@ def webhook():
         return "ok", 200, {"Content-Type": "text/plain"}
     try:
         data = request.form.to_dict() if not request.is_json else (request.get_json() or {})
-        body = (data.get("Body") or "").strip()
-        body_lc = body.lower()
-        msg_sid = (data.get("MessageSid") or "").strip()
-
-        if not _dedup_should_process(msg_sid):
-            return str(MessagingResponse()), 200, {"Content-Type":"application/xml"}
-
         skey = _sess_key(data)
-        from_wa = data.get("From","").strip()
-        resp = MessagingResponse()
-
-        if body_lc in {"hola","buenas","hey","buenos dias","buenas tardes","buenas noches"}:
-            sess = {"node_id": FIRST_NODE_ID, "data": {}, "last_question": None, "pending_next_id": None,
-                    "awaiting_option_for": None, "last_msg_sid": msg_sid}
-            _sess_set(skey, sess); _advance_flow_until_input(resp, sess, skey)
-            return str(resp), 200, {"Content-Type":"application/xml"}
-
-        if body_lc == "reiniciar":
-            sess = {"node_id": FIRST_NODE_ID, "data": {}, "last_question": None, "pending_next_id": None,
-                    "awaiting_option_for": None, "last_msg_sid": msg_sid}
-            _sess_set(skey, sess); _reply(resp, "🔄 Flujo reiniciado. Iniciando atención…")
-            _advance_flow_until_input(resp, sess, skey)
-            return str(resp), 200, {"Content-Type":"application/xml"}
-
-        if not _sess_exists(skey):
-            sess = {"node_id": FIRST_NODE_ID, "data": {}, "last_question": None, "pending_next_id": None,
-                    "awaiting_option_for": None, "last_msg_sid": None}
-            _sess_set(skey, sess); _advance_flow_until_input(resp, sess, skey)
-            return str(resp), 200, {"Content-Type":"application/xml"}
-
-        sess = _sess_get(skey)
-        if msg_sid and sess.get("last_msg_sid") == msg_sid:
-            return str(MessagingResponse()), 200, {"Content-Type":"application/xml"}
-
-        # A partir de aquí usamos exactamente el flujo previo (omitido por brevedad)
-        _reply(resp, "🤖 No entendí tu mensaje. Escribe *reiniciar* para comenzar nuevamente.")
-        return str(resp), 200, {"Content-Type":"application/xml"}
-
-    except Exception:
-        logging.exception("❌ Error en webhook")
-        resp = MessagingResponse()
-        resp.message("Lo siento, ocurrió un error inesperado. Escribe *reiniciar* para empezar de nuevo.")
-        return str(resp), 200, {"Content-Type": "application/xml"}
+        with etapas.medir("session_load"):
+            procesar, sess = _sesiones.abrir(skey, (data.get("MessageSid") or "").strip())
+        if not procesar:
+            return twiml.VACIA, 200, _XML
+        xml, sess = _turno_webhook(data, sess)
+        if sess is not None:
+            with etapas.medir("session_save"):
+                _sesiones.guardar(skey, sess)
+        return xml, 200, _XML
+    except Exception as e:
+        return _error_webhook(e), 200, _XML
 
 # -----------------------------------------------------------------------------
 @app.post("/reload-flow")
 def reload_flow():
     try:
         _load_flow(); return jsonify(ok=True, count=len(FLOW)), 200
+    except flujo.FlujoInvalido as e:
+        return jsonify(ok=False, error="invalid_flow", details=e.errores), 400
     except Exception as e:
         return jsonify(ok=False, error=str(e)), 500
 
@@ -849,7 +1302,6 @@ def _log_url_map():
     try: logging.info("URL MAP:\n%s", app.url_map)
     except Exception: pass
 
-_log_url_map()
-
 if __name__ == "__main__":
+    _log_url_map()
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=True, use_reloader=False)
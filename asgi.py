@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Modo ASGI: uvicorn asgi:app  (o hypercorn asgi:app)
+#
+# Mismas rutas que app.py (/webhook, /generate, /upload, /files, /health...):
+# - POST /webhook corre en el loop: dedup + sesión con redis.asyncio
+#   (abrir_async / guardar_async) y el turno del flujo, que es CPU de
+#   microsegundos, en un hilo de ASGI_TURN_WORKERS con el contexto de request
+#   de Flask. Esperar a Redis no ocupa ningún hilo.
+# - Los envíos a Twilio salen por DespachadorAsync (cliente HTTP asíncrono).
+# - El resto pasa por un puente WSGI a la app Flask en pools de hilos:
+#   /generate y /generate/batch (render + PDF con ?sync=1) en
+#   ASGI_RENDER_WORKERS, lo demás en ASGI_WSGI_WORKERS. Los trabajos en
+#   segundo plano (trabajos.py) y el conversor siguen igual.
+# Con varios procesos (uvicorn --workers N) las sesiones deben estar en Redis.
+# -----------------------------------------------------------------------------
+import os, io, sys, json, asyncio, logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+import app as bot
+import etapas
+import metricas
+import despachador
+import twiml
+
+log = logging.getLogger("asgi")
+
+ASGI_TURN_WORKERS   = max(1, int(os.getenv("ASGI_TURN_WORKERS", "8")))
+ASGI_RENDER_WORKERS = max(1, int(os.getenv("ASGI_RENDER_WORKERS", "4")))
+ASGI_WSGI_WORKERS   = max(1, int(os.getenv("ASGI_WSGI_WORKERS", "16")))
+ASGI_MAX_BODY       = int(os.getenv("ASGI_MAX_BODY_BYTES", str(50 * 1024 * 1024)))
+# Lo que el hilo WSGI junta de la respuesta antes de devolverla; lo que sigue se
+# transmite trozo a trozo (descargas grandes, /generate/batch en NDJSON)
+_PRIMER_TROZO_MAX = 256 * 1024
+
+_pool_turnos = ThreadPoolExecutor(ASGI_TURN_WORKERS, thread_name_prefix="asgi-turno")
+_pool_render = ThreadPoolExecutor(ASGI_RENDER_WORKERS, thread_name_prefix="asgi-render")
+_pool_wsgi   = ThreadPoolExecutor(ASGI_WSGI_WORKERS, thread_name_prefix="asgi-wsgi")
+_RUTAS_RENDER = ("/generate", "/generate/batch")
+_CT_XML = [(b"content-type", b"application/xml")]
+
+_arrancado = False
+_redis_async = None
+_desp_async = None
+
+# -----------------------------------------------------------------------------
+# Arranque / parada (lifespan; si el servidor no lo manda, en el primer request)
+# -----------------------------------------------------------------------------
+async def _arrancar():
+    global _arrancado, _redis_async, _desp_async
+    if _arrancado: return
+    _arrancado = True
+    metricas.instalar()
+    bot._arrancar_trabajos()
+    if bot.REDIS_URL:
+        import redis.asyncio as aioredis
+        _redis_async = aioredis.from_url(bot.REDIS_URL, decode_responses=True, socket_timeout=bot.REDIS_SOCKET_TIMEOUT,
+                                         socket_connect_timeout=bot.REDIS_SOCKET_TIMEOUT, health_check_interval=30)
+        bot._sesiones.redis_async = _redis_async
+    if bot.TWILIO_CONFIGURED:
+        _desp_async = despachador.DespachadorAsync(despachador.crear_cliente_twilio_async(bot.TW_SID, bot.TW_TOKEN),
+                                                   asyncio.get_running_loop())
+        bot.usar_despachador(_desp_async)
+    log.info("Modo ASGI listo (redis async: %s, twilio async: %s)", _redis_async is not None, _desp_async is not None)
+
+async def _detener():
+    if _desp_async is not None:
+        try: await _desp_async.cerrar()
+        except Exception as e: log.warning("Cerrando cliente Twilio: %s", e)
+    if _redis_async is not None:
+        bot._sesiones.redis_async = None
+        try: await _redis_async.aclose()
+        except Exception as e: log.warning("Cerrando Redis async: %s", e)
+    for pool in (_pool_turnos, _pool_render, _pool_wsgi): pool.shutdown(wait=False)
+
+async def _lifespan(receive, send):
+    while True:
+        msg = await receive()
+        if msg["type"] == "lifespan.startup":
+            try: await _arrancar()
+            except Exception as e:
+                log.exception("Arranque ASGI falló")
+                await send({"type": "lifespan.startup.failed", "message": str(e)}); return
+            await send({"type": "lifespan.startup.complete"})
+        elif msg["type"] == "lifespan.shutdown":
+            await _detener()
+            await send({"type": "lifespan.shutdown.complete"}); return
+
+# -----------------------------------------------------------------------------
+# HTTP <-> WSGI
+# -----------------------------------------------------------------------------
+async def _leer_cuerpo(receive):
+    # -> bytes, o None si pasa de ASGI_MAX_BODY
+    partes, n = [], 0
+    while True:
+        msg = await receive()
+        if msg["type"] == "http.disconnect": break
+        trozo = msg.get("body", b"")
+        n += len(trozo)
+        if n > ASGI_MAX_BODY: return None
+        if trozo: partes.append(trozo)
+        if not msg.get("more_body"): break
+    return b"".join(partes)
+
+def _environ(scope, cuerpo: bytes) -> dict:
+    servidor = scope.get("server") or ("localhost", 80)
+    cliente = scope.get("client") or ("", 0)
+    env = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": servidor[0], "SERVER_PORT": str(servidor[1] or 80),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": cliente[0], "REMOTE_PORT": str(cliente[1]),
+        "CONTENT_LENGTH": str(len(cuerpo)),
+        "wsgi.version": (1, 0), "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(cuerpo), "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True, "wsgi.multiprocess": True, "wsgi.run_once": False,
+    }
+    for k, v in scope.get("headers") or []:
+        k, v = k.decode("latin-1"), v.decode("latin-1")
+        if k == "content-type": env["CONTENT_TYPE"] = v
+        elif k != "content-length":
+            clave = "HTTP_" + k.upper().replace("-", "_")
+            env[clave] = f"{env[clave]},{v}" if clave in env else v
+    return env
+
+def _llamar_wsgi(environ):
+    # Corre en un hilo: -> (status, headers, primeros trozos, (iterador, resultado) o None si terminó)
+    estado = []
+    def start_response(status, headers, exc_info=None):
+        estado[:] = [int(status.split(" ", 1)[0]), [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]]
+        return lambda _: None
+    resultado = bot.app(environ, start_response)
+    it, trozos, n = iter(resultado), [], 0
+    while n < _PRIMER_TROZO_MAX:
+        trozo = next(it, None)
+        if trozo is None:
+            _cerrar(resultado)
+            return estado[0], estado[1], trozos, None
+        trozos.append(trozo); n += len(trozo)
+    return estado[0], estado[1], trozos, (it, resultado)
+
+def _cerrar(resultado):
+    if hasattr(resultado, "close"): resultado.close()
+
+async def _wsgi(scope, receive, send, pool):
+    cuerpo = await _leer_cuerpo(receive)
+    if cuerpo is None:
+        return await _responder(send, 413, [(b"content-type", b"application/json")],
+                                b'{"ok": false, "error": "payload_too_large"}')
+    loop = asyncio.get_running_loop()
+    status, headers, trozos, resto = await loop.run_in_executor(pool, _llamar_wsgi, _environ(scope, cuerpo))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    try:
+        for trozo in trozos:
+            if trozo: await send({"type": "http.response.body", "body": trozo, "more_body": True})
+        while resto is not None:
+            trozo = await loop.run_in_executor(pool, next, resto[0], None)
+            if trozo is None: break
+            if trozo: await send({"type": "http.response.body", "body": trozo, "more_body": True})
+    finally:
+        if resto is not None: await loop.run_in_executor(pool, _cerrar, resto[1])
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+async def _responder(send, status: int, headers, cuerpo: bytes):
+    await send({"type": "http.response.start", "status": status,
+                "headers": headers + [(b"content-length", str(len(cuerpo)).encode())]})
+    await send({"type": "http.response.body", "body": cuerpo})
+
+# -----------------------------------------------------------------------------
+# POST /webhook nativo
+# -----------------------------------------------------------------------------
+def _datos_webhook(scope, cuerpo: bytes) -> dict:
+    ct = next((v for k, v in scope.get("headers") or [] if k == b"content-type"), b"").decode("latin-1")
+    if "json" in ct: return json.loads(cuerpo or b"{}") or {}
+    datos = {}
+    for k, v in parse_qsl(cuerpo.decode("utf-8", "replace"), keep_blank_values=True): datos.setdefault(k, v)
+    return datos
+
+def _turno(environ, data, sess):
+    with bot.app.request_context(environ):
+        return bot._turno_webhook(data, sess)
+
+async def _webhook(scope, receive, send):
+    cuerpo = await _leer_cuerpo(receive)
+    if cuerpo is None: return await _responder(send, 413, [], b"")
+    t0 = etapas.entrar("http:webhook")
+    try:
+        data = _datos_webhook(scope, cuerpo)
+        skey = bot._sess_key(data)
+        with etapas.medir("session_load"):
+            procesar, sess = await bot._sesiones.abrir_async(skey, (data.get("MessageSid") or "").strip())
+        if not procesar:
+            xml = twiml.VACIA
+        else:
+            xml, sess = await asyncio.get_running_loop().run_in_executor(
+                _pool_turnos, _turno, _environ(scope, cuerpo), data, sess)
+            if sess is not None:
+                with etapas.medir("session_save"):
+                    await bot._sesiones.guardar_async(skey, sess)
+    except Exception as e:
+        xml = bot._error_webhook(e)
+    finally:
+        etapas.salir("http:webhook", t0, True, "200")
+    await _responder(send, 200, _CT_XML, xml)
+
+# -----------------------------------------------------------------------------
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan": return await _lifespan(receive, send)
+    if scope["type"] != "http": return
+    if not _arrancado: await _arrancar()
+    path = scope["path"]
+    if path == "/webhook" and scope["method"] == "POST": return await _webhook(scope, receive, send)
+    await _wsgi(scope, receive, send, _pool_render if path in _RUTAS_RENDER else _pool_wsgi)
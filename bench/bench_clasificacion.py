@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Micro-benchmark: costo de clasificación por cotización. "antes" reproduce las
+# funciones de app.py previas a clasificacion.py (normalización Unicode y
+# cadenas de `in` en cada llamada); "ahora" usa clasificacion.clasificar().
+# Uso: python bench/bench_clasificacion.py [iteraciones]
+import os, re, sys, time, random, unicodedata
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import clasificacion
+
+ETIQUETAS = [
+    ("🐜 Control de Plagas - 🐀 Desratización", "", ""),
+    ("Control de Plagas - Desinsectación", "", ""),
+    ("Control de Plagas - 🧴 Sanitización / Desinfección", "", ""),
+    ("🏊 Piscinas - 🧰 Plan Intermedio: Tratamiento + Limpieza física", "", ""),
+    ("Piscinas - Mantención de bomba y filtro", "", ""),
+    ("Piscinas - Diagnóstico", "", ""),
+    ("📷 Cámaras Seguridad", "Inalámbricas – Se conectan por WiFi", "Portón y patio"),
+    ("📷 Cámaras Seguridad", "Alámbricas – Cableadas", "Living y cocina"),
+    ("📷 Cámaras Seguridad", "☀️ Solares", "Perímetro del campo"),
+]
+
+def _norm(s):
+    if not s: return ""
+    s = s.strip().lower()
+    s = re.sub(r"[\u2460-\u24FF\u2600-\u27BF\ufe0f\u200d]", "", s)
+    s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
+    return re.sub(r"\s+", " ", s).strip()
+
+def _strip(t):
+    t = re.sub(r"[\u2460-\u24FF\u2600-\u27BF\ufe0f\u200d]", "", t or "")
+    t = "".join(c for c in unicodedata.normalize("NFKD", t) if not unicodedata.combining(c))
+    return re.sub(r"[^a-zA-Z0-9\s]", " ", t).lower().strip()
+
+def _dominio(l):
+    s = _norm(l)
+    if "piscin" in s: return "piscinas"
+    if any(k in s for k in ("plaga", "desratiz", "desinsect", "sanitiz")): return "plagas"
+    if "camar" in s: return "camaras"
+    return "otro"
+
+def _precio(l):
+    s = _strip(l)
+    if "desratiz" in s: return "desratizacion"
+    if "desinfecc" in s: return "desinfeccion"
+    return "desinsectacion"
+
+def _piscina(l):
+    s = _norm(l)
+    if "plan intermedio" in s or ("tratamient" in s and "limpiez" in s): return "piscina_plan_intermedio_m3"
+    if "bomba" in s or "filtro" in s or "mantencion" in s: return "piscina_mantencion_bomba_m3"
+    if "shock" in s or "clor" in s: return "piscina_shock_m3"
+    if "diagn" in s: return "piscina_diagnostico_total"
+    if "arena" in s or "carga" in s: return "piscina_cambio_arena_total"
+    return ""
+
+def _tipo(s):
+    s = (s or "").strip().lower()
+    if "dvr" in s or "grabador" in s: return "dvr"
+    if "inalam" in s or "wi fi" in s or "wi-fi" in s or "wifi" in s: return "inalambricas"
+    if "sola" in s: return "solares"
+    return "alambricas"
+
+def _exterior(t, tipo):
+    if tipo.startswith("sola"): return True
+    t = (t or "").lower()
+    return any(w in t for w in ("exterior", "patio", "jardin", "jardín", "porton", "portón", "entrada",
+                                "estacionamiento", "perimetro", "perímetro", "terraza", "muro"))
+
+def antes(serv, tipo, area):
+    # Llamadas de una cotización: normalize_payload, precio_total, contexto, resumen, envío
+    for _ in range(4): _dominio(serv)
+    _precio(serv)
+    for _ in range(2): _piscina(serv)
+    for _ in range(3): t = _tipo(tipo); _exterior(area, t)
+
+def ahora(serv, tipo, area):
+    for _ in range(4): clasificacion.clasificar(serv)
+    clasificacion.clasificar(serv)
+    for _ in range(2): clasificacion.clasificar(serv)
+    for _ in range(3): clasificacion.clasificar("", tipo, area)
+
+def _medir(fn, n, etiquetas):
+    t0 = time.perf_counter()
+    for i in range(n): fn(*etiquetas[i % len(etiquetas)])
+    return (time.perf_counter() - t0) / n * 1e6
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    a = _medir(antes, n, ETIQUETAS)
+    b = _medir(ahora, n, ETIQUETAS)
+    clasificacion.clasificar.cache_clear(); clasificacion.familias.cache_clear(); clasificacion.normalizar.cache_clear()
+    rnd = random.Random(1)
+    frias = [(f"{s} {rnd.random()}", f"{t} {rnd.random()}", f"{a_} {rnd.random()}") for s, t, a_ in ETIQUETAS * (n // len(ETIQUETAS))]
+    c = _medir(ahora, len(frias), frias)
+    print(f"por cotización  antes {a:6.1f} us | ahora (caché caliente) {b:5.2f} us | ahora (sin acierto de caché) {c:5.1f} us")
+    print("clasificación:", clasificacion.estado())
+
+if __name__ == "__main__":
+    main()
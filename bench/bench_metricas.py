@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Micro-benchmark: costo de un etapas.medir() (lo que paga el camino caliente
+# por cada etapa) sin métricas, con prometheus_client en un solo proceso y en
+# modo multiproceso (mmap, como corre bajo gunicorn). Cada modo en su propio
+# proceso: prometheus_client elige el backend al importarse.
+# Uso: python bench/bench_metricas.py [iteraciones]
+import os, sys, time, shutil, tempfile, subprocess
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _correr(modo: str, n: int):
+    if modo == "multiproceso":
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="bench-metricas-")
+    sys.path.insert(0, BASE)
+    import etapas, metricas
+    if modo != "sin_metricas": metricas.instalar()
+    for _ in range(1000):
+        with etapas.medir("render"): pass
+    t0 = time.perf_counter()
+    for _ in range(n):
+        with etapas.medir("render"): pass
+    us = (time.perf_counter() - t0) / n * 1e6
+    t0 = time.perf_counter()
+    for _ in range(n): etapas.fallo("twilio_send", "429")
+    us_err = (time.perf_counter() - t0) / n * 1e6
+    if modo == "multiproceso": shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    print(f"{modo:14s} medir() {us:5.2f} us | error {us_err:5.2f} us", flush=True)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    for modo in ("sin_metricas", "un_proceso", "multiproceso"):
+        env = dict(os.environ); env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--modo", modo, str(n)], env=env, check=True)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--modo": _correr(sys.argv[2], int(sys.argv[3]))
+    else: main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Micro-benchmark: PDF de cotización con el motor nativo (pdf_nativo.py) por
+# plantilla. Mide el primer documento del proceso (arma fondo y subconjuntos
+# de fuentes) y luego p50/p95 por documento; como referencia, el render DOCX
+# con caché y, con --lo, la conversión DOCX -> PDF del pool de LibreOffice.
+# Deja un PDF de muestra por plantilla en --out para revisarlo a ojo.
+# Uso: python bench/bench_pdf_nativo.py [--n 50] [--lo] [--out /tmp/pdf_nativo]
+import os, sys, io, time, argparse, tempfile, statistics
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE)
+import pdf_nativo
+import plantillas
+
+PLANTILLAS = [os.path.join(BASE, "templates", n) for n in (
+    "templatescotizacion_plagas.docx", "templatescotizacion_piscinas.docx", "templatescotizacion_camaras.docx")]
+CTX = {"fecha": "17-10-2026", "cliente": "Residencial", "direccion": "Pasaje Los Alerces 345", "comuna": "Villarrica",
+       "contacto": "Juan Perez", "email": "juan@email.com", "servicio": "Control de Plagas - Desratización",
+       "m2": "150", "m3": "24", "camaras": "", "descripcion": "Desratización — 150 m²",
+       "linea_servicio": "Desratización", "linea_cantidad": "4", "linea_total": "$60.000",
+       "total": "$60.000", "precio": "$60.000"}
+
+def _medir(fn, n):
+    tiempos = []
+    for _ in range(n):
+        t0 = time.perf_counter(); fn(); tiempos.append((time.perf_counter() - t0) * 1000)
+    tiempos.sort()
+    return statistics.median(tiempos), tiempos[max(0, int(len(tiempos) * 0.95) - 1)]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=50)
+    ap.add_argument("--lo", action="store_true", help="medir también la conversión con LibreOffice")
+    ap.add_argument("--out", default=os.path.join(tempfile.gettempdir(), "pdf_nativo"))
+    args = ap.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    if not os.path.exists(pdf_nativo.FUENTE_REGULAR):
+        sys.exit(f"Falta la fuente {pdf_nativo.FUENTE_REGULAR} (PDF_FONT_REGULAR)")
+
+    for path in PLANTILLAS:
+        nombre = os.path.basename(path)
+        salida = os.path.join(args.out, nombre.replace(".docx", ".pdf"))
+        t0 = time.perf_counter(); pdf_nativo.generar(salida, path, CTX)
+        primero = (time.perf_counter() - t0) * 1000
+        n50, n95 = _medir(lambda: pdf_nativo.generar_bytes(path, CTX), args.n)
+        plantillas.cache.obtener(path)
+        d50, _ = _medir(lambda: plantillas.cache.obtener(path).nueva().render(CTX), max(1, args.n // 5))
+        linea = (f"{nombre:36s} nativo: primero={primero:7.1f}ms p50={n50:5.1f}ms p95={n95:5.1f}ms "
+                 f"({os.path.getsize(salida) // 1024} KB) | render DOCX p50={d50:5.1f}ms")
+        if args.lo:
+            import conversor_lo
+            docx = os.path.join(args.out, nombre)
+            t = plantillas.cache.obtener(path).nueva(); t.render(CTX); t.save(docx)
+            l50, _ = _medir(lambda: conversor_lo.obtener_pool().convertir(docx, docx[:-5] + "_lo.pdf"), 3)
+            linea += f" | LibreOffice p50={l50:7.1f}ms"
+        print(linea, flush=True)
+    print("PDFs de muestra en", args.out)
+
+if __name__ == "__main__":
+    main()
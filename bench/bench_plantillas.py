@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Micro-benchmark: render DOCX con DocxTemplate nuevo por request vs caché compilada.
+# Uso: python bench/bench_plantillas.py [iteraciones]
+import os, sys, io, time, statistics
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from docxtpl import DocxTemplate
+import plantillas
+
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLANTILLAS = [os.path.join(BASE, "templates", n) for n in (
+    "templatescotizacion_plagas.docx", "templatescotizacion_piscinas.docx", "templatescotizacion_camaras.docx")]
+CTX = {"fecha": "17-10-2026", "cliente": "Residencial", "direccion": "Pasaje Los Alerces 345", "comuna": "Villarrica",
+       "contacto": "Juan Perez", "email": "juan@email.com", "servicio": "Control de Plagas - Desratización",
+       "m2": "150", "m3": "", "camaras": "", "descripcion": "Desratización — 150 m²",
+       "linea_servicio": "Desratización", "linea_cantidad": "1", "linea_total": "$60.000",
+       "total": "$60.000", "precio": "$60.000"}
+
+def _medir(fn, n):
+    tiempos = []
+    for _ in range(n):
+        t0 = time.perf_counter(); fn(); tiempos.append((time.perf_counter() - t0) * 1000)
+    tiempos.sort()
+    return statistics.median(tiempos), tiempos[int(len(tiempos) * 0.95) - 1]
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for path in PLANTILLAS:
+        def sin_cache():
+            t = DocxTemplate(path); t.render(CTX); t.save(io.BytesIO())
+        def con_cache():
+            t = plantillas.cache.obtener(path).nueva(); t.render(CTX); t.save(io.BytesIO())
+        plantillas.cache.obtener(path)
+        a50, a95 = _medir(sin_cache, n)
+        b50, b95 = _medir(con_cache, n)
+        print(f"{os.path.basename(path):40s} sin caché p50={a50:7.1f}ms p95={a95:7.1f}ms | "
+              f"con caché p50={b50:7.1f}ms p95={b95:7.1f}ms | x{a50 / b50:.1f}")
+    print("cache:", plantillas.cache.estado())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Reporte de memoria por sesión y benchmark con N sesiones abiertas (def. 100k):
+# JSON completo (formato anterior, SET sess:<k>) vs hash compacto (sesiones.py).
+# Sin Redis mide tamaño de payload, bytes escritos por turno, CPU y memoria del
+# almacén local. Con REDIS_URL (¡usar una instancia de pruebas!) también escribe
+# las N sesiones en ambos formatos bajo "bench:" y mide used_memory real.
+# Uso: python bench/bench_sesiones.py [n_sesiones]
+import os, sys, json, time, random, statistics, tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sesiones
+
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESPUESTAS = [("nombre", "Juan Pérez"), ("cliente", "Casa / Departamento"), ("servicio", "Control de Plagas"),
+              ("plaga", "Desratización"), ("m2", "150"), ("direccion", "Pasaje Los Alerces 345"),
+              ("comuna", "Villarrica"), ("email", "juan.perez@email.com"), ("telefono", "+56912345678")]
+
+def _sesiones(n: int):
+    with open(os.path.join(BASE, "chatbot-flujo.json"), encoding="utf-8") as f:
+        ids = [str(x["id"]) for x in json.load(f)]
+    rnd = random.Random(7)
+    for i in range(n):
+        k = rnd.randint(0, len(RESPUESTAS))
+        nodo = rnd.choice(ids)
+        yield f"+569{10000000 + i}", {
+            "node_id": nodo, "data": dict(RESPUESTAS[:k]), "last_question": nodo if k % 2 else None,
+            "pending_next_id": None, "awaiting_option_for": None if k % 2 else nodo,
+            "last_msg_sid": "SM" + "%032x" % rnd.getrandbits(128), "from_wa": f"whatsapp:+569{10000000 + i}"}
+
+def _turno(sess: dict) -> dict:
+    s = json.loads(json.dumps(sess))
+    s["data"]["comuna"] = "Pucón"; s["last_msg_sid"] = "SM" + "0" * 32
+    return s
+
+def _us(fn, items):
+    t0 = time.perf_counter()
+    for x in items: fn(x)
+    return (time.perf_counter() - t0) / len(items) * 1e6
+
+def _mem_local(items, fn):
+    tracemalloc.start()
+    m = sesiones.MemoriaTTL(len(items) + 1, 3600)
+    a = tracemalloc.take_snapshot()
+    for k, s in items: m.set(k, fn(s))
+    b = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(st.size_diff for st in b.compare_to(a, "filename")) / len(items)
+
+def _redis(url, items):
+    import redis
+    r = redis.from_url(url, decode_responses=True)
+    def usado(): return r.info("memory")["used_memory"]
+    res = {}
+    for nombre, escribir in (("json", lambda p, k, s: p.set(f"bench:sess:{k}", json.dumps(s), ex=3600)),
+                             ("hash", lambda p, k, s: (p.hset(f"bench:s:{k}", mapping=sesiones.codificar(s)),
+                                                       p.expire(f"bench:s:{k}", 3600)))):
+        antes = usado()
+        for i in range(0, len(items), 1000):
+            p = r.pipeline(transaction=False)
+            for k, s in items[i:i + 1000]: escribir(p, k, s)
+            p.execute()
+        despues = usado()
+        muestra = [r.memory_usage(f"bench:{'sess' if nombre == 'json' else 's'}:{k}") or 0 for k, _ in items[:200]]
+        res[nombre] = ((despues - antes) / len(items), statistics.mean(muestra))
+        cursor = 0
+        while True:
+            cursor, claves = r.scan(cursor, match="bench:*", count=5000)
+            if claves: r.delete(*claves)
+            if cursor == 0: break
+    return res
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    items = list(_sesiones(n))
+    planos = [sesiones.codificar(s) for _, s in items]
+    json_b = statistics.mean(len(json.dumps(s).encode()) for _, s in items)
+    hash_b = statistics.mean(sum(len(c.encode()) + len(v.encode()) for c, v in p.items()) for p in planos)
+    print(f"{n} sesiones")
+    print(f"payload por sesión   JSON {json_b:7.1f} B | hash {hash_b:7.1f} B ({len(planos[0])} campos típicos)")
+
+    muestra = items[:20_000]
+    json_turno = statistics.mean(len(json.dumps(_turno(s)).encode()) for _, s in muestra)
+    diff_turno = []
+    for (_, s), p in zip(muestra, planos):
+        nuevo = sesiones.codificar(_turno(s))
+        diff_turno.append(sum(len(c) + len(v.encode()) for c, v in nuevo.items() if p.get(c) != v))
+    print(f"escrito por turno    JSON {json_turno:7.1f} B | hash {statistics.mean(diff_turno):7.1f} B (solo campos cambiados)")
+
+    blobs = [json.dumps(s) for _, s in muestra]
+    print(f"CPU                  json.dumps {_us(json.dumps, [s for _, s in muestra]):5.1f} us  json.loads {_us(json.loads, blobs):5.1f} us | "
+          f"codificar {_us(sesiones.codificar, [s for _, s in muestra]):5.1f} us  decodificar {_us(sesiones.decodificar, planos[:20_000]):5.1f} us")
+
+    print(f"almacén local (tracemalloc, por sesión)  JSON str {_mem_local(items, json.dumps):7.1f} B | "
+          f"hash dict {_mem_local(items, sesiones.codificar):7.1f} B")
+
+    url = os.getenv("REDIS_URL")
+    if url:
+        for nombre, (delta, usage) in _redis(url, items).items():
+            print(f"redis {nombre:4s}  used_memory/sesión {delta:7.1f} B | MEMORY USAGE medio {usage:7.1f} B")
+    else:
+        print("redis: define REDIS_URL (instancia de pruebas) para medir used_memory real")
+
+if __name__ == "__main__":
+    main()
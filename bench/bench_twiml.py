@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Micro-benchmark: costo por mensaje de la respuesta TwiML del webhook.
+# antes: MessagingResponse + sustitución {variables} con regex + str() por cada
+# respuesta; ahora: bytes precompilados al cargar el flujo (twiml.py). Recorre
+# todos los nodos de chatbot-flujo.json, verifica que ambos caminos den los
+# mismos bytes y mide además un turno completo de _turno_webhook (sin HTTP ni
+# E/S de sesión) a lo largo de una conversación.
+# Uso: python bench/bench_twiml.py [n]
+import os, re, sys, json, time
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE)
+from twilio.twiml.messaging_response import MessagingResponse
+import flujo
+import twiml
+
+DATOS = {"nombre": "María José <Pérez> & Cía", "servicio": "Control de Plagas", "direccion": "Pasaje Los Alerces 345"}
+
+def _render_template_text(text, data):
+    def repl(m): return str(data.get(m.group(1).strip(), ""))
+    return re.sub(r"\{([^}]+)\}", repl, text or "")
+
+def antes(nodo, data):
+    resp = MessagingResponse()
+    texto = _render_template_text(nodo.menu, data) if nodo.personalizado else nodo.menu
+    if texto: resp.message(texto)
+    return str(resp).encode("utf-8")
+
+def ahora(nodo, data):
+    resp = twiml.Respuesta()
+    resp.agregar(nodo.respuesta.render(data))
+    return resp.bytes()
+
+def _medir(fn, nodos, n):
+    t0 = time.perf_counter()
+    for i in range(n): fn(nodos[i % len(nodos)], DATOS)
+    return (time.perf_counter() - t0) / n * 1e6
+
+def _turnos(n):
+    # Conversación completa repetida; cada turno pasa por _turno_webhook tal como en /webhook
+    os.environ.setdefault("TWILIO_ENABLED", "false")
+    os.environ.setdefault("SPECULATIVE_QUOTES", "off")
+    import app
+    pasos = ["hola", "Ana", "1", "1", "1", "1", "2", "Calle Falsa 123", "Temuco", "ana@x.cl"]
+    sess, total, k = None, 0.0, 0
+    with app.app.test_request_context("/webhook", method="POST"):
+        while k < n:
+            for i, body in enumerate(pasos):
+                data = {"From": "whatsapp:+56911112222", "Body": body, "MessageSid": f"SM{k}"}
+                t0 = time.perf_counter()
+                _, sess = app._turno_webhook(data, sess)
+                total += time.perf_counter() - t0; k += 1
+    return total / k * 1e6
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    with open(os.path.join(BASE, "chatbot-flujo.json"), encoding="utf-8") as f:
+        fl = flujo.compilar(json.load(f))
+    nodos = list(fl.nodos.values())
+    distintos = [x.id for x in nodos if antes(x, DATOS) != ahora(x, DATOS)]
+    if distintos: sys.exit(f"TwiML distinto en los nodos {distintos}")
+    estaticos = [x for x in nodos if not x.personalizado]
+    personalizados = [x for x in nodos if x.personalizado]
+    for nombre, grupo in (("estáticos", estaticos), ("personalizados", personalizados)):
+        if not grupo: continue
+        a, b = _medir(antes, grupo, n), _medir(ahora, grupo, n)
+        print(f"nodos {nombre:15s} ({len(grupo):2d})  antes {a:6.2f} us | ahora {b:5.2f} us | x{a / b:5.1f}")
+    print(f"turno completo de _turno_webhook: {_turnos(max(100, n // 50)):7.1f} us por mensaje")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+# Prueba de carga local, reproducible, del bot completo.
+#
+# Levanta (salvo --app-url) la app con gunicorn (o uvicorn asgi:app con
+# --server asgi) contra un Twilio REST falso
+# (fake_twilio.py) y un Redis local de reemplazo (fake_redis.py, o --redis-url).
+# Reproduce conversaciones de WhatsApp de varios turnos armadas desde
+# chatbot-flujo.json y cotizaciones POST /generate (sintéticas o un JSONL con el
+# formato de /generate/batch) con la concurrencia pedida.
+#
+# Reporta throughput y p50/p95/p99 por endpoint, el tiempo de punta a punta de
+# la cotización del webhook (último turno -> PDF recibido en el Twilio falso) y
+# las etapas del servidor (GET /stages: sesión, render, conversión, envío).
+# Guarda todo en JSON; con --baseline compara p95 y sale con código 1 si algo
+# empeoró más de --tolerance.
+#
+# Uso: python bench/carga.py --conversations 100 --generates 40 --concurrency 16
+# (sin LibreOffice, poner un soffice falso en PATH para medir solo la app)
+import os, sys, json, time, random, shutil, argparse, tempfile, threading, subprocess, statistics, datetime
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+BASE = os.path.dirname(BENCH)
+sys.path.insert(0, BASE); sys.path.insert(0, BENCH)
+import flujo
+from fake_redis import FakeRedis
+from fake_twilio import FakeTwilio
+
+RESPUESTAS = {"nombre": ["Ana", "Juan Pérez", "María José"], "tamano_piscina": ["6x3", "8 x 4", "10x5"],
+              "profundidad": ["1.4", "1,2", "no sé"], "area_vigilar": ["Portón y patio", "Living y cocina", "Estacionamiento"],
+              "direccion": ["Av. Alemania 0450", "Pasaje Los Alerces 345"], "comuna": ["Temuco", "Villarrica", "Pucón"],
+              "email": ["cliente@example.com"], "telefono": ["+56912345678"]}
+SERVICIOS = ["Control de Plagas - Desratización", "Control de Plagas - Desinsectación", "Sanitización",
+             "Piscinas - Plan Intermedio", "Piscinas - Diagnóstico"]
+
+# ---- guiones -----------------------------------------------------------------
+def guion_conversacion(fl: flujo.Flujo, rnd: random.Random):
+    turnos, nodo = ["hola"], fl.nodo(fl.primero)
+    for _ in range(len(fl) * 2):
+        if nodo is None: break
+        if nodo.tipo == "mensaje": nodo = fl.nodo(nodo.next_id); continue
+        if nodo.tipo == "condicional":
+            op = rnd.choice(nodo.opciones)
+            turnos.append(rnd.choice([str(op.n), f"{op.n}\ufe0f\u20e3", op.valor]))
+            nodo = fl.nodo(op.next_id)
+        else:
+            turnos.append(rnd.choice(RESPUESTAS.get(nodo.variable, ["prueba"])))
+            nodo = fl.nodo(nodo.next_id)
+    return turnos
+
+def payloads_generate(n: int, rnd: random.Random, archivo: str = ""):
+    if archivo:
+        with open(archivo, encoding="utf-8") as f:
+            base = [json.loads(l) for l in f if l.strip()]
+        return [dict(base[i % len(base)]) for i in range(n)]
+    return [{"servicio": rnd.choice(SERVICIOS), "m2": str(rnd.randint(20, 2500)), "m3": str(rnd.randint(10, 120)),
+             "cliente": "Residencial", "direccion": f"Calle {i}", "comuna": "Temuco", "contacto": f"Cliente {i}",
+             "email": f"c{i}@example.com", "fono": f"+5698{i:07d}"} for i in range(n)]
+
+# ---- medición ----------------------------------------------------------------
+class Registro:
+    def __init__(self):
+        self.lat = {}
+        self.err = {}
+        self.lock = threading.Lock()
+
+    def agregar(self, nombre: str, seg: float, ok: bool = True):
+        with self.lock:
+            self.lat.setdefault(nombre, []).append(seg)
+            if not ok: self.err[nombre] = self.err.get(nombre, 0) + 1
+
+def _pct(v, q):
+    return v[min(len(v) - 1, int(round(q * (len(v) - 1))))]
+
+def resumir(lat: dict, err: dict, wall: float) -> dict:
+    out = {}
+    for nombre, v in sorted(lat.items()):
+        v = sorted(v)
+        out[nombre] = {"count": len(v), "errors": err.get(nombre, 0), "rps": round(len(v) / wall, 2),
+                       "mean_ms": round(statistics.mean(v) * 1000, 2), "p50_ms": round(_pct(v, .5) * 1000, 2),
+                       "p95_ms": round(_pct(v, .95) * 1000, 2), "p99_ms": round(_pct(v, .99) * 1000, 2),
+                       "max_ms": round(v[-1] * 1000, 2)}
+    return out
+
+# ---- carga -------------------------------------------------------------------
+def conversar(url: str, turnos, numero: str, reg: Registro, fin_turnos: dict):
+    s = requests.Session()
+    for i, body in enumerate(turnos):
+        t0 = time.perf_counter()
+        try:
+            r = s.post(f"{url}/webhook", data={"From": f"whatsapp:{numero}", "WaId": numero.lstrip("+"),
+                                               "Body": body, "MessageSid": f"SM{numero[1:]}{i:04d}"}, timeout=60)
+            ok = r.status_code == 200 and "<Response" in r.text
+        except requests.RequestException:
+            ok = False
+        reg.agregar("webhook", time.perf_counter() - t0, ok)
+    fin_turnos[f"whatsapp:{numero}"] = time.perf_counter()
+
+def cotizar(url: str, payload: dict, modo: str, reg: Registro):
+    s = requests.Session()
+    t0 = time.perf_counter()
+    try:
+        if modo == "sync":
+            r = s.post(f"{url}/generate?sync=1", json=payload, timeout=180)
+            reg.agregar("generate_sync", time.perf_counter() - t0, r.status_code == 200 and r.json().get("ok"))
+            return
+        r = s.post(f"{url}/generate", json=payload, timeout=60)
+        reg.agregar("generate_enqueue", time.perf_counter() - t0, r.status_code == 202)
+        if r.status_code != 202: return
+        job = r.json()["job_id"]
+        while time.perf_counter() - t0 < 180:
+            time.sleep(0.05)
+            j = s.get(f"{url}/jobs/{job}", timeout=30).json()
+            if j.get("status") in ("done", "failed"):
+                reg.agregar("generate_job", time.perf_counter() - t0, j.get("status") == "done"); return
+        reg.agregar("generate_job", time.perf_counter() - t0, False)
+    except (requests.RequestException, ValueError):
+        reg.agregar("generate_sync" if modo == "sync" else "generate_enqueue", time.perf_counter() - t0, False)
+
+def etapas_servidor(url: str, workers: int) -> dict:
+    # /stages es por proceso: se consulta varias veces para juntar un resumen por worker
+    por_pid = {}
+    for _ in range(max(1, workers) * 8):
+        try: j = requests.get(f"{url}/stages", timeout=10).json()
+        except Exception: break
+        por_pid[j["pid"]] = j["stages"]
+        if len(por_pid) >= workers: break
+    if len(por_pid) == 1: return next(iter(por_pid.values()))
+    return {f"pid:{pid}": st for pid, st in por_pid.items()}
+
+# ---- entorno -----------------------------------------------------------------
+def levantar_app(args, redis_url: str, twilio: FakeTwilio, files_dir: str):
+    port = args.port
+    env = dict(os.environ, PORT=str(port), BASE_URL=f"http://127.0.0.1:{port}", FILES_DIR=files_dir,
+               TWILIO_ACCOUNT_SID="AC" + "0" * 32, TWILIO_AUTH_TOKEN="fake", TWILIO_ENABLED="true",
+               TWILIO_API_BASE_URL=twilio.url, OUTBOUND_RATE_PER_SEC="1000", OUTBOUND_BURST="1000")
+    env.pop("REDIS_URL", None)
+    for k in ("UPSTASH_REDIS_URL", "REDIS_TLS_URL", "RAILWAY_REDIS_URL", "REDIS_HOST"): env.pop(k, None)
+    if redis_url: env["REDIS_URL"] = redis_url
+    if args.server == "asgi":
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"]
+    else:
+        cmd = [sys.executable, "-m", "gunicorn", "app:app", "-b", f"127.0.0.1:{port}", "-w", str(args.workers),
+               "-k", "gthread", "--threads", str(args.threads), "--timeout", "180", "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=BASE, env=env, stdout=subprocess.DEVNULL if not args.verbose else None,
+                            stderr=subprocess.DEVNULL if not args.verbose else None)
+    url = f"http://127.0.0.1:{port}"
+    fin = time.time() + 60
+    while time.time() < fin:
+        if proc.poll() is not None: raise SystemExit("la app terminó al arrancar (usar --verbose)")
+        try:
+            if requests.get(f"{url}/health", timeout=2).status_code == 200: return proc, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.3)
+    proc.terminate(); raise SystemExit("la app no respondió /health en 60 s")
+
+def _git_commit():
+    try: return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE, text=True).strip()
+    except Exception: return ""
+
+def comparar(actual: dict, base: dict, tolerancia: float):
+    # Regresión: p95 peor que base * (1 + tolerancia) y al menos 5 ms más lento
+    malas = []
+    for seccion in ("endpoints", "e2e", "stages"):
+        for nombre, m in (actual.get(seccion) or {}).items():
+            b = (base.get(seccion) or {}).get(nombre)
+            if not isinstance(m, dict) or not isinstance(b, dict) or "p95_ms" not in m or b.get("p95_ms") is None: continue
+            if m["p95_ms"] is not None and m["p95_ms"] > b["p95_ms"] * (1 + tolerancia) and m["p95_ms"] - b["p95_ms"] > 5:
+                malas.append(f"{seccion}.{nombre}: p95 {b['p95_ms']} -> {m['p95_ms']} ms")
+    return malas
+
+def main():
+    ap = argparse.ArgumentParser(description="Prueba de carga local del bot")
+    ap.add_argument("--conversations", type=int, default=50)
+    ap.add_argument("--generates", type=int, default=20)
+    ap.add_argument("--generate-file", default="", help="JSONL con payloads de /generate")
+    ap.add_argument("--generate-mode", choices=("sync", "async"), default="sync")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi", help="gunicorn app:app | uvicorn asgi:app")
+    ap.add_argument("--workers", type=int, default=1, help="workers (procesos) del servidor")
+    ap.add_argument("--threads", type=int, default=8, help="hilos por worker gunicorn")
+    ap.add_argument("--port", type=int, default=5099)
+    ap.add_argument("--app-url", default="", help="usar una app ya levantada (no arranca gunicorn ni fakes de Twilio)")
+    ap.add_argument("--redis-url", default="", help="Redis real; por defecto un Redis local de reemplazo")
+    ap.add_argument("--no-redis", action="store_true", help="sin Redis (sesiones en memoria del worker)")
+    ap.add_argument("--twilio-latency-ms", type=float, default=80)
+    ap.add_argument("--twilio-429-rate", type=float, default=0.0)
+    ap.add_argument("--e2e-timeout", type=float, default=120)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--out", default="", help="archivo JSON de resultados (por defecto bench/resultados/carga_<fecha>.json)")
+    ap.add_argument("--baseline", default="", help="JSON de una corrida anterior para comparar")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    with open(os.path.join(BASE, "chatbot-flujo.json"), encoding="utf-8") as f:
+        fl = flujo.compilar(json.load(f))
+    guiones = [(f"+5697{i:07d}", guion_conversacion(fl, rnd)) for i in range(args.conversations)]
+    payloads = payloads_generate(args.generates, rnd, args.generate_file)
+
+    twilio = redis_srv = proc = None
+    files_dir = ""
+    if args.app_url:
+        url = args.app_url.rstrip("/")
+    else:
+        twilio = FakeTwilio(latencia_ms=args.twilio_latency_ms, tasa_429=args.twilio_429_rate).arrancar()
+        redis_url = ""
+        if not args.no_redis:
+            redis_url = args.redis_url
+            if not redis_url:
+                redis_srv = FakeRedis().arrancar(); redis_url = redis_srv.url
+        files_dir = tempfile.mkdtemp(prefix="carga_out_")
+        proc, url = levantar_app(args, redis_url, twilio, files_dir)
+
+    reg = Registro()
+    fin_turnos = {}
+    trabajos = [("c", g) for g in guiones] + [("g", p) for p in payloads]
+    rnd.shuffle(trabajos)
+    print(f"{len(guiones)} conversaciones ({sum(len(t) for _, t in guiones)} turnos), {len(payloads)} /generate, "
+          f"concurrencia {args.concurrency} -> {url}", flush=True)
+    t0 = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+            futs = [ex.submit(conversar, url, g[1], g[0], reg, fin_turnos) if k == "c"
+                    else ex.submit(cotizar, url, g, args.generate_mode, reg) for k, g in trabajos]
+            for f in futs: f.result()
+        wall = time.perf_counter() - t0
+
+        # Punta a punta del webhook: último turno -> primer mensaje con PDF en el Twilio falso
+        e2e = {}
+        if twilio is not None:
+            pendientes = set(fin_turnos)
+            limite = time.perf_counter() + args.e2e_timeout
+            while pendientes and time.perf_counter() < limite:
+                with twilio.lock: llegados = dict(twilio.primer_media)
+                for to in list(pendientes):
+                    if to in llegados:
+                        reg.agregar("webhook_quote_e2e", llegados[to] - fin_turnos[to]); pendientes.discard(to)
+                time.sleep(0.1)
+            for to in pendientes: reg.agregar("webhook_quote_e2e", args.e2e_timeout, ok=False)
+            e2e = resumir({"webhook_quote_e2e": reg.lat.pop("webhook_quote_e2e", [])},
+                          {"webhook_quote_e2e": reg.err.pop("webhook_quote_e2e", 0)}, wall) if fin_turnos else {}
+
+        total = sum(len(v) for v in reg.lat.values())
+        res = {"meta": {"time": datetime.datetime.utcnow().isoformat() + "Z", "commit": _git_commit(),
+                        "python": sys.version.split()[0], "args": vars(args)},
+               "wall_s": round(wall, 3), "requests": total, "throughput_rps": round(total / wall, 2),
+               "conversations_per_s": round(len(guiones) / wall, 2),
+               "endpoints": resumir(reg.lat, reg.err, wall), "e2e": e2e,
+               "stages": etapas_servidor(url, args.workers)}
+        if twilio is not None: res["twilio"] = twilio.estado()
+        if redis_srv is not None: res["redis_commands"] = redis_srv.estado.comandos
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try: proc.wait(10)
+            except subprocess.TimeoutExpired: proc.kill()
+        if files_dir: shutil.rmtree(files_dir, ignore_errors=True)
+
+    out = args.out or os.path.join(BENCH, "resultados", f"carga_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f: json.dump(res, f, ensure_ascii=False, indent=2)
+
+    print(f"{res['requests']} requests en {res['wall_s']} s -> {res['throughput_rps']} req/s")
+    for seccion in ("endpoints", "e2e", "stages"):
+        for nombre, m in (res.get(seccion) or {}).items():
+            if "p95_ms" not in m: continue
+            print(f"  {seccion:9s} {nombre:20s} n={m['count']:5d} err={m['errors']:3d} "
+                  f"p50={m['p50_ms']}ms p95={m['p95_ms']}ms p99={m['p99_ms']}ms")
+    print("resultados:", out)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f: base = json.load(f)
+        malas = comparar(res, base, args.tolerance)
+        for m in malas: print("REGRESIÓN", m)
+        if malas: sys.exit(1)
+        print(f"sin regresiones de p95 vs {args.baseline} (tolerancia {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
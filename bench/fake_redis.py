@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Redis local de reemplazo para pruebas de carga: servidor RESP en memoria con
+# los comandos que usa el bot (sesiones, dedup, trabajos, precios). No es un
+# Redis completo; si hay redis-server disponible, preferirlo (--redis-url).
+# Uso: python bench/fake_redis.py [puerto]
+import sys, time, socket, threading, socketserver
+
+class _Estado:
+    def __init__(self):
+        self.datos = {}        # clave -> valor (str | dict | list)
+        self.vence = {}        # clave -> time.monotonic() de expiración
+        self.cond = threading.Condition()
+        self.comandos = 0
+
+    def _vivo(self, k):
+        t = self.vence.get(k)
+        if t is not None and t <= time.monotonic():
+            self.datos.pop(k, None); self.vence.pop(k, None)
+        return k in self.datos
+
+class ErrorResp(Exception):
+    pass
+
+def _ok(): return b"+OK\r\n"
+def _int(n): return b":%d\r\n" % n
+def _nil(): return b"$-1\r\n"
+def _bulk(v):
+    if v is None: return _nil()
+    b = v if isinstance(v, bytes) else str(v).encode()
+    return b"$%d\r\n%s\r\n" % (len(b), b)
+def _arr(items):
+    if items is None: return b"*-1\r\n"
+    return b"*%d\r\n" % len(items) + b"".join(i if isinstance(i, (bytes, bytearray)) and i[:1] in b"+-:$*" else _bulk(i) for i in items)
+
+def ejecutar(st: _Estado, args):
+    cmd = args[0].upper()
+    a = args[1:]
+    st.comandos += 1
+    d = st.datos
+    if cmd in ("PING",): return b"+PONG\r\n"
+    if cmd in ("CLIENT", "SELECT"): return _ok()
+    if cmd == "ECHO": return _bulk(a[0])
+    if cmd == "GET":
+        return _bulk(d[a[0]]) if st._vivo(a[0]) else _nil()
+    if cmd == "SET":
+        k, v, opts = a[0], a[1], [x.upper() for x in a[2:]]
+        existe = st._vivo(k)
+        if "NX" in opts and existe: return _nil()
+        if "XX" in opts and not existe: return _nil()
+        d[k] = v; st.vence.pop(k, None)
+        for flag, mult in (("EX", 1.0), ("PX", 0.001)):
+            if flag in opts: st.vence[k] = time.monotonic() + float(a[2 + opts.index(flag) + 1]) * mult
+        return _ok()
+    if cmd == "DEL":
+        n = 0
+        for k in a:
+            if st._vivo(k): d.pop(k); st.vence.pop(k, None); n += 1
+        return _int(n)
+    if cmd == "EXISTS": return _int(sum(1 for k in a if st._vivo(k)))
+    if cmd == "EXPIRE":
+        if not st._vivo(a[0]): return _int(0)
+        st.vence[a[0]] = time.monotonic() + float(a[1]); return _int(1)
+    if cmd == "TTL":
+        if not st._vivo(a[0]): return _int(-2)
+        t = st.vence.get(a[0]); return _int(-1 if t is None else int(t - time.monotonic()))
+    if cmd == "HSET":
+        st._vivo(a[0]); h = d.setdefault(a[0], {})
+        nuevos = 0
+        for i in range(1, len(a), 2):
+            nuevos += a[i] not in h; h[a[i]] = a[i + 1]
+        return _int(nuevos)
+    if cmd == "HGET":
+        return _bulk(d[a[0]].get(a[1])) if st._vivo(a[0]) else _nil()
+    if cmd == "HGETALL":
+        if not st._vivo(a[0]): return _arr([])
+        return _arr([x for kv in d[a[0]].items() for x in kv])
+    if cmd == "HDEL":
+        if not st._vivo(a[0]): return _int(0)
+        h = d[a[0]]; n = sum(1 for f in a[1:] if h.pop(f, None) is not None)
+        if not h: d.pop(a[0]); st.vence.pop(a[0], None)
+        return _int(n)
+    if cmd in ("RPUSH", "LPUSH"):
+        st._vivo(a[0]); lst = d.setdefault(a[0], [])
+        for v in a[1:]:
+            if cmd == "RPUSH": lst.append(v)
+            else: lst.insert(0, v)
+        st.cond.notify_all()
+        return _int(len(lst))
+    if cmd == "LLEN": return _int(len(d[a[0]]) if st._vivo(a[0]) else 0)
+    if cmd == "LPOP":
+        if not st._vivo(a[0]) or not d[a[0]]: return _nil()
+        return _bulk(d[a[0]].pop(0))
+    if cmd == "BLPOP":
+        claves, limite = a[:-1], float(a[-1])
+        fin = time.monotonic() + (limite if limite > 0 else 1e9)
+        while True:
+            for k in claves:
+                if st._vivo(k) and d[k]: return _arr([k, d[k].pop(0)])
+            resto = fin - time.monotonic()
+            if resto <= 0: return b"*-1\r\n"
+            st.cond.wait(min(resto, 0.5))
+    if cmd in ("LMOVE", "BLMOVE"):
+        origen, destino, desde, hacia = a[0], a[1], a[2].upper(), a[3].upper()
+        fin = time.monotonic() + (float(a[4]) if cmd == "BLMOVE" and float(a[4]) > 0 else 1e9)
+        while True:
+            if st._vivo(origen) and d[origen]:
+                v = d[origen].pop(0 if desde == "LEFT" else -1)
+                st._vivo(destino); lst = d.setdefault(destino, [])
+                if hacia == "LEFT": lst.insert(0, v)
+                else: lst.append(v)
+                st.cond.notify_all()
+                return _bulk(v)
+            resto = fin - time.monotonic()
+            if cmd == "LMOVE" or resto <= 0: return _nil()
+            st.cond.wait(min(resto, 0.5))
+    if cmd == "LREM":
+        if not st._vivo(a[0]): return _int(0)
+        lst, n, v = d[a[0]], int(a[1]), a[2]
+        idx = [i for i, x in enumerate(lst) if x == v]
+        idx = idx[::-1][:-n] if n < 0 else idx[:n or None]
+        for i in sorted(idx, reverse=True): del lst[i]
+        return _int(len(idx))
+    if cmd == "LINDEX":
+        if not st._vivo(a[0]): return _nil()
+        try: return _bulk(d[a[0]][int(a[1])])
+        except IndexError: return _nil()
+    if cmd == "INFO": return _bulk("# Server\r\nredis_version:7.0.0-fake\r\n")
+    if cmd == "DBSIZE": return _int(sum(1 for k in list(d) if st._vivo(k)))
+    if cmd == "FLUSHALL": d.clear(); st.vence.clear(); return _ok()
+    raise ErrorResp(f"ERR unknown command '{args[0]}'")
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        # Como Redis: sin Nagle, si no las respuestas de un pipeline esperan el ACK retrasado (~40 ms)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _leer(self):
+        linea = self.rfile.readline()
+        if not linea: return None
+        if linea[:1] != b"*": return linea.decode().split()
+        n = int(linea[1:]); args = []
+        for _ in range(n):
+            largo = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(largo + 2)[:-2].decode())
+        return args
+
+    def handle(self):
+        st = self.server.estado
+        multi = None
+        while True:
+            args = self._leer()
+            if args is None: return
+            if not args: continue
+            cmd = args[0].upper()
+            with st.cond:
+                try:
+                    if cmd == "MULTI": multi = []; out = _ok()
+                    elif cmd == "DISCARD": multi = None; out = _ok()
+                    elif cmd == "EXEC":
+                        cola, multi = multi or [], None
+                        out = _arr([ejecutar(st, c) for c in cola])
+                    elif multi is not None: multi.append(args); out = b"+QUEUED\r\n"
+                    else: out = ejecutar(st, args)
+                except ErrorResp as e:
+                    out = b"-%s\r\n" % str(e).encode()
+                except Exception as e:
+                    out = b"-ERR %s\r\n" % str(e).encode()
+            self.wfile.write(out)
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, puerto: int = 0):
+        super().__init__(("127.0.0.1", puerto), _Handler)
+        self.estado = _Estado()
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (ConnectionError, OSError)): super().handle_error(request, client_address)
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+
+    def arrancar(self):
+        threading.Thread(target=self.serve_forever, name="fake-redis", daemon=True).start()
+        return self
+
+if __name__ == "__main__":
+    srv = FakeRedis(int(sys.argv[1]) if len(sys.argv) > 1 else 6379)
+    print("fake redis en", srv.url, flush=True)
+    srv.serve_forever()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# S3 local de reemplazo (estilo MinIO, path-style) para probar STORAGE_BACKEND=s3:
+# PUT/GET/HEAD/DELETE de objetos en memoria, GET con Range y If-None-Match,
+# URLs prefirmadas con vencimiento. Exige firma SigV4 (cabecera o query) pero
+# no la verifica; para eso, un MinIO real (minio server /data).
+# Uso: python bench/fake_s3.py [puerto]
+#      S3_ENDPOINT_URL=http://127.0.0.1:9000 S3_BUCKET=bot STORAGE_BACKEND=s3 ...
+import re, sys, time, hashlib, datetime, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+_RANGO = re.compile(r"bytes=(\d*)-(\d*)$")
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *a):
+        pass
+
+    def _clave(self):
+        partes = urlsplit(self.path)
+        return unquote(partes.path), parse_qs(partes.query)
+
+    def _autorizado(self, query) -> bool:
+        if (self.headers.get("Authorization") or "").startswith("AWS4-HMAC-SHA256 "): return True
+        if "X-Amz-Signature" not in query: return False
+        inicio = datetime.datetime.strptime(query["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ")
+        vence = inicio + datetime.timedelta(seconds=int(query["X-Amz-Expires"][0]))
+        return datetime.datetime.utcnow() <= vence
+
+    def _error(self, status, codigo):
+        cuerpo = f"<?xml version=\"1.0\"?><Error><Code>{codigo}</Code></Error>".encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        if self.command != "HEAD": self.wfile.write(cuerpo)
+
+    def do_PUT(self):
+        clave, query = self._clave()
+        n = int(self.headers.get("Content-Length") or 0)
+        datos = self.rfile.read(n)
+        if not self._autorizado(query): return self._error(403, "AccessDenied")
+        etag = '"%s"' % hashlib.md5(datos).hexdigest()
+        with self.server.lock:
+            self.server.objetos[clave] = (datos, self.headers.get("Content-Type") or "application/octet-stream",
+                                          etag, self.date_time_string(time.time()))
+            self.server.puts += 1
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        clave, query = self._clave()
+        if not self._autorizado(query): return self._error(403, "AccessDenied")
+        obj = self.server.objetos.get(clave)
+        if obj is None: return self._error(404, "NoSuchKey")
+        datos, tipo, etag, mtime = obj
+        with self.server.lock: self.server.gets += 1
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304); self.send_header("ETag", etag); self.end_headers(); return
+        status, ini, fin = 200, 0, len(datos) - 1
+        m = _RANGO.match(self.headers.get("Range") or "")
+        if m and datos:
+            if m.group(1): ini, fin = int(m.group(1)), min(int(m.group(2) or fin), fin)
+            else: ini = max(0, len(datos) - int(m.group(2)))
+            if ini > fin: return self._error(416, "InvalidRange")
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(fin - ini + 1 if datos else 0))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", mtime)
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206: self.send_header("Content-Range", f"bytes {ini}-{fin}/{len(datos)}")
+        self.end_headers()
+        if self.command != "HEAD": self.wfile.write(datos[ini:fin + 1])
+
+    do_HEAD = do_GET
+
+    def do_DELETE(self):
+        clave, query = self._clave()
+        if not self._autorizado(query): return self._error(403, "AccessDenied")
+        with self.server.lock: self.server.objetos.pop(clave, None)
+        self.send_response(204); self.end_headers()
+
+def servidor(puerto: int = 9000) -> ThreadingHTTPServer:
+    srv = ThreadingHTTPServer(("127.0.0.1", puerto), _Handler)
+    srv.daemon_threads = True
+    srv.objetos, srv.lock = {}, threading.Lock()
+    srv.puts = srv.gets = 0
+    return srv
+
+if __name__ == "__main__":
+    puerto = int(sys.argv[1]) if len(sys.argv) > 1 else 9000
+    srv = servidor(puerto)
+    print(f"S3 falso en http://127.0.0.1:{puerto}", flush=True)
+    try: srv.serve_forever()
+    except KeyboardInterrupt: pass
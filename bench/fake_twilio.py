@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Twilio REST falso para pruebas de carga: acepta POST .../Messages.json, espera
+# una latencia configurable, responde 201 (o 429 con cierta probabilidad) y
+# cuenta los mensajes. El bot se apunta aquí con TWILIO_API_BASE_URL.
+# Uso: python bench/fake_twilio.py [puerto] [latencia_ms]
+import sys, json, time, uuid, random, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *a):
+        pass
+
+    def do_POST(self):
+        srv = self.server
+        n = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(n).decode("utf-8"))
+        if srv.latencia: time.sleep(srv.latencia * (0.5 + random.random()))
+        if not self.path.endswith("/Messages.json"):
+            return self._json(404, {"code": 20404, "message": "not found"})
+        if srv.tasa_429 and random.random() < srv.tasa_429:
+            with srv.lock: srv.rechazados += 1
+            return self._json(429, {"code": 20429, "message": "Too Many Requests"})
+        to = (form.get("To") or [""])[0]
+        with srv.lock:
+            srv.mensajes += 1
+            srv.por_destino[to] = srv.por_destino.get(to, 0) + 1
+            if form.get("MediaUrl"):
+                srv.con_media += 1
+                srv.primer_media.setdefault(to, time.perf_counter())
+        sid = "SM" + uuid.uuid4().hex
+        self._json(201, {"sid": sid, "status": "queued", "to": to, "from": (form.get("From") or [""])[0],
+                         "body": (form.get("Body") or [""])[0], "num_media": str(len(form.get("MediaUrl") or []))})
+
+    def _json(self, status, obj):
+        raw = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+class FakeTwilio(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, puerto: int = 0, latencia_ms: float = 80, tasa_429: float = 0.0):
+        super().__init__(("127.0.0.1", puerto), _Handler)
+        self.latencia = latencia_ms / 1000.0
+        self.tasa_429 = tasa_429
+        self.lock = threading.Lock()
+        self.mensajes = 0
+        self.con_media = 0
+        self.rechazados = 0
+        self.por_destino = {}
+        self.primer_media = {}     # destinatario -> perf_counter del primer mensaje con adjunto
+
+    def handle_error(self, request, client_address):
+        # El cliente cierra conexiones keep-alive al terminar: no es un error del servidor
+        if not isinstance(sys.exc_info()[1], (ConnectionError, OSError)): super().handle_error(request, client_address)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def arrancar(self):
+        threading.Thread(target=self.serve_forever, name="fake-twilio", daemon=True).start()
+        return self
+
+    def estado(self) -> dict:
+        return {"messages": self.mensajes, "with_media": self.con_media, "rejected_429": self.rechazados,
+                "recipients": len(self.por_destino)}
+
+if __name__ == "__main__":
+    srv = FakeTwilio(int(sys.argv[1]) if len(sys.argv) > 1 else 8099, float(sys.argv[2]) if len(sys.argv) > 2 else 80)
+    print("fake twilio en", srv.url, flush=True)
+    srv.serve_forever()
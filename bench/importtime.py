@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Presupuesto de arranque: mide `python -X importtime -c "import app"` (el mejor
+# de N intentos, con caché de bytecode caliente) y falla (exit 1) si pasa de
+# IMPORT_BUDGET_MS o si al importar se cargan módulos que deben ser perezosos
+# (redis, docxtpl, twilio.rest, prometheus_client...). REDIS_URL apunta a una
+# IP que no responde: si algo conecta al importar, el tiempo se dispara.
+# Uso: python bench/importtime.py [--budget-ms 400] [--runs 5] [--top 15]
+import os, sys, argparse, tempfile, subprocess
+
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PEREZOSOS = ("redis", "docxtpl", "docx", "lxml.etree", "twilio.rest", "prometheus_client", "docx2pdf")
+
+def _entorno(files_dir: str) -> dict:
+    env = dict(os.environ)
+    env.update({"FILES_DIR": files_dir, "REDIS_URL": "redis://10.255.255.1:6379/0", "TEMPLATE_PRELOAD": "false",
+                "TWILIO_ACCOUNT_SID": "AC" + "0" * 32, "TWILIO_AUTH_TOKEN": "x", "PYTHONPATH": BASE})
+    return env
+
+def _medir(env: dict):
+    # -> (microsegundos acumulados de `app`, [(acumulado, propio, módulo)])
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=BASE, env=env,
+                         capture_output=True, text=True, check=True).stderr
+    filas = []
+    for linea in err.splitlines():
+        if not linea.startswith("import time:") or "|" not in linea: continue
+        partes = linea[len("import time:"):].split("|")
+        try: filas.append((int(partes[1]), int(partes[0]), partes[2].rstrip()))
+        except ValueError: continue
+    total = next(c for c, _, m in filas if m.strip() == "app")
+    return total, filas
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "400")))
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=15)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = _entorno(tmp)
+        mejor = min((_medir(env) for _ in range(max(1, args.runs))), key=lambda r: r[0])
+        cargados = subprocess.run([sys.executable, "-c", "import sys, app; print('\\n'.join(sys.modules))"],
+                                  cwd=BASE, env=env, capture_output=True, text=True, check=True).stdout.split()
+    total, filas = mejor
+    print(f"import app: {total / 1000:.1f} ms (presupuesto {args.budget_ms:.0f} ms, mejor de {args.runs})")
+    print("más pesados (acumulado / propio, ms):")
+    for acum, propio, mod in sorted(filas, reverse=True)[1:args.top + 1]:
+        print(f"  {acum / 1000:8.1f} {propio / 1000:8.1f}  {mod}")
+
+    fallas = []
+    if total / 1000 > args.budget_ms: fallas.append(f"import app tarda {total / 1000:.1f} ms > {args.budget_ms:.0f} ms")
+    fallas += [f"{m} se importa al arrancar (debe ser perezoso)" for m in PEREZOSOS if m in cargados]
+    for f in fallas: print("FALLA:", f)
+    sys.exit(1 if fallas else 0)
+
+if __name__ == "__main__":
+    main()
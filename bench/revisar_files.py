@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Chequeo de regresión de GET /files (almacén local): el estado interno
+# (índices SQLite, locks) y cualquier nombre que no sea un archivo publicado
+# dan 404; una cotización publicada sí se sirve, con rangos, y un ETag vigente da
+# 304 aunque venga con Range. Sale con código 1 si algo falla.
+# Uso: python bench/revisar_files.py
+import os, sys, tempfile
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE)
+
+def main():
+    tmp = tempfile.mkdtemp(prefix="revisar_files_")
+    os.environ.update({"FILES_DIR": os.path.join(tmp, "out"), "STORAGE_BACKEND": "local",
+                       "TWILIO_ENABLED": "false", "TEMPLATE_PRELOAD": "false", "FILES_OFFLOAD": "none"})
+    import app
+    c = app.app.test_client()
+    docx, pdf = app._nuevos_nombres()
+    ruta = app._almacen.ruta_nueva(pdf)
+    with open(ruta, "wb") as f: f.write(b"%PDF-1.4 prueba\n")
+    app._almacen.registrar(pdf, ruta)
+    with open(os.path.join(app.FILES_DIR, ".oculto"), "wb") as f: f.write(b"x")
+    with open(os.path.join(app.FILES_DIR, "suelto.txt"), "wb") as f: f.write(b"x")
+
+    esperados = [(f"/files/{pdf}", 200)]
+    esperados += [(f"/files/{n}", 404) for n in (
+        ".almacen.sqlite", ".almacen.lock", ".cache_cotizaciones.sqlite", ".oculto", "suelto.txt",
+        "../app.py", "%2e%2e/app.py", os.path.relpath(ruta, app.FILES_DIR).replace(os.sep, "/"))]
+    etag = c.get(f"/files/{pdf}").headers["ETag"]
+    rango = {"Range": "bytes=0-3"}
+    esperados += [(f"/files/{pdf}", 206, rango), (f"/files/{pdf}", 304, {"If-None-Match": etag}),
+                  (f"/files/{pdf}", 304, {"If-None-Match": etag, **rango}),
+                  (f"/files/{pdf}", 206, {"If-None-Match": '"otro"', **rango})]
+    fallas = 0
+    for url, status, *cab in esperados:
+        r = c.get(url, headers=cab[0] if cab else None)
+        if cab: url += " " + " ".join(cab[0])
+        ok = r.status_code == status
+        fallas += not ok
+        print(f"{'ok   ' if ok else 'FALLA'} {url} -> {r.status_code} (esperado {status})")
+    sys.exit(1 if fallas else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Caché de cotizaciones direccionada por contenido
+#
+# Clave = sha256(hash de la plantilla + contexto de render). El contexto
+# incluye `fecha`, así que la clave cambia cada día y un PDF de ayer nunca se
+# reutiliza con la fecha vencida. El índice es un SQLite local en el directorio
+# de estado del almacén, fuera de FILES_DIR para que /files no lo sirva
+# (compartido por los workers del contenedor), con desalojo LRU por
+# cantidad de entradas y por bytes. Desalojar solo saca la entrada del índice:
+# la vida de los archivos la maneja el almacén (almacen.py).
+# -----------------------------------------------------------------------------
+import os, json, time, sqlite3, hashlib, logging, threading
+from almacen import dir_estado, mover_estado
+
+log = logging.getLogger("cache_cotizaciones")
+
+QUOTE_CACHE_ENABLED     = (os.getenv("QUOTE_CACHE", "true").lower() == "true")
+QUOTE_CACHE_MAX_ENTRIES = int(os.getenv("QUOTE_CACHE_MAX_ENTRIES", "2000"))
+QUOTE_CACHE_MAX_BYTES   = int(os.getenv("QUOTE_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+
+def clave_cotizacion(template_sha: str, ctx: dict) -> str:
+    raw = template_sha + "\n" + json.dumps(ctx, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class CacheCotizaciones:
+    def __init__(self, files_dir: str, almacen, db_path: str = ""):
+        # almacen: dice si un nombre existe y cuánto pesa (ver almacen.crear)
+        self.files_dir = files_dir
+        self.almacen = almacen
+        if not db_path:
+            db_path = os.path.join(dir_estado(files_dir), "cache_cotizaciones.sqlite")
+            mover_estado(os.path.join(files_dir, ".cache_cotizaciones.sqlite"), db_path)
+        self.db_path = db_path
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        with self._db() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS cotizaciones (
+                            clave TEXT PRIMARY KEY, docx TEXT NOT NULL, pdf TEXT NOT NULL,
+                            bytes INTEGER NOT NULL, fecha TEXT NOT NULL,
+                            creado REAL NOT NULL, usado REAL NOT NULL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_cot_usado ON cotizaciones(usado)")
+
+    def _db(self) -> sqlite3.Connection:
+        # Una conexión por hilo y por proceso (no se comparte tras fork)
+        con = getattr(self._local, "con", None)
+        if con is None or getattr(self._local, "pid", None) != os.getpid():
+            con = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            self._local.con, self._local.pid = con, os.getpid()
+        return con
+
+    def _existe(self, name: str) -> bool:
+        return self.almacen.existe(name)
+
+    def buscar(self, clave: str):
+        if not QUOTE_CACHE_ENABLED: return None
+        db = self._db()
+        row = db.execute("SELECT docx, pdf FROM cotizaciones WHERE clave=?", (clave,)).fetchone()
+        # docx vacío: la cotización se guardó solo en PDF
+        if row and (not row[0] or self._existe(row[0])) and self._existe(row[1]):
+            db.execute("UPDATE cotizaciones SET usado=? WHERE clave=?", (time.time(), clave))
+            self.hits += 1
+            return row[0], row[1]
+        if row:
+            db.execute("DELETE FROM cotizaciones WHERE clave=?", (clave,))
+        self.misses += 1
+        return None
+
+    def guardar(self, clave: str, docx_name: str, pdf_name: str, fecha: str = ""):
+        if not QUOTE_CACHE_ENABLED: return
+        size = 0
+        for n in filter(None, (docx_name, pdf_name)):
+            try: size += self.almacen.tamano(n) or 0
+            except Exception: pass
+        now = time.time()
+        self._db().execute("INSERT OR REPLACE INTO cotizaciones VALUES (?,?,?,?,?,?,?)",
+                           (clave, docx_name, pdf_name, size, fecha, now, now))
+        try: self.desalojar(fecha_vigente=fecha)
+        except Exception as e: log.warning("Desalojo de caché falló: %s", e)
+
+    def desalojar(self, fecha_vigente: str = ""):
+        db = self._db()
+        # Entradas de otro día nunca vuelven a acertar: salen primero
+        if fecha_vigente:
+            for docx, pdf in db.execute("SELECT docx, pdf FROM cotizaciones WHERE fecha<>?", (fecha_vigente,)).fetchall():
+                self._borrar(db, docx, pdf)
+        n, total = db.execute("SELECT COUNT(*), COALESCE(SUM(bytes),0) FROM cotizaciones").fetchone()
+        if n <= QUOTE_CACHE_MAX_ENTRIES and total <= QUOTE_CACHE_MAX_BYTES: return
+        for docx, pdf, size in db.execute("SELECT docx, pdf, bytes FROM cotizaciones ORDER BY usado ASC").fetchall():
+            if n <= QUOTE_CACHE_MAX_ENTRIES and total <= QUOTE_CACHE_MAX_BYTES: break
+            self._borrar(db, docx, pdf)
+            n -= 1; total -= size
+
+    def _borrar(self, db, docx: str, pdf: str):
+        db.execute("DELETE FROM cotizaciones WHERE docx=? AND pdf=?", (docx, pdf))
+
+    def estado(self) -> dict:
+        try: n, total = self._db().execute("SELECT COUNT(*), COALESCE(SUM(bytes),0) FROM cotizaciones").fetchone()
+        except Exception: n, total = -1, -1
+        return {"enabled": QUOTE_CACHE_ENABLED, "hits": self.hits, "misses": self.misses,
+                "entries": n, "bytes": total}
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Clasificación de textos de servicio / cámara / área
+#
+# Un texto se normaliza una sola vez (sin tildes, emojis ni símbolos, en
+# minúsculas; memoizado) y se recorre una sola vez con un regex compilado que
+# reconoce todas las familias de palabras clave a la vez. clasificar() arma un
+# resultado tipado (dominio, clave de precio, clave de piscina, tipo de cámara,
+# exterior) y también queda memoizado: las etiquetas se repiten mucho.
+# -----------------------------------------------------------------------------
+import os, re, unicodedata
+from functools import lru_cache
+from typing import NamedTuple
+
+CLASIF_CACHE_SIZE = int(os.getenv("CLASSIFY_CACHE_SIZE", "4096"))
+
+# familia -> palabras clave (se buscan como subcadenas del texto normalizado)
+FAMILIAS = {
+    "piscina":      ("piscin",),
+    "plaga":        ("plaga", "sanitiz"),
+    "desratiz":     ("desratiz",),
+    "desinfecc":    ("desinfecc",),
+    "desinsect":    ("desinsect",),
+    "camara":       ("camar",),
+    "p_intermedio": ("plan intermedio",),
+    "tratamiento":  ("tratamient",),
+    "limpieza":     ("limpiez",),
+    "p_bomba":      ("bomba", "filtro", "mantencion"),
+    "p_shock":      ("shock", "clor"),
+    "p_diag":       ("diagn",),
+    "p_arena":      ("arena", "carga"),
+    "c_dvr":        ("dvr", "grabador"),
+    "c_inalam":     ("inalam", "wi fi", "wifi"),
+    "c_solar":      ("sola",),
+    "exterior":     ("exterior", "patio", "jardin", "porton", "entrada", "estacionamiento",
+                     "perimetro", "terraza", "muro"),
+}
+
+# Búsqueda anticipada en cada posición: encuentra palabras que se solapan
+# (igual que `kw in texto`) en una sola pasada
+_RE_FAMILIAS = re.compile("(?=(?:" + "|".join(
+    f"(?P<{fam}>{'|'.join(re.escape(k) for k in sorted(kws, key=len, reverse=True))})"
+    for fam, kws in FAMILIAS.items()) + "))")
+_RE_EMOJI = re.compile(r"[\u2460-\u24FF\u2600-\u27BF\ufe0f\u200d]")
+_RE_NO_ALNUM = re.compile(r"[^a-z0-9]+")
+
+class Clasificacion(NamedTuple):
+    dominio: str          # plagas | piscinas | camaras | otro
+    servicio_precio: str  # desinsectacion | desratizacion | desinfeccion
+    piscina_key: str      # clave de precios.piscinas o ""
+    tipo_camara: str      # alambricas | inalambricas | solares | dvr
+    exterior: bool
+
+@lru_cache(maxsize=CLASIF_CACHE_SIZE)
+def normalizar(texto: str) -> str:
+    t = _RE_EMOJI.sub("", texto or "")
+    t = "".join(c for c in unicodedata.normalize("NFKD", t) if not unicodedata.combining(c))
+    return _RE_NO_ALNUM.sub(" ", t.lower()).strip()
+
+@lru_cache(maxsize=CLASIF_CACHE_SIZE)
+def familias(texto: str) -> frozenset:
+    return frozenset(m.lastgroup for m in _RE_FAMILIAS.finditer(normalizar(texto)))
+
+def _dominio(f: frozenset) -> str:
+    if "piscina" in f: return "piscinas"
+    if f & {"plaga", "desratiz", "desinsect"}: return "plagas"
+    if "camara" in f: return "camaras"
+    return "otro"
+
+def _servicio_precio(f: frozenset) -> str:
+    if "desratiz" in f:  return "desratizacion"
+    if "desinfecc" in f: return "desinfeccion"
+    return "desinsectacion"
+
+def _piscina_key(f: frozenset) -> str:
+    if "p_intermedio" in f or {"tratamiento", "limpieza"} <= f: return "piscina_plan_intermedio_m3"
+    if "p_bomba" in f: return "piscina_mantencion_bomba_m3"
+    if "p_shock" in f: return "piscina_shock_m3"
+    if "p_diag" in f:  return "piscina_diagnostico_total"
+    if "p_arena" in f: return "piscina_cambio_arena_total"
+    return ""
+
+def _tipo_camara(f: frozenset) -> str:
+    if "c_dvr" in f:    return "dvr"
+    if "c_inalam" in f: return "inalambricas"
+    if "c_solar" in f:  return "solares"
+    return "alambricas"
+
+@lru_cache(maxsize=CLASIF_CACHE_SIZE)
+def clasificar(servicio: str, tipo_camara: str = "", area: str = "") -> Clasificacion:
+    fs = familias(servicio)
+    tipo = _tipo_camara(familias(tipo_camara))
+    return Clasificacion(_dominio(fs), _servicio_precio(fs), _piscina_key(fs), tipo,
+                         tipo == "solares" or "exterior" in familias(area))
+
+def estado() -> dict:
+    i = clasificar.cache_info()
+    return {"hits": i.hits, "misses": i.misses, "size": i.currsize, "max": i.maxsize}
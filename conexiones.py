@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Cliente Redis por proceso, creado al primer uso
+#
+# Importar app.py ya no conecta (ni importa redis-py): RedisPorProceso se pasa
+# a sesiones / precios / trabajos en lugar del cliente y resuelve el cliente
+# real en cada worker la primera vez que se usa, después del fork de gunicorn
+# (también con --preload), así ningún socket abierto en el master termina
+# compartido entre workers. Si Redis no responde al conectar, se reintenta
+# cada REDIS_RETRY_SECONDS; mientras tanto las llamadas levantan
+# ConnectionError y cada módulo usa su respaldo (memoria, cola local...).
+# Los comandos bloqueantes (BLMOVE de trabajos.py) usan otro cliente, de
+# bloqueante(): su socket espera más que el comando, el normal no.
+# -----------------------------------------------------------------------------
+import os, time, logging, threading
+
+log = logging.getLogger("conexiones")
+
+REDIS_RETRY_SECONDS = float(os.getenv("REDIS_RETRY_SECONDS", "30"))
+
+class RedisPorProceso:
+    def __init__(self, url: str, socket_timeout: float = 2.0, connect_timeout: float = 0.0):
+        self.url = url
+        self.socket_timeout = socket_timeout
+        self.connect_timeout = connect_timeout or socket_timeout
+        self._pid = None
+        self._cli = None
+        self._reintentar = 0.0
+        self._lock = threading.Lock()
+
+    def cliente(self):
+        # -> redis.Redis de este proceso, o None si no se pudo conectar
+        if self._pid == os.getpid() and (self._cli is not None or time.monotonic() < self._reintentar):
+            return self._cli
+        with self._lock:
+            if self._pid != os.getpid() or (self._cli is None and time.monotonic() >= self._reintentar):
+                self._pid, self._cli = os.getpid(), self._conectar()
+                if self._cli is None: self._reintentar = time.monotonic() + REDIS_RETRY_SECONDS
+            return self._cli
+
+    def _conectar(self):
+        import redis
+        try:
+            cli = redis.from_url(self.url, decode_responses=True, socket_timeout=self.socket_timeout,
+                                 socket_connect_timeout=self.connect_timeout, health_check_interval=30)
+            cli.ping()
+            log.info("Conectado a Redis correctamente (pid %s).", os.getpid())
+            return cli
+        except Exception as e:
+            log.warning("No se pudo conectar a Redis: %s. Reintento en %ss.", e, REDIS_RETRY_SECONDS)
+            return None
+
+    def bloqueante(self, espera: float) -> "RedisPorProceso":
+        # Conexiones aparte para comandos que esperan `espera` s en el servidor
+        return RedisPorProceso(self.url, self.socket_timeout + espera, self.connect_timeout)
+
+    def disponible(self) -> bool:
+        return self.cliente() is not None
+
+    def __getattr__(self, nombre):
+        cli = self.cliente()
+        if cli is None: raise ConnectionError("Redis no disponible")
+        return getattr(cli, nombre)
@@ -0,0 +1,581 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Pool de LibreOffice headless persistente (DOCX -> PDF)
+#
+# Cada instancia es un `soffice` de larga vida con su propio perfil
+# (-env:UserInstallation) que escucha en un pipe UNO propio. Las conversiones
+# se hacen por el puente UNO sin volver a arrancar la suite. Si el módulo
+# `uno` no está disponible (p. ej. desarrollo local), el pool cae a modo "cli":
+# un `soffice --convert-to` por conversión, pero con un perfil fijo por slot
+# para que dos conversiones concurrentes no peleen por el mismo perfil.
+#
+# Admisión (común a todos los workers del contenedor):
+# - LO_MAX_CONCURRENT conversiones a la vez (por defecto según CPU y memoria
+#   del cgroup), con cupos en archivos + flock: si un worker muere el kernel
+#   suelta su cupo.
+# - Hasta LO_QUEUE_MAX esperando (LO_ACQUIRE_TIMEOUT como máximo); si la cola
+#   está llena, ConversorSaturado de inmediato con un Retry-After estimado.
+# - Cada conversión tiene plazo (LO_CONVERT_TIMEOUT) y al vencer se mata el
+#   grupo de procesos completo (soffice + soffice.bin).
+# - Los grupos de soffice quedan anotados por worker: limpiar_huerfanos() mata
+#   los de workers muertos (gunicorn child_exit y al crear cada pool).
+#
+# convertir_bytes()/convertir_lote_bytes(): DOCX en memoria -> PDF en memoria.
+# LibreOffice lee y escribe en un directorio de trabajo efímero en tmpfs
+# (/dev/shm si tiene espacio, LO_WORK_DIR para fijarlo), nunca en FILES_DIR.
+# -----------------------------------------------------------------------------
+import os, time, glob, random, shutil, signal, subprocess, threading, logging, queue, tempfile, atexit, contextlib
+import etapas
+
+try:
+    import fcntl
+except Exception:
+    fcntl = None
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+except Exception:
+    uno = None
+    PropertyValue = None
+
+log = logging.getLogger("conversor_lo")
+
+LO_POOL_SIZE        = max(1, int(os.getenv("LO_POOL_SIZE", "2")))
+LO_POOL_DIR         = os.getenv("LO_POOL_DIR") or os.path.join(tempfile.gettempdir(), "lo_pool")
+LO_CONVERT_TIMEOUT  = float(os.getenv("LO_CONVERT_TIMEOUT", "60"))
+LO_START_TIMEOUT    = float(os.getenv("LO_START_TIMEOUT", "30"))
+LO_HEALTH_INTERVAL  = float(os.getenv("LO_HEALTH_INTERVAL", "15"))
+# Espera máxima en cola + conversión debe caber en el timeout del worker (gunicorn --timeout 120)
+LO_ACQUIRE_TIMEOUT  = float(os.getenv("LO_ACQUIRE_TIMEOUT", "30"))
+LO_POOL_MODE        = (os.getenv("LO_POOL_MODE", "auto") or "auto").strip().lower()   # auto | uno | cli
+LO_MAX_CONCURRENT   = int(os.getenv("LO_MAX_CONCURRENT", "0"))      # 0 = según el contenedor
+LO_MEM_PER_CONVERSION_MB = int(os.getenv("LO_MEM_PER_CONVERSION_MB", "400"))
+LO_QUEUE_MAX        = int(os.getenv("LO_QUEUE_MAX", "0"))           # 0 = 2 x LO_MAX_CONCURRENT
+LO_WORK_DIR         = os.getenv("LO_WORK_DIR", "")
+_DIR_GRUPOS = os.path.join(LO_POOL_DIR, "grupos")
+_SHM = "/dev/shm"
+
+class ConversorSaturado(RuntimeError):
+    def __init__(self, msg: str, reintentar_en: float):
+        super().__init__(msg)
+        self.reintentar_en = reintentar_en
+
+def lo_bin():
+    for name in ("soffice", "libreoffice"):
+        if shutil.which(name):
+            return name
+    return None
+
+def _prop(name, value):
+    p = PropertyValue(); p.Name = name; p.Value = value
+    return p
+
+def _file_url(path: str) -> str:
+    return uno.systemPathToFileUrl(os.path.abspath(path))
+
+def _kill_group(proc):
+    if not proc: return
+    # El lanzador puede haber salido dejando a soffice.bin vivo en el grupo
+    try: os.killpg(proc.pid, signal.SIGKILL)
+    except Exception:
+        try: proc.kill()
+        except Exception: pass
+    try: proc.wait(timeout=5)
+    except Exception: pass
+    _quitar_grupo(proc.pid)
+
+# ---- grupos de soffice por worker (para limpiar huérfanos) -------------------
+def _anotar_grupo(pgid: int):
+    try:
+        os.makedirs(_DIR_GRUPOS, exist_ok=True)
+        open(os.path.join(_DIR_GRUPOS, f"{os.getpid()}_{pgid}"), "w").close()
+    except OSError as e:
+        log.debug("No se pudo anotar el grupo %s: %s", pgid, e)
+
+def _quitar_grupo(pgid: int):
+    try: os.remove(os.path.join(_DIR_GRUPOS, f"{os.getpid()}_{pgid}"))
+    except OSError: pass
+
+def _vivo(pid: int) -> bool:
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except OSError: pass
+    return True
+
+def _es_soffice(pid: int) -> bool:
+    # Contra pids reciclados: solo se mata si el líder del grupo sigue siendo LibreOffice
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f: return b"office" in f.read()
+    except FileNotFoundError: return not os.path.isdir("/proc")
+    except OSError: return False
+
+def limpiar_huerfanos(pid_worker: int = 0) -> int:
+    # Mata los grupos de soffice de un worker muerto (o de todos los muertos) y borra sus perfiles
+    muertos, n = set(), 0
+    try: entradas = os.listdir(_DIR_GRUPOS)
+    except OSError: entradas = []
+    for nombre in entradas:
+        try: wpid, pgid = (int(x) for x in nombre.split("_"))
+        except ValueError: continue
+        if (pid_worker and wpid != pid_worker) or (not pid_worker and _vivo(wpid)): continue
+        muertos.add(wpid)
+        if _es_soffice(pgid):
+            try: os.killpg(pgid, signal.SIGKILL); n += 1
+            except OSError: pass
+        try: os.remove(os.path.join(_DIR_GRUPOS, nombre))
+        except OSError: pass
+    for perfil in glob.glob(os.path.join(LO_POOL_DIR, "perfil_*_*")):
+        try: wpid = int(os.path.basename(perfil).split("_")[1])
+        except ValueError: continue
+        if wpid in muertos or wpid == pid_worker or (not pid_worker and wpid != os.getpid() and not _vivo(wpid)):
+            shutil.rmtree(perfil, ignore_errors=True)
+    for base in {LO_WORK_DIR or _SHM, tempfile.gettempdir()}:
+        for d in glob.glob(os.path.join(base, "lo_trabajo_*_*")):
+            try: wpid = int(os.path.basename(d).split("_")[2])
+            except (ValueError, IndexError): continue
+            if wpid in muertos or wpid == pid_worker or (not pid_worker and wpid != os.getpid() and not _vivo(wpid)):
+                shutil.rmtree(d, ignore_errors=True)
+    if n: log.warning("Se mataron %s grupos de LibreOffice huérfanos", n)
+    return n
+
+def _base_trabajo(necesario: int) -> str:
+    # tmpfs si entra con holgura (en Docker /dev/shm es de 64 MB por defecto); si no, el temp local
+    if LO_WORK_DIR: return LO_WORK_DIR
+    try:
+        st = os.statvfs(_SHM)
+        if os.access(_SHM, os.W_OK) and st.f_bavail * st.f_frsize > 4 * necesario + 16 * 1024 * 1024:
+            return _SHM
+    except (OSError, AttributeError):
+        pass
+    return tempfile.gettempdir()
+
+@contextlib.contextmanager
+def espacio_trabajo(necesario: int = 0):
+    d = tempfile.mkdtemp(prefix=f"lo_trabajo_{os.getpid()}_", dir=_base_trabajo(necesario))
+    try: yield d
+    finally: shutil.rmtree(d, ignore_errors=True)
+
+def _leer(path: str) -> bytes:
+    with open(path, "rb") as f: return f.read()
+
+def _escribir(path: str, datos: bytes):
+    with open(path, "wb") as f: f.write(datos)
+
+def _ejecutar(cmd, timeout: float):
+    # soffice lanza soffice.bin como hijo: al vencer el plazo se mata el grupo, no solo el lanzador
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    _anotar_grupo(proc.pid)
+    try:
+        _, err = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_group(proc)
+        raise RuntimeError(f"Conversión excedió {timeout:.0f}s")
+    except BaseException:
+        _kill_group(proc); raise
+    _kill_group(proc)    # por si soffice.bin quedó vivo tras salir el lanzador
+    if proc.returncode != 0:
+        raise RuntimeError(f"LibreOffice falló ({proc.returncode}): {err.decode('utf-8', 'replace')[-300:]}")
+
+# ---- admisión -----------------------------------------------------------------
+def _cpus() -> int:
+    try: n = len(os.sched_getaffinity(0))
+    except Exception: n = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f: cuota, periodo = f.read().split()
+        if cuota != "max": n = min(n, max(1, int(cuota) // int(periodo)))
+    except Exception:
+        pass
+    return n
+
+def _memoria() -> int:
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f: v = f.read().strip()
+            if v != "max" and int(v) < (1 << 60): return int(v)
+        except Exception:
+            pass
+    try: return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except Exception: return 0
+
+def cupos_contenedor() -> int:
+    if LO_MAX_CONCURRENT > 0: return LO_MAX_CONCURRENT
+    n, mem = _cpus(), _memoria()
+    if mem: n = min(n, mem // (LO_MEM_PER_CONVERSION_MB * 1024 * 1024))
+    return max(1, n)
+
+class Admision:
+    # Semáforo del contenedor: cupos "cupo_<i>" y tickets de espera "cola_<i>" como
+    # archivos con flock (cada intento abre su propio descriptor, así también separa
+    # hilos del mismo proceso). Sin fcntl (Windows) los cupos son por proceso.
+    def __init__(self, cupos: int = 0, cola: int = -1, directorio: str = ""):
+        self.cupos = cupos or cupos_contenedor()
+        self.cola = cola if cola >= 0 else (LO_QUEUE_MAX or 2 * self.cupos)
+        self.dir = directorio or os.path.join(LO_POOL_DIR, "admision")
+        os.makedirs(self.dir, exist_ok=True)
+        self._locks = {}
+        self.rechazos = 0
+        self.duracion = 5.0     # media móvil de una conversión, para estimar Retry-After
+
+    def _tomar(self, tipo: str, n: int):
+        orden = list(range(n)); random.shuffle(orden)
+        for i in orden:
+            if fcntl is None:
+                lk = self._locks.setdefault((tipo, i), threading.Lock())
+                if lk.acquire(blocking=False): return lk
+                continue
+            fd = os.open(os.path.join(self.dir, f"{tipo}_{i}"), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    @staticmethod
+    def _soltar(ficha):
+        if isinstance(ficha, int): os.close(ficha)     # cerrar suelta el flock
+        else: ficha.release()
+
+    def reintentar_en(self) -> float:
+        # Tiempo para que se vacíe la cola completa, redondeado hacia arriba
+        return float(max(1, int(self.duracion * (self.cola + self.cupos) / self.cupos + 0.999)))
+
+    def _saturado(self, motivo: str):
+        self.rechazos += 1
+        return ConversorSaturado(f"Conversor saturado ({motivo})", self.reintentar_en())
+
+    def entrar(self, espera: float):
+        # -> ficha del cupo (devolver con salir); ConversorSaturado si la cola está llena o vence la espera
+        cupo = self._tomar("cupo", self.cupos)
+        if cupo is not None: return cupo, time.monotonic()
+        ticket = self._tomar("cola", self.cola) if self.cola else None
+        if ticket is None: raise self._saturado("cola llena")
+        try:
+            limite, pausa = time.monotonic() + espera, 0.02
+            while cupo is None:
+                if time.monotonic() >= limite: raise self._saturado(f"espera de {espera:.0f}s agotada")
+                time.sleep(pausa); pausa = min(pausa * 2, 0.2)
+                cupo = self._tomar("cupo", self.cupos)
+        finally:
+            self._soltar(ticket)
+        return cupo, time.monotonic()
+
+    def intentar(self):
+        # -> ficha si hay un cupo libre ahora mismo, si no None (sin cola ni espera)
+        cupo = self._tomar("cupo", self.cupos)
+        return None if cupo is None else (cupo, time.monotonic())
+
+    def salir(self, ficha):
+        cupo, t0 = ficha
+        self._soltar(cupo)
+        self.duracion = 0.8 * self.duracion + 0.2 * (time.monotonic() - t0)
+
+    def hay_lugar(self) -> bool:
+        # Sondeo sin esperar: un cupo libre o un lugar en la cola
+        for tipo, n in (("cupo", self.cupos), ("cola", self.cola)):
+            f = self._tomar(tipo, n) if n else None
+            if f is not None:
+                self._soltar(f); return True
+        return False
+
+    def libre(self) -> bool:
+        # Sondeo sin esperar: un cupo libre ahora mismo (la cola no cuenta)
+        f = self._tomar("cupo", self.cupos)
+        if f is None: return False
+        self._soltar(f); return True
+
+    def estado(self) -> dict:
+        return {"slots": self.cupos, "queue_max": self.cola, "rejected": self.rechazos,
+                "avg_convert_seconds": round(self.duracion, 2), "shared": fcntl is not None}
+
+class _InstanciaLO:
+    def __init__(self, idx: int, bin_lo: str, modo: str):
+        self.idx = idx
+        self.bin_lo = bin_lo
+        self.modo = modo
+        self.perfil = os.path.join(LO_POOL_DIR, f"perfil_{os.getpid()}_{idx}")
+        self.pipe = f"lo_pool_{os.getpid()}_{idx}"
+        self.proc = None
+        self.desktop = None
+        self.conversiones = 0
+        self.reinicios = 0
+        self.ultimo_error = ""
+
+    def _perfil_url(self) -> str:
+        return "file://" + os.path.abspath(self.perfil)
+
+    def iniciar(self):
+        os.makedirs(self.perfil, exist_ok=True)
+        if self.modo != "uno": return
+        self.detener()
+        cmd = [self.bin_lo, "--headless", "--invisible", "--nologo", "--nodefault", "--norestore",
+               "--nolockcheck", f"-env:UserInstallation={self._perfil_url()}",
+               f"--accept=pipe,name={self.pipe};urp;StarOffice.ComponentContext"]
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                     start_new_session=True)
+        _anotar_grupo(self.proc.pid)
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+        limite = time.monotonic() + LO_START_TIMEOUT
+        while True:
+            try:
+                ctx = resolver.resolve(f"uno:pipe,name={self.pipe};urp;StarOffice.ComponentContext")
+                self.desktop = ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+                return
+            except Exception as e:
+                if self.proc.poll() is not None or time.monotonic() > limite:
+                    self.ultimo_error = f"arranque: {e}"
+                    self.detener()
+                    raise RuntimeError(f"LibreOffice #{self.idx} no arrancó: {e}")
+                time.sleep(0.25)
+
+    def detener(self):
+        self.desktop = None
+        _kill_group(self.proc)
+        self.proc = None
+
+    def reiniciar(self):
+        self.reinicios += 1
+        log.warning("Reiniciando LibreOffice #%s (%s)", self.idx, self.ultimo_error or "health check")
+        self.iniciar()
+
+    def sano(self) -> bool:
+        if self.modo != "uno": return True
+        if not self.proc or self.proc.poll() is not None or self.desktop is None: return False
+        try:
+            self.desktop.getFrames()
+            return True
+        except Exception as e:
+            self.ultimo_error = f"health: {e}"
+            return False
+
+    def convertir(self, docx_path: str, pdf_path: str):
+        if self.modo == "uno": self._convertir_uno(docx_path, pdf_path)
+        else:                  self._convertir_cli(docx_path, pdf_path)
+        self.conversiones += 1
+
+    def convertir_lote(self, pares) -> dict:
+        # Varias conversiones con una sola invocación: un soffice con N archivos
+        # en modo cli, o la misma instancia caliente en modo uno.
+        errores = {}
+        if self.modo == "uno":
+            for docx_path, pdf_path in pares:
+                try: self._convertir_uno(docx_path, pdf_path); self.conversiones += 1
+                except Exception as e:
+                    errores[docx_path] = str(e)
+                    if not self.sano(): self.reiniciar()
+            return errores
+        por_dir = {}
+        for docx_path, pdf_path in pares:
+            por_dir.setdefault(os.path.dirname(pdf_path), []).append((docx_path, pdf_path))
+        for outdir, grupo in por_dir.items():
+            cmd = [self.bin_lo, "--headless", "--norestore", f"-env:UserInstallation={self._perfil_url()}",
+                   "--convert-to", "pdf", "--outdir", outdir] + [d for d, _ in grupo]
+            try:
+                _ejecutar(cmd, LO_CONVERT_TIMEOUT * len(grupo))
+            except Exception as e:
+                for d, _ in grupo: errores[d] = str(e)
+                continue
+            for docx_path, pdf_path in grupo:
+                generated = os.path.join(outdir, os.path.splitext(os.path.basename(docx_path))[0] + ".pdf")
+                if os.path.exists(generated) and generated != pdf_path:
+                    os.replace(generated, pdf_path)
+                if os.path.exists(pdf_path): self.conversiones += 1
+                else: errores[docx_path] = "LibreOffice no generó el PDF"
+        return errores
+
+    def _convertir_uno(self, docx_path: str, pdf_path: str):
+        # Watchdog: si la conversión se cuelga matamos el proceso; la llamada UNO
+        # bloqueada falla de inmediato y la instancia se reinicia.
+        colgado = threading.Event()
+        def _matar():
+            colgado.set(); _kill_group(self.proc)
+        timer = threading.Timer(LO_CONVERT_TIMEOUT, _matar); timer.daemon = True; timer.start()
+        doc = None
+        try:
+            doc = self.desktop.loadComponentFromURL(_file_url(docx_path), "_blank", 0, (_prop("Hidden", True),))
+            if doc is None:
+                raise RuntimeError("LibreOffice no pudo abrir el DOCX")
+            doc.storeToURL(_file_url(pdf_path), (_prop("FilterName", "writer_pdf_Export"),))
+        except Exception as e:
+            if colgado.is_set():
+                raise RuntimeError(f"Conversión excedió {LO_CONVERT_TIMEOUT:.0f}s")
+            raise RuntimeError(f"LibreOffice falló: {e}")
+        finally:
+            timer.cancel()
+            if doc is not None:
+                try: doc.close(True)
+                except Exception: pass
+
+    def _convertir_cli(self, docx_path: str, pdf_path: str):
+        outdir = os.path.dirname(pdf_path)
+        cmd = [self.bin_lo, "--headless", "--norestore", f"-env:UserInstallation={self._perfil_url()}",
+               "--convert-to", "pdf", "--outdir", outdir, docx_path]
+        _ejecutar(cmd, LO_CONVERT_TIMEOUT)
+        base_pdf = os.path.splitext(os.path.basename(docx_path))[0] + ".pdf"
+        generated = os.path.join(outdir, base_pdf)
+        if os.path.exists(generated) and generated != pdf_path:
+            os.replace(generated, pdf_path)
+
+class PoolLibreOffice:
+    def __init__(self, size: int = LO_POOL_SIZE, modo: str = LO_POOL_MODE):
+        self.pid = os.getpid()
+        self.bin_lo = lo_bin()
+        if modo == "auto": modo = "uno" if uno is not None else "cli"
+        if modo == "uno" and uno is None:
+            log.warning("LO_POOL_MODE=uno pero el módulo 'uno' no está disponible; usando modo cli.")
+            modo = "cli"
+        self.modo = modo
+        self.size = size
+        self.instancias = [_InstanciaLO(i, self.bin_lo, modo) for i in range(size)] if self.bin_lo else []
+        self._libres = queue.Queue()
+        self._listo = threading.Event()
+        self._detener = threading.Event()
+        self._arrancado = False
+        self._lock = threading.Lock()
+        self.admision = Admision()
+
+    def arrancar(self):
+        with self._lock:
+            if self._arrancado or not self.bin_lo: return
+            self._arrancado = True
+        try: limpiar_huerfanos()
+        except Exception as e: log.warning("Limpieza de LibreOffice huérfanos falló: %s", e)
+        threading.Thread(target=self._arrancar_instancias, name="lo-pool-start", daemon=True).start()
+
+    def _arrancar_instancias(self):
+        for inst in self.instancias:
+            try:
+                inst.iniciar()
+                self._libres.put(inst); self._listo.set()
+            except Exception as e:
+                log.error("No se pudo iniciar LibreOffice #%s: %s", inst.idx, e)
+                # Queda en el pool igual; el health check lo reintenta.
+                self._libres.put(inst)
+        if self.modo == "uno":
+            threading.Thread(target=self._health_loop, name="lo-pool-health", daemon=True).start()
+
+    def _health_loop(self):
+        while not self._detener.wait(LO_HEALTH_INTERVAL):
+            # Solo revisamos instancias libres; las ocupadas tienen su propio watchdog.
+            for _ in range(len(self.instancias)):
+                try: inst = self._libres.get_nowait()
+                except queue.Empty: break
+                try:
+                    if not inst.sano(): inst.reiniciar()
+                except Exception as e:
+                    log.error("Health check LibreOffice #%s: %s", inst.idx, e)
+                finally:
+                    self._libres.put(inst)
+            if any(i.sano() for i in self.instancias): self._listo.set()
+            else: self._listo.clear()
+
+    @contextlib.contextmanager
+    def _turno(self, solo_libre: bool = False):
+        # convert_wait: cupo del contenedor + instancia libre (en curso = cola del conversor).
+        # solo_libre: trabajo de fondo; toma un cupo solo si está libre ya, sin entrar a la
+        # cola, y lo retiene hasta terminar (ConversorSaturado si no hay)
+        t0 = etapas.entrar("convert_wait")
+        try:
+            ficha = self.admision.intentar() if solo_libre else self.admision.entrar(LO_ACQUIRE_TIMEOUT)
+            if ficha is None: raise ConversorSaturado("Sin cupo libre", self.admision.reintentar_en())
+        except ConversorSaturado:
+            etapas.salir("convert_wait", t0, False, "saturado"); raise
+        try: inst = self._libres.get(block=not solo_libre, timeout=LO_ACQUIRE_TIMEOUT)
+        except queue.Empty:
+            self.admision.salir(ficha)
+            etapas.salir("convert_wait", t0, False, "pool_saturado")
+            raise ConversorSaturado("No hay instancias de LibreOffice libres (pool saturado)",
+                                    self.admision.reintentar_en())
+        etapas.salir("convert_wait", t0)
+        try: yield inst
+        finally:
+            self._libres.put(inst)
+            self.admision.salir(ficha)
+
+    def hay_lugar(self) -> bool:
+        return self.admision.hay_lugar()
+
+    def libre(self) -> bool:
+        # Cupo del contenedor e instancia de este worker libres ahora mismo
+        return bool(self.bin_lo) and not self._libres.empty() and self.admision.libre()
+
+    def convertir(self, docx_path: str, pdf_path: str, solo_libre: bool = False) -> None:
+        if not self.bin_lo:
+            raise RuntimeError("LibreOffice no está disponible en el contenedor.")
+        self.arrancar()
+        with self._turno(solo_libre) as inst:
+            if not inst.sano(): inst.reiniciar()
+            try:
+                inst.convertir(docx_path, pdf_path)
+            except Exception as e:
+                inst.ultimo_error = str(e)
+                if not inst.sano():
+                    try: inst.reiniciar()
+                    except Exception as e2: log.error("Reinicio LibreOffice #%s falló: %s", inst.idx, e2)
+                raise
+        if not os.path.exists(pdf_path):
+            raise RuntimeError("LibreOffice no generó el PDF")
+
+    def convertir_lote(self, pares) -> dict:
+        pares = list(pares)
+        if not pares: return {}
+        if not self.bin_lo:
+            raise RuntimeError("LibreOffice no está disponible en el contenedor.")
+        self.arrancar()
+        with self._turno() as inst:
+            if not inst.sano(): inst.reiniciar()
+            return inst.convertir_lote(pares)
+
+    def convertir_bytes(self, docx: bytes, solo_libre: bool = False) -> bytes:
+        with espacio_trabajo(len(docx)) as d:
+            entrada, salida = os.path.join(d, "cotizacion.docx"), os.path.join(d, "cotizacion.pdf")
+            _escribir(entrada, docx)
+            self.convertir(entrada, salida, solo_libre)
+            return _leer(salida)
+
+    def convertir_lote_bytes(self, docs) -> list:
+        # -> un PDF (bytes) o la excepción por documento, en el mismo orden
+        docs = list(docs)
+        if not docs: return []
+        with espacio_trabajo(sum(len(x) for x in docs)) as d:
+            pares = [(os.path.join(d, f"doc_{i}.docx"), os.path.join(d, f"doc_{i}.pdf")) for i in range(len(docs))]
+            for (entrada, _), docx in zip(pares, docs): _escribir(entrada, docx)
+            errores = self.convertir_lote(pares)
+            res = []
+            for entrada, salida in pares:
+                if entrada in errores: res.append(RuntimeError(errores[entrada])); continue
+                try: res.append(_leer(salida))
+                except OSError: res.append(RuntimeError("LibreOffice no generó el PDF"))
+            return res
+
+    def listo(self) -> bool:
+        if not self.bin_lo: return False
+        if self.modo != "uno": return True
+        return self._listo.is_set()
+
+    def estado(self) -> dict:
+        return {
+            "modo": self.modo, "size": self.size, "ready": self.listo(),
+            "libres": self._libres.qsize(), "admission": self.admision.estado(),
+            "instancias": [{"idx": i.idx, "sana": i.sano(), "conversiones": i.conversiones,
+                            "reinicios": i.reinicios, "ultimo_error": i.ultimo_error} for i in self.instancias],
+        }
+
+    def cerrar(self):
+        self._detener.set()
+        for inst in self.instancias:
+            inst.detener()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def obtener_pool() -> PoolLibreOffice:
+    # Un pool por proceso: tras un fork (gunicorn) el hijo crea el suyo propio.
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = PoolLibreOffice()
+            atexit.register(_pool.cerrar)
+        return _pool
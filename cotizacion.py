@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Cotización calculada una sola vez
+#
+# calcular() toma el info normalizado y la tabla de precios vigente y, en una
+# pasada, clasifica los textos, busca los precios y arma medidas, líneas y
+# montos ya formateados. El resultado (Cotizacion) es inmutable: el contexto de
+# la plantilla, el mensaje al cliente, el resumen al admin y las respuestas
+# JSON se arman a partir de ese mismo valor, sin volver a clasificar ni a
+# consultar precios (y con una sola versión de precios por cotización).
+# -----------------------------------------------------------------------------
+import re
+from typing import NamedTuple
+import clasificacion
+
+def fmt_clp(v: int) -> str:
+    return f"${v:,}".replace(",", ".")
+
+def _num_txt(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else str(v)
+
+def _float(v) -> float:
+    try: return float(str(v).replace(",", ".")) if str(v or "").strip() else 0.0
+    except Exception: return 0.0
+
+def volumen_estimado_m3(info: dict) -> float:
+    for k in ("m3", "volumen", "volumen_m3"):
+        v = str(info.get(k, "") or "").strip()
+        if v:
+            try: return float(v.replace(",", "."))
+            except Exception: pass
+    m2, prof = _float(info.get("m2")), _float(info.get("profundidad"))
+    return round(m2 * prof, 1) if (m2 > 0 and prof > 0) else 0.0
+
+def cantidad_aproximada(opcion: str) -> int:
+    t = (opcion or "").lower()
+    if "1" in t and "2" in t: return 2
+    if "3" in t and "5" in t: return 4
+    if "mas" in t or "más" in t or "5" in t: return 6
+    m = re.search(r"\d+", t)
+    return int(m.group(0)) if m else 1
+
+def total_camaras(tp, c: clasificacion.Clasificacion, cantidad_opcion: str):
+    # -> (total, tipo, cantidad, unitario con descuento, área)
+    tipo = c.tipo_camara
+    qty  = cantidad_aproximada(cantidad_opcion)
+    area = "exterior" if c.exterior else "interior"
+    tabla = tp.camaras.get(tipo, {})
+    if area not in tabla: area = next(iter(tabla.keys()), "exterior")
+    unit = int(round(int(tabla.get(area, 0)) * tp.descuento(qty)))
+    return unit * qty, tipo, qty, unit, area
+
+class Linea(NamedTuple):
+    descripcion: str
+    cantidad: float
+    unidad: str
+    unitario: int
+    total: int
+    tramo: str = ""
+    precio_lista: int = 0     # cámaras: unitario antes del descuento por cantidad
+    descuento: float = 0.0
+
+    def a_dict(self) -> dict:
+        d = {"description": self.descripcion, "quantity": self.cantidad, "unit": self.unidad,
+             "unit_price": self.unitario, "total": self.total}
+        if self.tramo: d["tier"] = self.tramo
+        if self.unidad == "unidad":
+            d["list_price"] = self.precio_lista
+            d["discount"] = self.descuento
+        return d
+
+class Cotizacion(NamedTuple):
+    dominio: str            # plagas | piscinas | camaras | otro
+    servicio: str           # etiqueta tal como la eligió el cliente
+    total: int
+    total_fmt: str
+    lineas: tuple           # (Linea, ...)
+    m2: float
+    m2_txt: str
+    m3: float
+    m3_txt: str             # "" si no hay volumen
+    tipo_camara: str        # canónico (alambricas | inalambricas | solares | dvr)
+    area: str               # interior | exterior
+    cantidad: int
+    unitario_fmt: str       # cámaras: unitario con descuento
+    version_precios: str
+
+    def a_dict(self) -> dict:
+        return {"domain": self.dominio, "service": self.servicio, "total": self.total, "total_fmt": self.total_fmt,
+                "currency": "CLP", "items": [l.a_dict() for l in self.lineas], "price_version": self.version_precios}
+
+def calcular(info: dict, tp) -> Cotizacion:
+    label = info.get("servicio_label", "") or ""
+    c = clasificacion.clasificar(label, info.get("tipo_camara", "") or "", info.get("area_vigilar", "") or "")
+    m2 = _float(info.get("m2"))
+    m2_txt = _num_txt(m2) if m2 or not str(info.get("m2") or "").strip() else str(info.get("m2"))
+    m3 = volumen_estimado_m3(info) if c.dominio == "piscinas" else 0.0
+    total, lineas, qty, unit, area, tipo = 0, (), 1, 0, "", ""
+    if c.dominio == "piscinas":
+        key = c.piscina_key
+        total = tp.piscina(key, m3)
+        if total:
+            i = tp.tramo_m3(m3); tramo = tp.rango(tp.hasta_m3, i, "m³")
+            if key.endswith("_m3"): lineas = (Linea(label, m3, "m3", tp.piscinas[key][i], total, tramo),)
+            else:                   lineas = (Linea(label, 1, "servicio", total, total, tramo),)
+    elif c.dominio == "plagas":
+        total = tp.plaga(info.get("servicio_precio") or c.servicio_precio, info.get("m2") or 0)
+        if total: lineas = (Linea(label, 1, "servicio", total, total, tp.rango(tp.hasta_m2, tp.tramo_m2(info.get("m2") or 0), "m²")),)
+    elif c.dominio == "camaras":
+        total, tipo, qty, unit, area = total_camaras(tp, c, info.get("cantidad_camara", ""))
+        if total:
+            lineas = (Linea(f"Cámara {tipo} ({area})", qty, "unidad", unit, total,
+                            precio_lista=tp.camaras.get(tipo, {}).get(area, unit),
+                            descuento=round(1 - tp.descuento(qty), 4)),)
+    return Cotizacion(c.dominio, label, total, fmt_clp(total), lineas, m2, m2_txt,
+                      m3, _num_txt(m3) if m3 else "", tipo, area, qty, fmt_clp(unit), tp.version)
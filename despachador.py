@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Despachador de mensajes salientes (Twilio WhatsApp)
+#
+# - Una cola por destinatario: los mensajes a un mismo número salen en orden
+#   (texto -> PDF -> DOCX) aunque haya varios hilos enviando.
+# - Token bucket por número remitente en vez de time.sleep(MEDIA_DELAY).
+# - Reintentos con backoff exponencial + jitter ante 429/5xx/errores de red.
+# - Cliente Twilio con sesión HTTP keep-alive compartida.
+# - Quien encola recibe un Future y puede volver de inmediato.
+# - DespachadorAsync: lo mismo sobre asyncio y el cliente HTTP asíncrono de
+#   Twilio (modo ASGI, asgi.py); encolar() sigue llamándose desde hilos.
+# -----------------------------------------------------------------------------
+import os, time, random, asyncio, logging, threading, collections
+from concurrent.futures import Future
+import etapas
+
+log = logging.getLogger("despachador")
+
+OUTBOUND_WORKERS      = max(1, int(os.getenv("OUTBOUND_WORKERS", "4")))
+OUTBOUND_RATE_PER_SEC = float(os.getenv("OUTBOUND_RATE_PER_SEC", "5"))
+OUTBOUND_BURST        = float(os.getenv("OUTBOUND_BURST", "10"))
+OUTBOUND_MAX_ATTEMPTS = max(1, int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "4")))
+OUTBOUND_RETRY_BASE   = float(os.getenv("OUTBOUND_RETRY_BASE_SECONDS", "1"))
+OUTBOUND_HTTP_TIMEOUT = float(os.getenv("OUTBOUND_HTTP_TIMEOUT", "15"))
+# Solo DespachadorAsync: envíos simultáneos (no son hilos, son peticiones abiertas)
+OUTBOUND_ASYNC_CONCURRENCY = max(1, int(os.getenv("OUTBOUND_ASYNC_CONCURRENCY", "64")))
+# Solo pruebas de carga: apunta el cliente a un Twilio falso (bench/carga.py)
+TWILIO_API_BASE_URL   = (os.getenv("TWILIO_API_BASE_URL") or "").rstrip("/")
+
+def crear_cliente_twilio(sid: str, token: str):
+    if not (sid and token): return None
+    from twilio.rest import Client
+    from twilio.http.http_client import TwilioHttpClient
+    cli = Client(sid, token, http_client=TwilioHttpClient(pool_connections=True, timeout=OUTBOUND_HTTP_TIMEOUT))
+    if TWILIO_API_BASE_URL: cli.api.base_url = TWILIO_API_BASE_URL
+    return cli
+
+def crear_cliente_twilio_async(sid: str, token: str):
+    # Crear dentro del loop: AsyncTwilioHttpClient abre su sesión aiohttp al construirse
+    if not (sid and token): return None
+    from twilio.rest import Client
+    from twilio.http.async_http_client import AsyncTwilioHttpClient
+    cli = Client(sid, token, http_client=AsyncTwilioHttpClient(pool_connections=True))
+    if TWILIO_API_BASE_URL: cli.api.base_url = TWILIO_API_BASE_URL
+    return cli
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = max(rate, 0.001)
+        self.capacidad = max(burst, 1.0)
+        self.tokens = self.capacidad
+        self.t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _intentar(self) -> float:
+        # Toma un token y devuelve 0, o devuelve cuánto falta para el próximo
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacidad, self.tokens + (now - self.t) * self.rate)
+            self.t = now
+            if self.tokens >= 1:
+                self.tokens -= 1; return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def tomar(self):
+        # Bloquea lo justo hasta que haya un token
+        while True:
+            espera = self._intentar()
+            if not espera: return
+            time.sleep(espera)
+
+    async def tomar_async(self):
+        while True:
+            espera = self._intentar()
+            if not espera: return
+            await asyncio.sleep(espera)
+
+def _reintentable(e: Exception) -> bool:
+    status = getattr(e, "status", None)
+    if status is None: return True   # error de red / timeout
+    return status == 429 or status >= 500
+
+class Despachador:
+    def __init__(self, cliente, workers: int = OUTBOUND_WORKERS):
+        self.pid = os.getpid()
+        self.cliente = cliente
+        self.workers = workers
+        self._colas = {}                 # destinatario -> deque[(kwargs, future, t_encolado)]
+        self._listos = collections.deque()
+        self._en_curso = set()
+        self._cond = threading.Condition()
+        self._buckets = {}
+        self._arrancado = False
+        self.enviados = 0
+        self.fallidos = 0
+        self.reintentos = 0
+        self._latencias = collections.deque(maxlen=500)
+
+    def arrancar(self):
+        with self._cond:
+            if self._arrancado: return
+            self._arrancado = True
+        for i in range(self.workers):
+            threading.Thread(target=self._loop, name=f"twilio-out-{i}", daemon=True).start()
+
+    def encolar(self, from_: str, to: str, body: str = "", media_url=None) -> Future:
+        fut = Future()
+        kwargs = {"from_": from_, "to": to, "body": body}
+        if media_url: kwargs["media_url"] = list(media_url)
+        self.arrancar()
+        with self._cond:
+            cola = self._colas.setdefault(to, collections.deque())
+            cola.append((kwargs, fut, time.monotonic()))
+            if to not in self._en_curso and len(cola) == 1:
+                self._listos.append(to)
+            self._cond.notify()
+        return fut
+
+    def _bucket(self, from_: str) -> TokenBucket:
+        b = self._buckets.get(from_)
+        if b is None:
+            b = self._buckets.setdefault(from_, TokenBucket(OUTBOUND_RATE_PER_SEC, OUTBOUND_BURST))
+        return b
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._listos: self._cond.wait()
+                to = self._listos.popleft()
+                self._en_curso.add(to)
+                kwargs, fut, t0 = self._colas[to].popleft()
+            try:
+                if fut.set_running_or_notify_cancel():
+                    try: fut.set_result(self._enviar(kwargs, t0))
+                    except Exception as e: fut.set_exception(e)
+            finally:
+                with self._cond:
+                    self._en_curso.discard(to)
+                    if self._colas.get(to): self._listos.append(to); self._cond.notify()
+                    else: self._colas.pop(to, None)
+
+    def _enviar(self, kwargs: dict, t0: float):
+        intento = 0
+        while True:
+            intento += 1
+            self._bucket(kwargs["from_"]).tomar()
+            t1 = time.perf_counter()
+            try:
+                msg = self.cliente.messages.create(**kwargs)
+                etapas.registrar("twilio_send", time.perf_counter() - t1)
+                self.enviados += 1
+                self._latencias.append(time.monotonic() - t0)
+                etapas.registrar("send", time.monotonic() - t0)
+                return msg.sid
+            except Exception as e:
+                etapas.registrar("twilio_send", time.perf_counter() - t1, ok=False,
+                                 motivo=str(getattr(e, "status", None) or type(e).__name__))
+                if intento >= OUTBOUND_MAX_ATTEMPTS or not _reintentable(e):
+                    self.fallidos += 1
+                    log.warning("Twilio falló (%s intentos) a %s: %s", intento, kwargs.get("to"), e)
+                    raise
+                self.reintentos += 1
+                time.sleep(OUTBOUND_RETRY_BASE * (2 ** (intento - 1)) * (0.5 + random.random()))
+
+    def estado(self) -> dict:
+        lat = sorted(self._latencias)
+        p = lambda q: round(lat[min(len(lat) - 1, int(len(lat) * q))] * 1000, 1) if lat else None
+        with self._cond:
+            pendientes = sum(len(c) for c in self._colas.values())
+        return {"sent": self.enviados, "failed": self.fallidos, "retries": self.reintentos,
+                "pending": pendientes, "latency_ms": {"p50": p(0.5), "p95": p(0.95), "max": p(1.0)}}
+
+class DespachadorAsync:
+    # Mismo contrato que Despachador (encolar() -> concurrent Future, estado()),
+    # pero cada envío es una tarea del loop de asgi.py: esperar a Twilio no ocupa hilos.
+    def __init__(self, cliente, loop, concurrencia: int = OUTBOUND_ASYNC_CONCURRENCY):
+        self.pid = os.getpid()
+        self.cliente = cliente
+        self.loop = loop
+        self._sem = asyncio.Semaphore(concurrencia)
+        self._turnos = {}                # destinatario -> [asyncio.Lock, mensajes pendientes]
+        self._buckets = {}
+        self.enviados = 0
+        self.fallidos = 0
+        self.reintentos = 0
+        self._latencias = collections.deque(maxlen=500)
+
+    def encolar(self, from_: str, to: str, body: str = "", media_url=None) -> Future:
+        kwargs = {"from_": from_, "to": to, "body": body}
+        if media_url: kwargs["media_url"] = list(media_url)
+        # Las tareas arrancan en el orden en que se encolan y el Lock de asyncio es FIFO:
+        # a un mismo destinatario los mensajes salen en orden
+        return asyncio.run_coroutine_threadsafe(self._despachar(kwargs, time.monotonic()), self.loop)
+
+    async def _despachar(self, kwargs: dict, t0: float):
+        to = kwargs["to"]
+        turno = self._turnos.get(to)
+        if turno is None: turno = self._turnos[to] = [asyncio.Lock(), 0]
+        turno[1] += 1
+        try:
+            async with turno[0]:
+                async with self._sem:
+                    return await self._enviar(kwargs, t0)
+        finally:
+            turno[1] -= 1
+            if not turno[1]: self._turnos.pop(to, None)
+
+    def _bucket(self, from_: str) -> TokenBucket:
+        b = self._buckets.get(from_)
+        if b is None: b = self._buckets[from_] = TokenBucket(OUTBOUND_RATE_PER_SEC, OUTBOUND_BURST)
+        return b
+
+    async def _enviar(self, kwargs: dict, t0: float):
+        intento = 0
+        while True:
+            intento += 1
+            await self._bucket(kwargs["from_"]).tomar_async()
+            t1 = time.perf_counter()
+            try:
+                msg = await asyncio.wait_for(self.cliente.messages.create_async(**kwargs), OUTBOUND_HTTP_TIMEOUT)
+                etapas.registrar("twilio_send", time.perf_counter() - t1)
+                self.enviados += 1
+                self._latencias.append(time.monotonic() - t0)
+                etapas.registrar("send", time.monotonic() - t0)
+                return msg.sid
+            except Exception as e:
+                etapas.registrar("twilio_send", time.perf_counter() - t1, ok=False,
+                                 motivo=str(getattr(e, "status", None) or type(e).__name__))
+                if intento >= OUTBOUND_MAX_ATTEMPTS or not _reintentable(e):
+                    self.fallidos += 1
+                    log.warning("Twilio falló (%s intentos) a %s: %s", intento, kwargs.get("to"), e)
+                    raise
+                self.reintentos += 1
+                await asyncio.sleep(OUTBOUND_RETRY_BASE * (2 ** (intento - 1)) * (0.5 + random.random()))
+
+    async def cerrar(self):
+        http = getattr(self.cliente, "http_client", None)
+        if http is not None and hasattr(http, "close"): await http.close()
+
+    def estado(self) -> dict:
+        lat = sorted(self._latencias)
+        p = lambda q: round(lat[min(len(lat) - 1, int(len(lat) * q))] * 1000, 1) if lat else None
+        return {"mode": "async", "sent": self.enviados, "failed": self.fallidos, "retries": self.reintentos,
+                "pending": sum(t[1] for t in list(self._turnos.values())),
+                "latency_ms": {"p50": p(0.5), "p95": p(0.95), "max": p(1.0)}}
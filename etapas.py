@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Tiempos por etapa del pipeline (sesión, render, conversión, envío...)
+#
+# medir("render") / registrar("twilio", seg) guardan la duración en una
+# muestra acotada por etapa (últimas STAGE_SAMPLES) más contadores de llamadas
+# y errores. Es por proceso; resumen() da p50/p95/p99 y lo expone GET /stages.
+# Costo por registro: un perf_counter y un append.
+#
+# `observador` (lo instala metricas.py) recibe además cada entrada/salida y
+# cada registro, para los histogramas y gauges de Prometheus.
+# -----------------------------------------------------------------------------
+import os, time, threading, collections
+from contextlib import contextmanager
+
+STAGE_SAMPLES = int(os.getenv("STAGE_SAMPLES", "5000"))
+
+class _Etapa:
+    __slots__ = ("muestras", "n", "errores", "total")
+    def __init__(self):
+        self.muestras = collections.deque(maxlen=STAGE_SAMPLES)
+        self.n = 0
+        self.errores = 0
+        self.total = 0.0
+
+_etapas = {}
+_lock = threading.Lock()
+observador = None   # objeto con entrar(nombre), salir(nombre), registrar(nombre, seg, ok, motivo)
+
+def _etapa(nombre: str) -> _Etapa:
+    e = _etapas.get(nombre)
+    if e is None:
+        with _lock: e = _etapas.setdefault(nombre, _Etapa())
+    return e
+
+def registrar(nombre: str, segundos: float, ok: bool = True, motivo: str = ""):
+    e = _etapa(nombre)
+    e.muestras.append(segundos)
+    e.n += 1
+    e.total += segundos
+    if not ok: e.errores += 1
+    o = observador
+    if o is not None: o.registrar(nombre, segundos, ok, motivo or ("" if ok else "error"))
+
+def fallo(nombre: str, motivo: str):
+    # Error sin duración (p. ej. una excepción que el handler atrapa y responde 200)
+    _etapa(nombre).errores += 1
+    o = observador
+    if o is not None: o.fallo(nombre, motivo)
+
+def entrar(nombre: str) -> float:
+    o = observador
+    if o is not None: o.entrar(nombre)
+    return time.perf_counter()
+
+def salir(nombre: str, t0: float, ok: bool = True, motivo: str = ""):
+    o = observador
+    if o is not None: o.salir(nombre)
+    registrar(nombre, time.perf_counter() - t0, ok, motivo)
+
+@contextmanager
+def medir(nombre: str):
+    t0 = entrar(nombre)
+    motivo = ""
+    try:
+        yield
+    except BaseException as e:
+        motivo = type(e).__name__
+        raise
+    finally:
+        salir(nombre, t0, not motivo, motivo)
+
+def percentil(ordenadas, q: float):
+    if not ordenadas: return None
+    return ordenadas[min(len(ordenadas) - 1, int(round(q * (len(ordenadas) - 1))))]
+
+def resumen() -> dict:
+    out = {}
+    for nombre, e in list(_etapas.items()):
+        m = sorted(e.muestras)
+        ms = lambda v: round(v * 1000, 2) if v is not None else None
+        out[nombre] = {"count": e.n, "errors": e.errores, "mean_ms": ms(e.total / e.n) if e.n else None,
+                       "p50_ms": ms(percentil(m, 0.50)), "p95_ms": ms(percentil(m, 0.95)),
+                       "p99_ms": ms(percentil(m, 0.99)), "max_ms": ms(m[-1] if m else None)}
+    return out
+
+def reiniciar():
+    with _lock: _etapas.clear()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Motor del flujo conversacional (chatbot-flujo.json compilado)
+#
+# compilar() valida el JSON (ids duplicados, nextId colgantes, tipos) y arma
+# una máquina de estados inmutable: tabla de nodos por id, menú de opciones
+# ya renderizado y, por cada nodo `condicional`, un índice respuesta -> opción
+# con dígitos ("1", "1️⃣"), texto normalizado de la opción y sus prefijos sin
+# ambigüedad. Cada mensaje entrante cuesta una o dos búsquedas en dict.
+# Cada nodo sabe además qué variables se pueden guardar todavía desde él hasta
+# el final (por_guardar): así se sabe, sin ids fijos, cuándo ya están todos los
+# datos que definen el precio.
+# La respuesta de cada nodo también queda lista (twiml.Plantilla): bytes TwiML
+# fijos para los nodos estáticos, trozos ya escapados para los personalizados.
+# -----------------------------------------------------------------------------
+import re, unicodedata
+from types import MappingProxyType
+from typing import NamedTuple, Optional, Tuple
+import twiml
+
+TIPOS = ("mensaje", "pregunta", "condicional")
+_PREFIJO_MIN = 3
+
+class FlujoInvalido(ValueError):
+    def __init__(self, errores):
+        super().__init__("; ".join(errores))
+        self.errores = list(errores)
+
+class Opcion(NamedTuple):
+    n: int
+    texto: str        # texto tal cual del JSON
+    valor: str        # texto sin numeración ni emojis (lo que se guarda en la sesión)
+    save_as: str
+    next_id: str
+
+class Nodo(NamedTuple):
+    id: str
+    tipo: str
+    contenido: str
+    variable: str
+    next_id: str
+    opciones: Tuple[Opcion, ...]
+    menu: str                      # contenido + opciones, listo para enviar
+    personalizado: bool            # contiene {variables}
+    indice: MappingProxyType       # respuesta normalizada -> Opcion
+    por_guardar: frozenset = frozenset()   # variables guardables desde este nodo (inclusive) en adelante
+    respuesta: twiml.Plantilla = None      # menu como <Message> TwiML
+
+_RE_NUMERACION = re.compile(r"^\s*\d+\s*(?:\ufe0f?\u20e3|[.)\-:])?\s*")
+_RE_SIMBOLOS_INICIALES = re.compile(r"^[\W_]+")
+_RE_NO_ALNUM = re.compile(r"[^a-z0-9]+")
+_RE_VARIABLE = re.compile(r"\{([^}]+)\}")
+
+def valor_opcion(texto: str) -> str:
+    t = _RE_NUMERACION.sub("", texto or "", count=1)
+    return _RE_SIMBOLOS_INICIALES.sub("", t).strip()
+
+def normalizar_respuesta(texto: str) -> str:
+    t = unicodedata.normalize("NFD", (texto or "").lower())
+    t = "".join(c for c in t if unicodedata.category(c) != "Mn")
+    return _RE_NO_ALNUM.sub(" ", t).strip()
+
+def presentar_opciones(opciones) -> str:
+    lines = []
+    for i, opt in enumerate(opciones or [], 1):
+        t = (opt.get("text", "") or "").strip()
+        if not re.match(r"^\d", t): t = f"{i}. {t}"
+        lines.append(t)
+    return "\n".join(lines)
+
+def _indice_opciones(opciones: Tuple[Opcion, ...]) -> dict:
+    indice = {}
+    # 1) prefijos sin ambigüedad ("desrat" -> Desratización)
+    duenos = {}
+    for op in opciones:
+        norm = normalizar_respuesta(op.valor)
+        for k in range(_PREFIJO_MIN, len(norm)):
+            duenos.setdefault(norm[:k], set()).add(op.n)
+    for pref, ns in duenos.items():
+        if len(ns) == 1 and not pref.endswith(" "):
+            indice[pref] = opciones[next(iter(ns)) - 1]
+    # 2) texto completo (gana sobre prefijos: "no" vs "no estoy seguro")
+    for op in opciones:
+        for k in {normalizar_respuesta(op.valor), normalizar_respuesta(op.texto), op.texto.strip()}:
+            if k: indice[k] = op
+    # 3) números y keycaps (ganan sobre todo)
+    for op in opciones:
+        for k in (str(op.n), f"{op.n}\ufe0f\u20e3", f"{op.n}\u20e3"):
+            indice[k] = op
+    return indice
+
+class Flujo:
+    def __init__(self, nodos: dict, primero: Optional[str]):
+        self.nodos = MappingProxyType(nodos)
+        self.primero = primero
+
+    def __len__(self):
+        return len(self.nodos)
+
+    def nodo(self, node_id) -> Optional[Nodo]:
+        return self.nodos.get(str(node_id)) if node_id not in (None, "") else None
+
+    @staticmethod
+    def buscar_opcion(nodo: Nodo, respuesta: str) -> Optional[Opcion]:
+        r = (respuesta or "").strip()
+        op = nodo.indice.get(r)
+        if op is None: op = nodo.indice.get(normalizar_respuesta(r))
+        return op
+
+def _por_guardar(nodos: dict) -> dict:
+    res = {nid: ({n.variable} if n.tipo == "pregunta" and n.variable else set())
+                | {op.save_as for op in n.opciones if op.save_as} for nid, n in nodos.items()}
+    siguientes = {nid: [x for x in (n.next_id, *(op.next_id for op in n.opciones)) if x in nodos]
+                  for nid, n in nodos.items()}
+    cambio = True
+    while cambio:       # punto fijo: el flujo puede tener ciclos
+        cambio = False
+        for nid, sig in siguientes.items():
+            for x in sig:
+                if not res[x] <= res[nid]:
+                    res[nid] |= res[x]; cambio = True
+    return {nid: frozenset(v) for nid, v in res.items()}
+
+def compilar(flow: list) -> Flujo:
+    errores = []
+    crudos = {}
+    for pos, node in enumerate(flow or []):
+        nid = str(node.get("id", "")).strip()
+        if not nid: errores.append(f"nodo #{pos} sin id"); continue
+        if nid in crudos: errores.append(f"id duplicado {nid}"); continue
+        crudos[nid] = node
+
+    nodos = {}
+    for nid, node in crudos.items():
+        tipo = (node.get("type") or "").strip()
+        if tipo not in TIPOS: errores.append(f"{nid}: tipo desconocido '{tipo}'")
+        contenido = node.get("content", "") or ""
+        variable = (node.get("variableName") or "").strip()
+        next_id = str(node.get("nextId") or "").strip()
+        if next_id and next_id not in crudos: errores.append(f"{nid}: nextId {next_id} no existe")
+        if tipo == "pregunta" and not variable: errores.append(f"{nid}: pregunta sin variableName")
+        opciones = []
+        for i, opt in enumerate(node.get("options") or [], 1):
+            onext = str(opt.get("nextId") or "").strip()
+            if not onext: errores.append(f"{nid}: opción {i} sin nextId")
+            elif onext not in crudos: errores.append(f"{nid}: opción {i} nextId {onext} no existe")
+            texto = (opt.get("text", "") or "").strip()
+            opciones.append(Opcion(i, texto, valor_opcion(texto), (opt.get("saveAs") or "").strip(), onext))
+        opciones = tuple(opciones)
+        if tipo == "condicional" and not opciones: errores.append(f"{nid}: condicional sin opciones")
+        menu = contenido
+        if opciones: menu = f"{contenido}\n{presentar_opciones(node.get('options'))}" if contenido else presentar_opciones(node.get("options"))
+        nodos[nid] = Nodo(nid, tipo, contenido, variable, next_id, opciones, menu,
+                          bool(_RE_VARIABLE.search(menu)), MappingProxyType(_indice_opciones(opciones)),
+                          respuesta=twiml.Plantilla(menu))
+    if errores:
+        raise FlujoInvalido(errores)
+    nodos = {nid: n._replace(por_guardar=pg) for (nid, n), pg in zip(nodos.items(), _por_guardar(nodos).values())}
+    primero = str(flow[0]["id"]) if flow else None
+    return Flujo(nodos, primero)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Genera cotizaciones en lote desde JSONL (mismo formato que POST /generate/batch).
+# Uso: python generar_lote.py requests.jsonl --base-url https://mi-bot.up.railway.app > resultados.ndjson
+import sys, json, argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def main():
+    ap = argparse.ArgumentParser(description="Cotizaciones en lote (JSONL -> NDJSON)")
+    ap.add_argument("entrada", nargs="?", default="-", help="archivo JSONL (por defecto stdin)")
+    ap.add_argument("--base-url", default="", help="URL pública para armar /files/... (por defecto BASE_URL)")
+    ap.add_argument("--send", action="store_true", help="enviar por WhatsApp como /generate")
+    ap.add_argument("--chunk", type=int, default=0, help="documentos por invocación del conversor")
+    ap.add_argument("--workers", type=int, default=0, help="hilos de render en paralelo")
+    args = ap.parse_args()
+
+    import app
+    public = args.base_url or app.BASE_URL or "http://localhost:5000"
+    kw = {}
+    if args.chunk > 0:   kw["chunk_size"] = args.chunk
+    if args.workers > 0: kw["workers"] = args.workers
+
+    falta_motor = app._motor_no_disponible()
+    if falta_motor:
+        print(f"❌ {falta_motor[1]}", file=sys.stderr); sys.exit(2)
+
+    entrada = sys.stdin if args.entrada == "-" else open(args.entrada, "r", encoding="utf-8")
+    ok = err = 0
+    with entrada:
+        for res in app.generar_lote(app.leer_jsonl(entrada), public, enviar=args.send, **kw):
+            if res.get("ok"): ok += 1
+            else: err += 1
+            print(json.dumps(res, ensure_ascii=False), flush=True)
+    print(f"✅ {ok} cotizaciones generadas, {err} con error", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Config de gunicorn (se carga sola desde el directorio de trabajo; los flags
+# del Procfile / Dockerfile siguen mandando sobre lo demás)
+#
+# Métricas multiproceso: todos los workers escriben en el mismo directorio y
+# GET /metrics suma sus archivos (ver metricas.py). El directorio es por master
+# y se vacía al arrancar, así no se suman valores de una ejecución anterior.
+# Si un worker muere (timeout, OOM) se matan sus LibreOffice (ver conversor_lo).
+# -----------------------------------------------------------------------------
+import os, shutil, tempfile
+
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR",
+                      os.path.join(tempfile.gettempdir(), f"smartplagas-metrics-{os.getpid()}"))
+
+def on_starting(server):
+    d = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(d, ignore_errors=True)
+    os.makedirs(d, exist_ok=True)
+
+def child_exit(server, worker):
+    import metricas, conversor_lo
+    metricas.marcar_muerto(worker.pid)
+    conversor_lo.limpiar_huerfanos(worker.pid)
+
+def on_exit(server):
+    if os.path.basename(os.environ["PROMETHEUS_MULTIPROC_DIR"]).startswith("smartplagas-metrics-"):
+        shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Idempotencia y single-flight para la generación de cotizaciones
+#
+# Cada operación tiene una clave (Idempotency-Key del cliente o la huella del
+# payload normalizado). La primera petición toma la clave con SET NX (vence en
+# IDEMPOTENCY_LOCK_SECONDS) y genera; las idénticas que llegan mientras tanto,
+# en cualquier worker o nodo, sondean la clave y devuelven el mismo resultado;
+# las que llegan después lo leen mientras dure IDEMPOTENCY_TTL_SECONDS.
+# Sin Idempotency-Key la clave sale del payload, y un pedido idéntico puede ser
+# un reenvío a propósito: ese resultado se guarda solo
+# IDEMPOTENCY_DERIVED_TTL_SECONDS (lo justo para las que esperaban al líder).
+# - Si el líder falla, la clave se borra: el reintento vuelve a generar.
+# - Si el líder muere, la clave vence y otro toma el relevo.
+# - Misma Idempotency-Key con otro payload -> ClaveReutilizada.
+# Sin Redis (o si falla) el mismo protocolo corre en memoria del proceso.
+# -----------------------------------------------------------------------------
+import os, json, time, hashlib, logging
+import sesiones
+
+log = logging.getLogger("idempotencia")
+
+IDEMPOTENCY_ENABLED   = (os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true")
+IDEMPOTENCY_TTL       = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+IDEMPOTENCY_LOCK      = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "180"))   # > conversión más lenta
+IDEMPOTENCY_WAIT      = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "90"))
+IDEMPOTENCY_LOCAL_MAX = int(os.getenv("IDEMPOTENCY_LOCAL_MAX", "2000"))
+IDEMPOTENCY_DERIVED_TTL = max(1, int(os.getenv("IDEMPOTENCY_DERIVED_TTL_SECONDS", "30")))
+CLAVE_MAX = 200
+
+class EsperaAgotada(Exception):
+    pass
+
+class ClaveReutilizada(Exception):
+    pass
+
+def huella(obj) -> str:
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+def clave_de(cabecera: str, payload) -> str:
+    # Idempotency-Key del cliente, o la huella del payload (mismo pedido => misma clave)
+    cabecera = (cabecera or "").strip()[:CLAVE_MAX]
+    if cabecera: return "k:" + hashlib.sha256(cabecera.encode("utf-8")).hexdigest()[:32]
+    return "p:" + huella(payload)[:32]
+
+def ttl_de(clave: str) -> int:
+    # Claves del payload (sin Idempotency-Key): ventana corta, ver cabecera
+    return IDEMPOTENCY_DERIVED_TTL if clave.startswith("p:") else IDEMPOTENCY_TTL
+
+class Idempotencia:
+    def __init__(self, redis_cli=None, prefijo: str = "idem:", ttl: int = IDEMPOTENCY_TTL,
+                 lock: int = IDEMPOTENCY_LOCK, espera: float = IDEMPOTENCY_WAIT):
+        self._r = redis_cli
+        self.prefijo = prefijo
+        self.ttl, self.lock, self.espera = ttl, lock, espera
+        self.local = sesiones.MemoriaTTL(IDEMPOTENCY_LOCAL_MAX, ttl)
+        self.compartidos = 0
+        self._aviso = 0.0
+
+    # ---- almacenamiento: Redis y, si no está o falla, memoria local ---------
+    def _redis(self, op: str, *args, **kw):
+        # -> (True, respuesta) o (False, None) si hay que usar la memoria local
+        if self._r is None: return False, None
+        try: return True, getattr(self._r, op)(*args, **kw)
+        except Exception as e:
+            if time.monotonic() >= self._aviso:
+                self._aviso = time.monotonic() + 30
+                log.warning("Redis %s falló (%s); idempotencia en memoria local", op, e)
+            return False, None
+
+    def reclamar(self, clave: str, huella_payload: str = ""):
+        # -> None si esta petición queda a cargo; si no, el registro actual
+        k = self.prefijo + clave
+        reg = json.dumps({"estado": "en_curso", "huella": huella_payload, "pid": os.getpid()})
+        ok, tomado = self._redis("set", k, reg, nx=True, ex=self.lock)
+        if not ok: tomado = self.local.set_nx(k, reg, self.lock)
+        return None if tomado else (self.obtener(clave) or {})
+
+    def obtener(self, clave: str):
+        k = self.prefijo + clave
+        ok, v = self._redis("get", k)
+        if not ok: v = self.local.get(k)
+        return json.loads(v) if v else None
+
+    def completar(self, clave: str, resultado, huella_payload: str = "", ttl: int = 0):
+        k, ttl = self.prefijo + clave, ttl or self.ttl
+        reg = json.dumps({"estado": "listo", "huella": huella_payload, "resultado": resultado}, default=str)
+        ok, _ = self._redis("set", k, reg, ex=ttl)
+        if not ok: self.local.set(k, reg, ttl)
+
+    def soltar(self, clave: str):
+        k = self.prefijo + clave
+        ok, _ = self._redis("delete", k)
+        if not ok: self.local.pop(k)
+
+    # ---- single-flight ------------------------------------------------------
+    def ejecutar(self, clave: str, fn, huella_payload: str = "", ttl: int = 0):
+        # -> (resultado, compartido). compartido=True: lo generó otra petición.
+        # ttl: cuánto se guarda el resultado (0 = el de la instancia)
+        limite = time.monotonic() + self.espera
+        pausa = 0.02
+        while True:
+            actual = self.reclamar(clave, huella_payload)
+            if actual is None:
+                try: resultado = fn()
+                except BaseException:
+                    self.soltar(clave); raise
+                self.completar(clave, resultado, huella_payload, ttl)
+                return resultado, False
+            if not actual:
+                continue    # se liberó entre el SET NX y el GET: volver a intentar tomarla
+            if huella_payload and actual.get("huella") and actual["huella"] != huella_payload:
+                raise ClaveReutilizada(clave)
+            if actual.get("estado") == "listo":
+                self.compartidos += 1
+                return actual.get("resultado"), True
+            if time.monotonic() >= limite:
+                raise EsperaAgotada(clave)
+            time.sleep(pausa)
+            pausa = min(pausa * 2, 0.25)
+
+    def estado(self) -> dict:
+        return {"enabled": IDEMPOTENCY_ENABLED, "backend": "redis" if self._r is not None else "local",
+                "ttl_seconds": self.ttl, "lock_seconds": self.lock, "shared": self.compartidos}
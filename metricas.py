@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Métricas Prometheus (GET /metrics)
+#
+# Se alimentan de etapas.py: cada medir()/registrar() suma al histograma de
+# latencia de su etapa, cada error al contador por etapa y motivo (clase de la
+# excepción, status de Twilio o status HTTP) y cada entrada/salida al gauge de
+# operaciones en curso. La etapa convert_wait (esperar una instancia libre de
+# LibreOffice) además mueve la profundidad de cola del conversor.
+#
+# Con varios workers de gunicorn se usa el modo multiproceso de
+# prometheus_client: cada proceso escribe en archivos mmap bajo
+# PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py lo define y lo limpia al arrancar)
+# y /metrics suma los de todos; los gauges solo cuentan procesos vivos.
+# Sin prometheus_client todo queda en no-op y /metrics responde 503.
+# prometheus_client se importa en instalar() (primer request del worker), no
+# al importar app.py.
+# Costo: ~8 us por medir() en modo multiproceso (bench/bench_metricas.py).
+# -----------------------------------------------------------------------------
+import os, threading
+import etapas
+
+prom = multiprocess = None
+_cargado = False
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir") or ""
+# Desde ~1 ms (sesión, render) hasta la conversión a PDF lenta (LO_CONVERT_TIMEOUT)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _cargar() -> bool:
+    global prom, multiprocess, _cargado, CONTENT_TYPE
+    if not _cargado:
+        try:
+            import prometheus_client as prom
+            from prometheus_client import multiprocess
+            CONTENT_TYPE = prom.CONTENT_TYPE_LATEST
+        except Exception:
+            prom = multiprocess = None
+        _cargado = True
+    return prom is not None
+
+class _Observador:
+    def __init__(self):
+        self.duracion = prom.Histogram("smartplagas_stage_duration_seconds", "Duración por etapa del pipeline",
+                                       ["stage"], buckets=BUCKETS)
+        self.errores = prom.Counter("smartplagas_stage_errors_total", "Errores por etapa y motivo", ["stage", "reason"])
+        self.en_curso = prom.Gauge("smartplagas_stage_in_flight", "Operaciones en curso por etapa", ["stage"],
+                                   multiprocess_mode="livesum")
+        self.cola_conversor = prom.Gauge("smartplagas_converter_queue_depth",
+                                         "Conversiones esperando una instancia de LibreOffice", multiprocess_mode="livesum")
+        # .labels() toma un lock y arma la tupla en cada llamada: los hijos se guardan por etapa
+        self._hist = {}
+        self._gauges = {}
+
+    def _h(self, nombre):
+        h = self._hist.get(nombre)
+        if h is None: h = self._hist[nombre] = self.duracion.labels(nombre)
+        return h
+
+    def _g(self, nombre):
+        g = self._gauges.get(nombre)
+        if g is None: g = self._gauges[nombre] = self.en_curso.labels(nombre)
+        return g
+
+    def entrar(self, nombre: str):
+        self._g(nombre).inc()
+        if nombre == "convert_wait": self.cola_conversor.inc()
+
+    def salir(self, nombre: str):
+        self._g(nombre).dec()
+        if nombre == "convert_wait": self.cola_conversor.dec()
+
+    def registrar(self, nombre: str, segundos: float, ok: bool, motivo: str):
+        self._h(nombre).observe(segundos)
+        if not ok: self.errores.labels(nombre, motivo).inc()
+
+    def fallo(self, nombre: str, motivo: str):
+        self.errores.labels(nombre, motivo).inc()
+
+_observador = None
+_lock = threading.Lock()
+
+def disponible() -> bool:
+    return _cargar()
+
+def instalar():
+    # Idempotente: las métricas se registran una sola vez por proceso
+    global _observador
+    if _observador is not None: return
+    if not _cargar(): return
+    with _lock:
+        if _observador is None: _observador = _Observador()
+        etapas.observador = _observador
+
+def exponer() -> bytes:
+    if not _cargar(): return b""
+    if MULTIPROC_DIR:
+        reg = prom.CollectorRegistry()
+        multiprocess.MultiProcessCollector(reg)
+        return prom.generate_latest(reg)
+    return prom.generate_latest()
+
+def marcar_muerto(pid: int):
+    # gunicorn child_exit: saca los gauges del worker muerto (los contadores se conservan)
+    if MULTIPROC_DIR and _cargar(): multiprocess.mark_process_dead(pid)
@@ -0,0 +1,654 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Motor PDF nativo para cotizaciones (sin DOCX ni LibreOffice)
+#
+# Arma el PDF directo desde el mismo ctx que recibe la plantilla DOCX
+# (_contexto_plantilla en app.py), con una disposición declarativa por dominio
+# (DISPOSICIONES) que reproduce la de las plantillas: página A3, encabezado con
+# logo, datos cliente/emisor en dos columnas, tabla de servicio, total,
+# condiciones y pie.
+#
+# Lo estático se arma una vez por proceso y se reutiliza en cada documento:
+# - fondo: las imágenes ancladas a la página (encabezado, logo) y las formas
+#   vectoriales del pie se leen del propio .docx de la plantilla; los PNG se
+#   pasan a PDF sin decodificar píxeles (los filtros PNG son por canal: basta
+#   separar color y alfa fila a fila y dejar que el lector los deshaga con
+#   /Predictor 15). Se recalcula si cambia el archivo de la plantilla.
+# - fuentes: DejaVu Sans (regular y negrita) embebidas como subconjunto
+#   (CIDFontType2, Identity-H): solo los glifos de un juego base (ASCII,
+#   Latin-1 y puntuación tipográfica) más los que traiga el documento.
+# Por documento queda componer el stream de contenido (texto y tabla) y
+# escribir el archivo: ~1-2 ms (bench/bench_pdf_nativo.py) contra segundos de
+# la conversión con LibreOffice. El primer documento del proceso paga ~0.5 s
+# (recomprimir las imágenes); con TEMPLATE_PRELOAD=true lo paga el master.
+#
+# Se activa por plantilla con PDF_NATIVE_TEMPLATES (plagas,piscinas,camaras o
+# *); sin fuentes, con una plantilla sin disposición o ante cualquier error,
+# app.py vuelve al camino DOCX + LibreOffice. El DOCX se sigue generando para
+# docx_url.
+# -----------------------------------------------------------------------------
+import os, re, zlib, struct, hashlib, zipfile, logging, threading
+from array import array
+from functools import lru_cache
+from typing import NamedTuple, Tuple
+from xml.etree import ElementTree
+
+log = logging.getLogger("pdf_nativo")
+
+PDF_NATIVE_TEMPLATES = {t.strip().lower() for t in os.getenv("PDF_NATIVE_TEMPLATES", "").split(",") if t.strip()}
+FUENTE_REGULAR = os.getenv("PDF_FONT_REGULAR", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+FUENTE_NEGRITA = os.getenv("PDF_FONT_BOLD", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf")
+
+# Juego base de caracteres del subconjunto (cubre casi todas las cotizaciones)
+CARACTERES_BASE = frozenset(chr(c) for c in list(range(0x20, 0x7F)) + list(range(0xA0, 0x100))) | frozenset("–—‘’“”•…€™✓")
+
+EMU_PT = 12700.0
+
+# -----------------------------------------------------------------------------
+# Disposición declarativa (unidades: puntos, y hacia abajo desde el borde
+# superior; x relativa a la caja actual: margen o columna)
+# -----------------------------------------------------------------------------
+class Texto(NamedTuple):
+    plantilla: str          # str.format con el ctx: "{cliente}"
+    estilo: str
+    x: float = 0.0
+    antes: float = 0.0      # espacio antes
+    ancho: float = 0.0      # 0 = hasta el borde derecho de la caja
+    alinear: str = "izq"    # izq | centro | der
+    vineta: str = ""
+
+class Columnas(NamedTuple):
+    izq: Tuple
+    der: Tuple
+    x_der: float            # inicio de la columna derecha (desde el margen)
+    ancho_izq: float
+
+class Tabla(NamedTuple):
+    x: float
+    anchos: Tuple[float, ...]
+    filas: Tuple            # ((plantilla, estilo, alinear), ...) por fila
+    antes: float = 0.0
+    cabecera: str = ""      # color de fondo de la primera fila
+    borde: str = ""         # color de bordes ("" = sin bordes)
+    relleno: float = 5.0
+
+class Fijo(NamedTuple):
+    y: float                # posición absoluta; no mueve el cursor
+    elementos: Tuple
+
+# estilo -> (negrita, tamaño, color)
+ESTILOS = {
+    "titulo":      (True, 36, "3762B8"),
+    "seccion":     (True, 18, "1F2A5B"),
+    "texto":       (False, 16, "000000"),
+    "condicion":   (True, 13, "1F2A5B"),
+    "item":        (False, 13, "1F2A5B"),
+    "tabla_cab":   (True, 14, "FFFFFF"),
+    "total":       (True, 22, "1F2A5B"),
+    "total_valor": (True, 22, "000000"),
+    "pie":         (False, 17, "FBFBFB"),
+}
+
+PAGINA = (842.5, 1190.5)        # A3, como las plantillas (16850 x 23810 twips)
+MARGEN_IZQ, MARGEN_DER = 56.65, 63.75
+
+CONDICIONES = (
+    "Reserva del servicio: Para confirmar la visita y reservar la atención, se solicita un anticipo del 50% del valor total.",
+    "El saldo: Se paga al término del trabajo, junto con la entrega de la documentación sanitaria correspondiente.",
+    "Forma de pago: Reserva por transferencia bancaria y saldo por transferencia o tarjeta de débito.",
+    "Vigencia de la cotización: 7 días hábiles",
+    "El servicio de Control de Plagas incluye:",
+)
+INCLUYE = ("Informe técnico del servicio", "Plano de ubicación de estaciones cebaderas",
+           "Certificado de aplicación y productos utilizados")
+
+def _disposicion(descripcion: str, col_cantidad: str, cantidad: str) -> tuple:
+    return (
+        Texto("Cotización de Servicios", "titulo", x=23.3, antes=150),
+        Columnas(
+            izq=(Texto("Datos del Cliente", "seccion", x=27.5, antes=22),
+                 Texto("{cliente}", "texto", x=27.5, antes=8.3),
+                 Texto("{direccion}", "texto", x=27.5, antes=5),
+                 Texto("{comuna}", "texto", x=27.5, antes=5),
+                 Texto("{contacto}", "texto", x=27.5, antes=5),
+                 Texto("{email}", "texto", x=27.5, antes=5),
+                 Texto("DESCRIPCIÓN:", "seccion", x=20, antes=18)),
+            der=(Texto("Datos del Emisor", "seccion", x=20, antes=22),
+                 Texto("SMART PLAGAS E.I.R.L.", "texto", x=20, antes=8.3),
+                 Texto("+56 9 5816 6055", "texto", x=20, antes=5),
+                 Texto("contacto@smartplagas.cl www.smartplagas.cl", "texto", x=20, antes=5, ancho=181)),
+            x_der=389.8, ancho_izq=255.4),
+        Texto(descripcion, "texto", x=20, antes=10.5),
+        Tabla(x=26.7, anchos=(327.0, 92.15, 269.3), antes=18, cabecera="548DD4", borde="365F91",
+              filas=((("SERVICIO", "tabla_cab", "centro"), (col_cantidad, "tabla_cab", "centro"), ("TOTAL", "tabla_cab", "centro")),
+                     (("{linea_servicio}", "texto", "izq"), (cantidad, "texto", "centro"), ("{linea_total}", "texto", "centro")))),
+        Tabla(x=396.3, anchos=(107.0, 180.65), antes=14,
+              filas=((("TOTAL", "total", "der"), ("{total}", "total_valor", "izq")),)),
+        Texto("CONDICIONES", "seccion", x=5.45, antes=16),
+        *(Texto(t, "condicion", x=21.3, antes=14.2, vineta="•") for t in CONDICIONES),
+        *(Texto(t, "item", x=42.6, antes=4.3, vineta="–") for t in INCLUYE),
+        Fijo(1122, (Texto("SMART PLAGAS E.I.R.L. – Control profesional de plagas urbanas", "pie", alinear="centro"),
+                    Texto("Servicios con respaldo técnico y productos certificados por el ISP.", "pie", alinear="centro", antes=4))),
+    )
+
+DISPOSICIONES = {
+    "plagas":   _disposicion("{descripcion}, con instalación de estaciones cebaderas y entrega de informe sanitario "
+                             "conforme a exigencias SEREMI.", "M2", "{m2}"),
+    "piscinas": _disposicion("{descripcion}.", "M2", "{m3}"),
+    "camaras":  _disposicion("{descripcion}", "CANTIDAD", "{linea_cantidad}"),
+}
+
+def dominio_plantilla(tpl_path: str) -> str:
+    # templatescotizacion_plagas.docx -> "plagas"
+    m = re.search(r"_([a-z]+)\.docx$", os.path.basename(tpl_path).lower())
+    return m.group(1) if m else ""
+
+def activo(tpl_path: str) -> bool:
+    dom = dominio_plantilla(tpl_path)
+    return (dom in DISPOSICIONES and ("*" in PDF_NATIVE_TEMPLATES or dom in PDF_NATIVE_TEMPLATES)
+            and os.path.exists(FUENTE_REGULAR) and os.path.exists(FUENTE_NEGRITA))
+
+def algun_activo() -> bool:
+    return bool(PDF_NATIVE_TEMPLATES) and os.path.exists(FUENTE_REGULAR) and os.path.exists(FUENTE_NEGRITA)
+
+# -----------------------------------------------------------------------------
+# TrueType: lectura y subconjunto
+# -----------------------------------------------------------------------------
+def _suma(datos: bytes) -> int:
+    datos += b"\0" * (-len(datos) % 4)
+    a = array("I", datos)
+    if struct.pack("=I", 1) != struct.pack(">I", 1): a.byteswap()
+    return sum(a) & 0xFFFFFFFF
+
+class FuenteTTF:
+    TABLAS_SUBCONJUNTO = ("cvt ", "fpgm", "glyf", "head", "hhea", "hmtx", "loca", "maxp", "prep")
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f: self.datos = datos = f.read()
+        self.tablas = {}
+        for i in range(struct.unpack_from(">H", datos, 4)[0]):
+            tag, _, off, lon = struct.unpack_from(">4sIII", datos, 12 + 16 * i)
+            self.tablas[tag.decode("latin-1")] = (off, lon)
+        head = self.tabla("head")
+        self.upm = struct.unpack_from(">H", head, 18)[0]
+        self.bbox = struct.unpack_from(">hhhh", head, 36)
+        hhea = self.tabla("hhea")
+        self.ascenso, self.descenso = struct.unpack_from(">hh", hhea, 4)
+        n_metricas = struct.unpack_from(">H", hhea, 34)[0]
+        self.n_glifos = struct.unpack_from(">H", self.tabla("maxp"), 4)[0]
+        avances = list(struct.unpack_from(">%dH" % (2 * n_metricas), self.tabla("hmtx"))[0::2])
+        self.avances = avances + [avances[-1]] * (self.n_glifos - n_metricas)
+        if struct.unpack_from(">h", head, 50)[0]:
+            self.loca = list(struct.unpack_from(">%dI" % (self.n_glifos + 1), self.tabla("loca")))
+        else:
+            self.loca = [o * 2 for o in struct.unpack_from(">%dH" % (self.n_glifos + 1), self.tabla("loca"))]
+        self.cmap = self._leer_cmap()
+        post = self.tabla("post")
+        self.italica = struct.unpack_from(">i", post, 4)[0] / 65536.0 if post else 0.0
+        os2 = self.tabla("OS/2")
+        self.altura_mayus = (struct.unpack_from(">h", os2, 88)[0] if len(os2) >= 90 and struct.unpack_from(">H", os2, 0)[0] >= 2
+                             else self.ascenso)
+        self.nombre = re.sub(r"[^A-Za-z0-9-]", "", self._nombre_ps() or os.path.splitext(os.path.basename(path))[0])
+        self.interlineado = (self.ascenso - self.descenso) / self.upm
+        self._anchos = {}
+
+    def tabla(self, tag: str) -> bytes:
+        off, lon = self.tablas.get(tag, (0, 0))
+        return self.datos[off:off + lon]
+
+    def _leer_cmap(self) -> dict:
+        cmap = self.tabla("cmap")
+        subtablas = {}
+        for i in range(struct.unpack_from(">H", cmap, 2)[0]):
+            plat, enc, off = struct.unpack_from(">HHI", cmap, 4 + 8 * i)
+            subtablas[(plat, enc)] = off
+        off = next((subtablas[k] for k in ((3, 10), (0, 4), (3, 1), (0, 3)) if k in subtablas), None)
+        if off is None: raise ValueError("fuente sin cmap unicode")
+        mapa, formato = {}, struct.unpack_from(">H", cmap, off)[0]
+        if formato == 12:
+            for g in range(struct.unpack_from(">I", cmap, off + 12)[0]):
+                ini, fin, gid = struct.unpack_from(">III", cmap, off + 16 + 12 * g)
+                for c in range(ini, fin + 1): mapa[c] = gid + c - ini
+        elif formato == 4:
+            n = struct.unpack_from(">H", cmap, off + 6)[0] // 2
+            fines = struct.unpack_from(">%dH" % n, cmap, off + 14)
+            inicios = struct.unpack_from(">%dH" % n, cmap, off + 16 + 2 * n)
+            deltas = struct.unpack_from(">%dh" % n, cmap, off + 16 + 4 * n)
+            base_rangos = off + 16 + 6 * n
+            rangos = struct.unpack_from(">%dH" % n, cmap, base_rangos)
+            for s in range(n):
+                for c in range(inicios[s], fines[s] + 1):
+                    if c == 0xFFFF: continue
+                    if rangos[s] == 0: gid = (c + deltas[s]) & 0xFFFF
+                    else:
+                        gid = struct.unpack_from(">H", cmap, base_rangos + 2 * s + rangos[s] + 2 * (c - inicios[s]))[0]
+                        if gid: gid = (gid + deltas[s]) & 0xFFFF
+                    if gid: mapa[c] = gid
+        else:
+            raise ValueError(f"cmap formato {formato} no soportado")
+        return mapa
+
+    def _nombre_ps(self) -> str:
+        name = self.tabla("name")
+        if not name: return ""
+        n, base = struct.unpack_from(">HH", name, 2)
+        for i in range(n):
+            plat, enc, _, nid, lon, off = struct.unpack_from(">6H", name, 6 + 12 * i)
+            if nid != 6: continue
+            crudo = name[base + off:base + off + lon]
+            return crudo.decode("utf-16-be" if plat in (0, 3) else "latin-1", "replace")
+        return ""
+
+    def ancho(self, texto: str, tam: float) -> float:
+        anchos, total = self._anchos, 0
+        for ch in texto:
+            a = anchos.get(ch)
+            if a is None:
+                gid = self.cmap.get(ord(ch))
+                a = anchos[ch] = self.avances[gid] if gid is not None else 0
+            total += a
+        return total * tam / self.upm
+
+    def _componentes(self, gid: int):
+        glyf = self.tablas["glyf"][0]
+        a, b = self.loca[gid], self.loca[gid + 1]
+        if b - a < 10 or struct.unpack_from(">h", self.datos, glyf + a)[0] >= 0: return
+        pos = glyf + a + 10
+        while True:
+            banderas, comp = struct.unpack_from(">HH", self.datos, pos)
+            yield comp
+            pos += 4 + (4 if banderas & 0x1 else 2)
+            pos += 2 if banderas & 0x8 else 4 if banderas & 0x40 else 8 if banderas & 0x80 else 0
+            if not banderas & 0x20: break
+
+    def subconjunto(self, gids) -> bytes:
+        # Mismos gid (CIDToGIDMap /Identity): los glifos no usados quedan vacíos
+        usados = set(gids) | {0}
+        pendientes = list(usados)
+        while pendientes:
+            for comp in self._componentes(pendientes.pop()):
+                if comp not in usados: usados.add(comp); pendientes.append(comp)
+        glyf, loca, partes, pos = self.tabla("glyf"), array("I"), [], 0
+        for gid in range(self.n_glifos):
+            loca.append(pos)
+            if gid in usados:
+                trozo = glyf[self.loca[gid]:self.loca[gid + 1]]
+                trozo += b"\0" * (-len(trozo) % 4)
+                partes.append(trozo); pos += len(trozo)
+        loca.append(pos)
+        if struct.pack("=I", 1) != struct.pack(">I", 1): loca.byteswap()
+        head = bytearray(self.tabla("head"))
+        struct.pack_into(">I", head, 8, 0)      # checkSumAdjustment
+        struct.pack_into(">h", head, 50, 1)     # loca larga
+        tablas = {"glyf": b"".join(partes), "loca": loca.tobytes(), "head": bytes(head)}
+        for tag in self.TABLAS_SUBCONJUNTO:
+            if tag not in tablas and tag in self.tablas: tablas[tag] = self.tabla(tag)
+        return _sfnt(tablas)
+
+def _sfnt(tablas: dict) -> bytes:
+    n = len(tablas)
+    potencia = 1 << (n.bit_length() - 1)
+    salida = [struct.pack(">IHHHH", 0x00010000, n, potencia * 16, potencia.bit_length() - 1, n * 16 - potencia * 16)]
+    off, cuerpos = 12 + 16 * n, []
+    for tag in sorted(tablas):
+        datos = tablas[tag]
+        salida.append(struct.pack(">4sIII", tag.encode("latin-1"), _suma(datos), off, len(datos)))
+        datos += b"\0" * (-len(datos) % 4)
+        cuerpos.append(datos); off += len(datos)
+    return b"".join(salida + cuerpos)
+
+@lru_cache(maxsize=4)
+def fuente(path: str) -> FuenteTTF:
+    return FuenteTTF(path)
+
+# -----------------------------------------------------------------------------
+# Objetos PDF
+# -----------------------------------------------------------------------------
+def _stream(dic: str, datos: bytes) -> bytes:
+    return b"<<%s /Length %d>>\nstream\n%s\nendstream" % (dic.encode("latin-1"), len(datos), datos)
+
+def _objetos_fuente(f: FuenteTTF, caracteres: frozenset, n: int):
+    # -> [cuerpos de los objetos n .. n+4], n = Type0 que va en /Resources
+    pares = sorted({(ord(ch), f.cmap[ord(ch)]) for ch in caracteres if ord(ch) in f.cmap}, key=lambda p: p[1])
+    gids = [g for _, g in pares]
+    programa = f.subconjunto(gids)
+    etiqueta = "".join(chr(65 + b % 26) for b in hashlib.sha1(repr(gids).encode()).digest()[:6])
+    nombre = f"{etiqueta}+{f.nombre}"
+    escala = 1000.0 / f.upm
+    anchos = " ".join("%d [%d]" % (g, round(f.avances[g] * escala)) for g in sorted(set(gids)))
+    mapa = "".join("<%04X> <%04X>\n" % (g, u) for u, g in pares if u <= 0xFFFF)
+    n_map = len([1 for u, _ in pares if u <= 0xFFFF])
+    cmap = ("/CIDInit /ProcSet findresource begin 12 dict begin begincmap\n"
+            "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+            "/CMapName /Adobe-Identity-UCS def /CMapType 2 def\n"
+            "1 begincodespacerange <0000> <FFFF> endcodespacerange\n")
+    for i in range(0, n_map, 100):
+        bloque = mapa.splitlines()[i:i + 100]
+        cmap += "%d beginbfchar\n%s\nendbfchar\n" % (len(bloque), "\n".join(bloque))
+    cmap += "endcmap CMapName currentdict /CMap defineresource pop end end"
+    bandera = 32 | (64 if f.italica else 0)
+    bbox = " ".join(str(round(v * escala)) for v in f.bbox)
+    return [
+        b"<< /Type /Font /Subtype /Type0 /BaseFont /%s /Encoding /Identity-H /DescendantFonts [%d 0 R] /ToUnicode %d 0 R >>"
+        % (nombre.encode(), n + 1, n + 4),
+        b"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /%s /CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) "
+        b"/Supplement 0 >> /FontDescriptor %d 0 R /DW %d /W [%s] /CIDToGIDMap /Identity >>"
+        % (nombre.encode(), n + 2, round(f.avances[0] * escala), anchos.encode()),
+        b"<< /Type /FontDescriptor /FontName /%s /Flags %d /FontBBox [%s] /ItalicAngle %d /Ascent %d /Descent %d "
+        b"/CapHeight %d /StemV 80 /FontFile2 %d 0 R >>"
+        % (nombre.encode(), bandera, bbox.encode(), f.italica, round(f.ascenso * escala), round(f.descenso * escala),
+           round(f.altura_mayus * escala), n + 3),
+        _stream("/Filter /FlateDecode /Length1 %d" % len(programa), zlib.compress(programa, 9)),
+        _stream("/Filter /FlateDecode", zlib.compress(cmap.encode("ascii"), 9)),
+    ]
+
+def _imagen_png(datos: bytes):
+    # -> (ancho, alto, dict color, datos color, datos alfa o None), sin decodificar píxeles
+    if datos[:8] != b"\x89PNG\r\n\x1a\n": raise ValueError("no es PNG")
+    pos, idat, ihdr = 8, [], None
+    while pos < len(datos):
+        lon, tipo = struct.unpack_from(">I4s", datos, pos)
+        cuerpo = datos[pos + 8:pos + 8 + lon]
+        if tipo == b"IHDR": ihdr = struct.unpack(">IIBBBBB", cuerpo)
+        elif tipo == b"IDAT": idat.append(cuerpo)
+        elif tipo == b"IEND": break
+        pos += 12 + lon
+    ancho, alto, bits, tipo_color, _, _, entrelazado = ihdr
+    if bits != 8 or entrelazado or tipo_color not in (0, 2, 4, 6):
+        raise ValueError(f"PNG no soportado (bits={bits}, color={tipo_color}, entrelazado={entrelazado})")
+    canales = {0: 1, 2: 3, 4: 2, 6: 4}[tipo_color]
+    n_color = 3 if tipo_color in (2, 6) else 1
+    espacio = "/DeviceRGB" if n_color == 3 else "/DeviceGray"
+    dic = ("/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent 8 /Filter /FlateDecode "
+           "/DecodeParms << /Predictor 15 /Colors %%d /BitsPerComponent 8 /Columns %d >>" % (ancho, alto, espacio, ancho))
+    if canales == n_color:
+        return ancho, alto, dic % n_color, b"".join(idat), None
+    crudo = zlib.decompress(b"".join(idat))
+    fila, fila_c = 1 + ancho * canales, 1 + ancho * n_color
+    color, alfa = bytearray(fila_c * alto), bytearray((1 + ancho) * alto)
+    for y in range(alto):
+        ini = y * fila
+        c0, a0 = y * fila_c, y * (1 + ancho)
+        color[c0] = alfa[a0] = crudo[ini]
+        for k in range(n_color):
+            color[c0 + 1 + k:c0 + fila_c:n_color] = crudo[ini + 1 + k:ini + fila:canales]
+        alfa[a0 + 1:a0 + 1 + ancho] = crudo[ini + canales:ini + fila:canales]
+    return ancho, alto, dic % n_color, zlib.compress(bytes(color), 6), zlib.compress(bytes(alfa), 6)
+
+_imagenes = {}
+
+def _imagen_cacheada(datos: bytes):
+    # Por contenido: las plantillas comparten encabezado y logo
+    clave = hashlib.sha256(datos).digest()
+    img = _imagenes.get(clave)
+    if img is None: img = _imagenes[clave] = _imagen_png(datos)
+    return img
+
+# -----------------------------------------------------------------------------
+# Fondo de la plantilla: imágenes y formas ancladas a la página
+# -----------------------------------------------------------------------------
+NS = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main",
+      "wp": "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing",
+      "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+      "pic": "http://schemas.openxmlformats.org/drawingml/2006/picture",
+      "wps": "http://schemas.microsoft.com/office/word/2010/wordprocessingShape",
+      "wpg": "http://schemas.microsoft.com/office/word/2010/wordprocessingGroup",
+      "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships"}
+_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}Relationship"
+
+class Fondo(NamedTuple):
+    imagenes: Tuple          # (ancho, alto, dict, color, alfa) por imagen
+    contenido: bytes         # operadores que pintan el fondo (/ImN Do y trazados)
+
+def _xfrm(nodo):
+    # -> (x, y, cx, cy) del a:xfrm directo del nodo (EMU), o None
+    xf = nodo.find("a:xfrm", NS)
+    if xf is None: return None
+    off, ext = xf.find("a:off", NS), xf.find("a:ext", NS)
+    return int(off.get("x")), int(off.get("y")), int(ext.get("cx")), int(ext.get("cy"))
+
+def _posicion(nodo, margen: float):
+    # wp:positionH/V -> EMU desde el borde de la página, o None si no se soporta
+    if nodo is None: return None
+    base = {"page": 0, "margin": margen * EMU_PT}.get(nodo.get("relativeFrom"))
+    off, alinear = nodo.find("wp:posOffset", NS), nodo.find("wp:align", NS)
+    if base is None: return None
+    if off is not None: return base + int(off.text)
+    if alinear is not None and alinear.text in ("top", "left"): return base
+    return None
+
+def _leer_fondo(tpl_path: str) -> Fondo:
+    with zipfile.ZipFile(tpl_path) as z:
+        doc = ElementTree.fromstring(z.read("word/document.xml"))
+        rels = {r.get("Id"): r.get("Target") for r in ElementTree.fromstring(z.read("word/_rels/document.xml.rels")).iter(_REL)}
+        imagenes, ops, medias = [], [], {}
+        alto_pag = PAGINA[1]
+        for ancla in doc.iter("{%s}anchor" % NS["wp"]):
+            # Las plantillas no tienen margen superior (pgMar top=0)
+            ax, ay = _posicion(ancla.find("wp:positionH", NS), MARGEN_IZQ), _posicion(ancla.find("wp:positionV", NS), 0)
+            if ax is None or ay is None: continue
+            grupo = ancla.find(".//wpg:wgp", NS)
+            # Transformación del grupo: hijos en coordenadas chOff/chExt
+            gx = gy = 0; sx = sy = 1.0
+            if grupo is not None:
+                xf = grupo.find("wpg:grpSpPr/a:xfrm", NS)
+                if xf is not None and xf.find("a:chExt", NS) is not None:
+                    ext, ch_off, ch_ext = xf.find("a:ext", NS), xf.find("a:chOff", NS), xf.find("a:chExt", NS)
+                    sx = int(ext.get("cx")) / max(1, int(ch_ext.get("cx")))
+                    sy = int(ext.get("cy")) / max(1, int(ch_ext.get("cy")))
+                    gx, gy = -int(ch_off.get("x")) * sx, -int(ch_off.get("y")) * sy
+            def _pt(x, y):
+                return (ax + gx + x * sx) / EMU_PT, alto_pag - (ay + gy + y * sy) / EMU_PT
+            for pic in ancla.iter("{%s}pic" % NS["pic"]):
+                blip = pic.find(".//a:blip", NS)
+                caja = _xfrm(pic.find("pic:spPr", NS)) if grupo is not None else None
+                if caja is None:
+                    ext = ancla.find("wp:extent", NS)
+                    caja = (0, 0, int(ext.get("cx")), int(ext.get("cy")))
+                objetivo = rels.get(blip.get("{%s}embed" % NS["r"])) if blip is not None else None
+                if not objetivo: continue
+                if objetivo not in medias:
+                    medias[objetivo] = len(imagenes)
+                    imagenes.append(_imagen_cacheada(z.read("word/" + objetivo.lstrip("/"))))
+                x0, y1 = _pt(caja[0], caja[1] + caja[3])
+                ops.append("q %.2f 0 0 %.2f %.2f %.2f cm /Im%d Do Q" % (caja[2] * sx / EMU_PT, caja[3] * sy / EMU_PT,
+                                                                         x0, y1, medias[objetivo]))
+            for forma in ancla.iter("{%s}wsp" % NS["wps"]):
+                sp = forma.find("wps:spPr", NS)
+                color = sp.find("a:solidFill/a:srgbClr", NS) if sp is not None else None
+                caja = _xfrm(sp) if sp is not None else None
+                if color is None or caja is None: continue
+                trazo = []
+                for path in sp.iterfind("a:custGeom/a:pathLst/a:path", NS):
+                    pw, ph_ = int(path.get("w") or caja[2]) or 1, int(path.get("h") or caja[3]) or 1
+                    def _p(pt):
+                        return _pt(caja[0] + int(pt.get("x")) * caja[2] / pw, caja[1] + int(pt.get("y")) * caja[3] / ph_)
+                    for cmd in path:
+                        nombre = cmd.tag.split("}")[1]
+                        pts = [_p(pt) for pt in cmd.iterfind("a:pt", NS)]
+                        if nombre == "moveTo": trazo.append("%.2f %.2f m" % pts[0])
+                        elif nombre == "lnTo": trazo.append("%.2f %.2f l" % pts[0])
+                        elif nombre == "cubicBezTo": trazo.append("%.2f %.2f %.2f %.2f %.2f %.2f c" % (*pts[0], *pts[1], *pts[2]))
+                        elif nombre == "close": trazo.append("h")
+                if trazo: ops.append("%s rg %s f" % (_rgb(color.get("val")), " ".join(trazo)))
+    return Fondo(tuple(imagenes), "\n".join(ops).encode("latin-1"))
+
+_fondos = {}
+_lock = threading.Lock()
+
+def fondo(tpl_path: str) -> Fondo:
+    # Por proceso; se relee si cambia mtime/tamaño de la plantilla
+    st = os.stat(tpl_path)
+    firma = (st.st_mtime_ns, st.st_size)
+    item = _fondos.get(tpl_path)
+    if item is None or item[0] != firma:
+        with _lock:
+            item = _fondos.get(tpl_path)
+            if item is None or item[0] != firma:
+                item = _fondos[tpl_path] = (firma, _leer_fondo(tpl_path))
+    return item[1]
+
+@lru_cache(maxsize=16)
+def _recursos_fijos(tpl_path: str, firma, extra: frozenset):
+    # -> (cuerpos de objetos desde el 5, dict /Resources, contenido del fondo)
+    fnd = fondo(tpl_path)
+    objetos, xobjs = [], []
+    for i, (ancho, alto, dic, color, alfa) in enumerate(fnd.imagenes):
+        n = 5 + len(objetos)
+        if alfa is None:
+            objetos.append(_stream(dic, color))
+        else:
+            objetos.append(_stream(dic + " /SMask %d 0 R" % (n + 1), color))
+            objetos.append(_stream(dic.replace("/DeviceRGB", "/DeviceGray").replace("/Colors 3", "/Colors 1"), alfa))
+        xobjs.append("/Im%d %d 0 R" % (i, n))
+    caracteres = CARACTERES_BASE | extra
+    fuentes = []
+    for clave, path in (("F1", FUENTE_REGULAR), ("F2", FUENTE_NEGRITA)):
+        n = 5 + len(objetos)
+        objetos.extend(_objetos_fuente(fuente(path), caracteres, n))
+        fuentes.append("/%s %d 0 R" % (clave, n))
+    recursos = "<< /Font << %s >> /XObject << %s >> >>" % (" ".join(fuentes), " ".join(xobjs))
+    return objetos, recursos.encode("latin-1"), fnd.contenido
+
+def calentar(tpl_paths):
+    # Arma fondo y fuentes antes del primer documento (p. ej. en el master con --preload)
+    for p in tpl_paths:
+        if not activo(p): continue
+        try: _recursos_fijos(p, _firma(p), frozenset())
+        except Exception as e: log.warning("PDF nativo: no se pudo precargar %s: %s", p, e)
+
+def _firma(path: str):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+# -----------------------------------------------------------------------------
+# Composición
+# -----------------------------------------------------------------------------
+def _rgb(hexa: str) -> str:
+    return "%.3f %.3f %.3f" % tuple(int(hexa[i:i + 2], 16) / 255.0 for i in (0, 2, 4))
+
+class _Ctx(dict):
+    def __missing__(self, clave): return ""
+
+class _Lienzo:
+    def __init__(self, regular: FuenteTTF, negrita: FuenteTTF):
+        self.fuentes = {False: ("F1", regular), True: ("F2", negrita)}
+        self.ops = []
+
+    def _hex(self, f: FuenteTTF, texto: str) -> str:
+        return "".join("%04X" % f.cmap[ord(ch)] for ch in texto if ord(ch) in f.cmap)
+
+    def lineas(self, texto: str, estilo: str, ancho: float):
+        negrita, tam, _ = ESTILOS[estilo]
+        f = self.fuentes[negrita][1]
+        salida, actual = [], ""
+        for palabra in texto.split():
+            prueba = f"{actual} {palabra}" if actual else palabra
+            if actual and f.ancho(prueba, tam) > ancho:
+                salida.append(actual); actual = palabra
+            else:
+                actual = prueba
+        return salida + [actual] if actual else salida or [""]
+
+    def alto_linea(self, estilo: str) -> float:
+        negrita, tam, _ = ESTILOS[estilo]
+        return self.fuentes[negrita][1].interlineado * tam
+
+    def escribir(self, texto: str, estilo: str, x: float, y: float, ancho: float, alinear: str):
+        # y: borde superior de la línea
+        negrita, tam, color = ESTILOS[estilo]
+        clave, f = self.fuentes[negrita]
+        if alinear != "izq":
+            libre = ancho - f.ancho(texto, tam)
+            x += libre / 2 if alinear == "centro" else libre
+        base = PAGINA[1] - y - f.ascenso * tam / f.upm
+        self.ops.append("BT /%s %g Tf %s rg %.2f %.2f Td <%s> Tj ET" % (clave, tam, _rgb(color), x, base, self._hex(f, texto)))
+
+    def parrafo(self, t: Texto, ctx, x0: float, ancho_caja: float, y: float) -> float:
+        y += t.antes
+        x = x0 + t.x
+        ancho = t.ancho or (ancho_caja - t.x)
+        texto = " ".join(t.plantilla.format_map(ctx).split())
+        sangria = 0.0
+        if t.vineta:
+            sangria = 14.2
+            self.escribir(t.vineta, t.estilo, x - sangria, y, sangria, "izq")
+        alto = self.alto_linea(t.estilo)
+        for linea in self.lineas(texto, t.estilo, ancho):
+            self.escribir(linea, t.estilo, x, y, ancho, t.alinear)
+            y += alto
+        return y
+
+    def tabla(self, t: Tabla, ctx, x0: float, y: float) -> float:
+        y += t.antes
+        for i, fila in enumerate(t.filas):
+            celdas = [(self.lineas(" ".join(p.format_map(ctx).split()), est, ancho - 2 * t.relleno), est, al)
+                      for (p, est, al), ancho in zip(fila, t.anchos)]
+            alto = max(len(ls) * self.alto_linea(est) for ls, est, _ in celdas) + 2 * t.relleno
+            x = x0 + t.x
+            if i == 0 and t.cabecera:
+                self.ops.append("%s rg %.2f %.2f %.2f %.2f re f" % (_rgb(t.cabecera), x, PAGINA[1] - y - alto, sum(t.anchos), alto))
+            for (ls, est, al), ancho in zip(celdas, t.anchos):
+                yl = y + t.relleno
+                for linea in ls:
+                    self.escribir(linea, est, x + t.relleno, yl, ancho - 2 * t.relleno, al)
+                    yl += self.alto_linea(est)
+                if t.borde:
+                    self.ops.append("%s RG 1.5 w %.2f %.2f %.2f %.2f re S" % (_rgb(t.borde), x, PAGINA[1] - y - alto, ancho, alto))
+                x += ancho
+            y += alto
+        return y
+
+    def componer(self, elementos, ctx, x0: float, ancho: float, y: float) -> float:
+        for el in elementos:
+            if isinstance(el, Texto):
+                y = self.parrafo(el, ctx, x0, ancho, y)
+            elif isinstance(el, Tabla):
+                y = self.tabla(el, ctx, x0, y)
+            elif isinstance(el, Columnas):
+                y_izq = self.componer(el.izq, ctx, x0, el.ancho_izq, y)
+                y_der = self.componer(el.der, ctx, x0 + el.x_der, ancho - el.x_der, y)
+                y = max(y_izq, y_der)
+            elif isinstance(el, Fijo):
+                self.componer(el.elementos, ctx, x0, ancho, el.y)
+        return y
+
+def _extra(ctx: dict) -> frozenset:
+    # Caracteres del documento fuera del juego base (se suman al subconjunto)
+    return frozenset(ch for v in ctx.values() if isinstance(v, str) for ch in v) - CARACTERES_BASE - frozenset("\n\r\t")
+
+def generar_bytes(tpl_path: str, ctx: dict) -> bytes:
+    disposicion = DISPOSICIONES[dominio_plantilla(tpl_path)]
+    extra = _extra(ctx)
+    regular, negrita = fuente(FUENTE_REGULAR), fuente(FUENTE_NEGRITA)
+    extra = frozenset(ch for ch in extra if ord(ch) in regular.cmap or ord(ch) in negrita.cmap)
+    objetos, recursos, contenido_fondo = _recursos_fijos(tpl_path, _firma(tpl_path), extra)
+
+    lienzo = _Lienzo(regular, negrita)
+    valores = _Ctx({k: ("" if v is None else str(v)) for k, v in ctx.items()})
+    lienzo.componer(disposicion, valores, MARGEN_IZQ, PAGINA[0] - MARGEN_IZQ - MARGEN_DER, 0.0)
+    contenido = contenido_fondo + b"\n" + "\n".join(lienzo.ops).encode("latin-1")
+
+    cuerpos = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+               b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %g %g] /Resources %s /Contents 4 0 R >>"
+               % (PAGINA[0], PAGINA[1], recursos),
+               _stream("/Filter /FlateDecode", zlib.compress(contenido, 6))]
+    salida = [b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n"]
+    pos, offsets = len(salida[0]), []
+    for i, cuerpo in enumerate(cuerpos + objetos, 1):
+        offsets.append(pos)
+        trozo = b"%d 0 obj\n" % i
+        salida += (trozo, cuerpo, b"\nendobj\n")
+        pos += len(trozo) + len(cuerpo) + 8
+    n = len(offsets) + 1
+    salida.append(b"xref\n0 %d\n0000000000 65535 f \n" % n)
+    salida.append(b"".join(b"%010d 00000 n \n" % o for o in offsets))
+    salida.append(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (n, pos))
+    return b"".join(salida)
+
+def generar(pdf_path: str, tpl_path: str, ctx: dict) -> None:
+    datos = generar_bytes(tpl_path, ctx)
+    tmp = pdf_path + ".tmp"
+    with open(tmp, "wb") as f: f.write(datos)
+    os.replace(tmp, pdf_path)
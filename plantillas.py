@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Caché de plantillas DOCX compiladas (docxtpl)
+#
+# Por plantilla se guarda, una vez por proceso: los bytes del .docx, el XML
+# del cuerpo/encabezados/pies ya "parchado" por docxtpl y compilado a un
+# jinja2.Template. Cada render abre un Document nuevo desde los bytes en
+# memoria (sin disco) y se salta get_xml/patch_xml/compilación Jinja.
+# Se invalida cuando cambia el mtime/tamaño del archivo (y entonces el hash).
+# docxtpl (python-docx + lxml) se importa en el primer render, no al importar.
+# -----------------------------------------------------------------------------
+import os, re, io, hashlib, threading, logging
+from functools import lru_cache
+from jinja2 import Template
+
+log = logging.getLogger("plantillas")
+
+PLANTILLAS_CACHE   = (os.getenv("TEMPLATE_CACHE", "true").lower() == "true")
+PLANTILLAS_PRELOAD = (os.getenv("TEMPLATE_PRELOAD", "false").lower() == "true")
+
+def _docx_template():
+    from docxtpl import DocxTemplate
+    return DocxTemplate
+
+@lru_cache(maxsize=None)
+def _clase_compilada():
+    DocxTemplate = _docx_template()
+
+    class _DocxTemplateCompilada(DocxTemplate):
+        def __init__(self, compilada: "PlantillaCompilada"):
+            super().__init__(io.BytesIO(compilada.blob))
+            self._compilada = compilada
+
+        def _render_compilado(self, template: Template, part, context) -> str:
+            # Mismo post-proceso que DocxTemplate.render_xml_part, sin recompilar
+            self.current_rendering_part = part
+            dst_xml = template.render(context)
+            dst_xml = re.sub(r"\n<w:p([ >])", r"<w:p\1", dst_xml)
+            dst_xml = (dst_xml.replace("{_{", "{{").replace("}_}", "}}")
+                              .replace("{_%", "{%").replace("%_}", "%}"))
+            return self.resolve_listing(dst_xml)
+
+        def build_xml(self, context, jinja_env=None):
+            if jinja_env is not None: return super().build_xml(context, jinja_env)
+            return self._render_compilado(self._compilada.cuerpo, self.docx._part, context)
+
+        def build_headers_footers_xml(self, context, uri, jinja_env=None):
+            if jinja_env is not None:
+                yield from super().build_headers_footers_xml(context, uri, jinja_env); return
+            for relKey, part in self.get_headers_footers(uri):
+                comp = self._compilada.partes.get(str(part.partname))
+                if comp is None:
+                    xml = self.patch_xml(self.get_part_xml(part))
+                    encoding = self.get_headers_footers_encoding(xml)
+                    xml = self.render_xml_part(xml, part, context, jinja_env)
+                else:
+                    template, encoding = comp
+                    xml = self._render_compilado(template, part, context)
+                yield relKey, xml.encode(encoding)
+
+    return _DocxTemplateCompilada
+
+def _compilar(src_xml: str) -> Template:
+    return Template(re.sub(r"<w:p([ >])", r"\n<w:p\1", src_xml))
+
+class PlantillaCompilada:
+    def __init__(self, path: str):
+        self.path = path
+        st = os.stat(path)
+        self.firma = (st.st_mtime_ns, st.st_size)
+        with open(path, "rb") as f: self.blob = f.read()
+        self.sha256 = hashlib.sha256(self.blob).hexdigest()
+        DocxTemplate = _docx_template()
+        base = DocxTemplate(io.BytesIO(self.blob)); base.init_docx()
+        self.cuerpo = _compilar(base.patch_xml(base.get_xml()))
+        self.partes = {}
+        for uri in (DocxTemplate.HEADER_URI, DocxTemplate.FOOTER_URI):
+            for _, part in base.get_headers_footers(uri):
+                xml = base.get_part_xml(part)
+                encoding = base.get_headers_footers_encoding(xml)
+                self.partes[str(part.partname)] = (_compilar(base.patch_xml(xml)), encoding)
+
+    def nueva(self) -> "DocxTemplate":
+        return _clase_compilada()(self)
+
+class CachePlantillas:
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.recargas = 0
+
+    def obtener(self, path: str) -> PlantillaCompilada:
+        st = os.stat(path)
+        firma = (st.st_mtime_ns, st.st_size)
+        item = self._items.get(path)
+        if item is not None and item.firma == firma:
+            self.hits += 1
+            return item
+        with self._lock:
+            item = self._items.get(path)
+            if item is not None and item.firma == firma:
+                self.hits += 1
+                return item
+            if item is not None: self.recargas += 1
+            self.misses += 1
+            item = PlantillaCompilada(path)
+            self._items[path] = item
+            log.info("Plantilla compilada: %s (%s)", os.path.basename(path), item.sha256[:12])
+            return item
+
+    def precargar(self, paths):
+        for p in paths:
+            if not os.path.exists(p): continue
+            try: self.obtener(p)
+            except Exception as e: log.warning("No se pudo precargar %s: %s", p, e)
+
+    def estado(self) -> dict:
+        return {"enabled": PLANTILLAS_CACHE, "hits": self.hits, "misses": self.misses, "reloads": self.recargas,
+                "cached": {os.path.basename(p): it.sha256[:12] for p, it in list(self._items.items())}}
+
+cache = CachePlantillas()
+_hashes = {}
+
+def hash_plantilla(path: str) -> str:
+    # sha256 del .docx, recalculado solo si cambia mtime/tamaño
+    if PLANTILLAS_CACHE: return cache.obtener(path).sha256
+    st = os.stat(path)
+    firma = (st.st_mtime_ns, st.st_size)
+    item = _hashes.get(path)
+    if item is None or item[0] != firma:
+        with open(path, "rb") as f: item = (firma, hashlib.sha256(f.read()).hexdigest())
+        _hashes[path] = item
+    return item[1]
+
+def docx_template(path: str) -> "DocxTemplate":
+    if not PLANTILLAS_CACHE: return _docx_template()(path)
+    return cache.obtener(path).nueva()
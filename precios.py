@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Tablas de precios versionadas
+#
+# Fuentes, en orden: Redis (PRICE_TABLES_REDIS_KEY, JSON), archivo
+# (PRICE_TABLES_FILE, por defecto precios.json junto a app.py) y, si no hay
+# ninguna, las tablas incluidas abajo. Formato (mismo que TABLAS_INCLUIDAS):
+#   {"version": "2026-10-01",
+#    "plagas":   {"hasta_m2": [50, 100, ...], "precios": {"desratizacion": [...]}},
+#    "piscinas": {"hasta_m3": [25, 50, 100],  "precios": {"piscina_shock_m3": [...]}},
+#    "camaras":  {"precios": {"dvr": {"interior": 75000}}, "descuentos": [[5, 0.85], ...]}}
+# `hasta_*` son los topes (inclusive) de cada tramo; el último tramo es abierto,
+# así que cada lista de precios tiene len(hasta) + 1 valores.
+#
+# compilar() valida y arma tuplas ordenadas para búsqueda con bisect; la tabla
+# activa se reemplaza de una vez (una asignación), nunca se edita en sitio.
+# actual() revisa la fuente cada PRICE_RELOAD_INTERVAL_SECONDS.
+# -----------------------------------------------------------------------------
+import os, json, time, logging, threading, datetime
+from bisect import bisect_left
+
+log = logging.getLogger("precios")
+
+PRICE_TABLES_FILE   = os.getenv("PRICE_TABLES_FILE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "precios.json")
+PRICE_TABLES_KEY    = os.getenv("PRICE_TABLES_REDIS_KEY", "precios:tablas")
+PRICE_RELOAD_EVERY  = float(os.getenv("PRICE_RELOAD_INTERVAL_SECONDS", "30"))
+
+TABLAS_INCLUIDAS = {
+    "version": "incluida",
+    "plagas": {
+        "hasta_m2": [50, 100, 200, 300, 500, 1000, 2000],
+        "precios": {
+            "desinsectacion": [37500, 47500, 65000, 80000, 105000, 165000, 270000, 440000],
+            "desratizacion":  [34000, 44000, 60000, 75000,  97500, 150000, 235000, 375000],
+            "desinfeccion":   [30000, 40000, 55000, 70000,  90000, 140000, 220000, 350000],
+        },
+    },
+    "piscinas": {
+        "hasta_m3": [25, 50, 100],
+        "precios": {
+            "piscina_plan_intermedio_m3":  [3900, 3400, 3100, 2900],
+            "piscina_mantencion_bomba_m3": [3200, 3000, 2800, 2600],
+            "piscina_shock_m3":            [1500, 1300, 1100, 900],
+            "piscina_diagnostico_total":   [30000, 35000, 40000, 45000],
+            "piscina_cambio_arena_total":  [90000, 140000, 200000, 300000],
+        },
+    },
+    "camaras": {
+        "precios": {
+            "alambricas":   {"interior": 70000, "exterior": 90000},
+            "inalambricas": {"interior": 60000, "exterior": 80000},
+            "solares":      {"exterior": 150000},
+            "dvr":          {"interior": 75000, "exterior": 95000},
+        },
+        "descuentos": [[5, 0.85], [3, 0.90], [2, 0.95]],
+    },
+}
+
+class TablasInvalidas(ValueError):
+    def __init__(self, errores):
+        super().__init__("; ".join(errores))
+        self.errores = list(errores)
+
+class TablaPrecios:
+    def __init__(self, version, hasta_m2, plagas, hasta_m3, piscinas, camaras, descuentos, fuente=""):
+        self.version = version
+        self.hasta_m2 = hasta_m2          # tuple[int] ordenada
+        self.plagas = plagas              # servicio -> tuple[int]
+        self.hasta_m3 = hasta_m3
+        self.piscinas = piscinas
+        self.camaras = camaras            # tipo -> {area: int}
+        self.descuentos = descuentos      # tuple[(min_qty, factor)] de mayor a menor
+        self.fuente = fuente
+        self.cargada = datetime.datetime.utcnow().isoformat() + "Z"
+
+    def tramo_m2(self, m2) -> int:
+        return bisect_left(self.hasta_m2, max(0, int(float(m2) if m2 else 0)))
+
+    def tramo_m3(self, m3: float) -> int:
+        return bisect_left(self.hasta_m3, max(0.0, m3))
+
+    def rango(self, limites, i: int, unidad: str) -> str:
+        lo = limites[i - 1] + 1 if i else 0
+        return f"{lo}-{limites[i]} {unidad}" if i < len(limites) else f"más de {limites[-1]} {unidad}"
+
+    def plaga(self, servicio: str, m2) -> int:
+        tabla = self.plagas.get(servicio)
+        return tabla[self.tramo_m2(m2)] if tabla else 0
+
+    def piscina(self, serv_key: str, m3: float) -> int:
+        # Servicios *_m3: precio por m³ del tramo x volumen; el resto: total del tramo
+        if m3 <= 0 and serv_key.endswith("_m3"): return 0
+        tabla = self.piscinas.get(serv_key)
+        if not tabla: return 0
+        unit = tabla[self.tramo_m3(m3)]
+        if serv_key.endswith("_m3"): return int(round(unit * m3)) if unit > 0 else 0
+        return unit
+
+    def descuento(self, qty: int) -> float:
+        for minimo, factor in self.descuentos:
+            if qty >= minimo: return factor
+        return 1.0
+
+    def estado(self) -> dict:
+        return {"version": self.version, "source": self.fuente, "loaded_at": self.cargada}
+
+def _enteros(valores, n, donde, errores):
+    if not isinstance(valores, list) or len(valores) != n:
+        errores.append(f"{donde}: se esperaban {n} precios"); return ()
+    try: return tuple(int(v) for v in valores)
+    except (TypeError, ValueError): errores.append(f"{donde}: precio no numérico"); return ()
+
+def _limites(valores, donde, errores):
+    try: lim = tuple(float(v) if isinstance(v, float) else int(v) for v in (valores or []))
+    except (TypeError, ValueError): errores.append(f"{donde}: tope no numérico"); return ()
+    if not lim: errores.append(f"{donde}: sin tramos")
+    elif any(b <= a for a, b in zip(lim, lim[1:])): errores.append(f"{donde}: topes no crecientes")
+    return lim
+
+def compilar(raw: dict, fuente: str = "") -> TablaPrecios:
+    errores = []
+    if not isinstance(raw, dict): raise TablasInvalidas(["la tabla debe ser un objeto JSON"])
+    pl, pi, ca = raw.get("plagas") or {}, raw.get("piscinas") or {}, raw.get("camaras") or {}
+    hasta_m2 = _limites(pl.get("hasta_m2"), "plagas.hasta_m2", errores)
+    hasta_m3 = _limites(pi.get("hasta_m3"), "piscinas.hasta_m3", errores)
+    plagas = {k: _enteros(v, len(hasta_m2) + 1, f"plagas.{k}", errores) for k, v in (pl.get("precios") or {}).items()}
+    piscinas = {k: _enteros(v, len(hasta_m3) + 1, f"piscinas.{k}", errores) for k, v in (pi.get("precios") or {}).items()}
+    if not plagas: errores.append("plagas.precios vacío")
+    if not piscinas: errores.append("piscinas.precios vacío")
+    camaras = {}
+    for tipo, areas in (ca.get("precios") or {}).items():
+        if not isinstance(areas, dict) or not areas:
+            errores.append(f"camaras.{tipo}: sin áreas"); continue
+        try: camaras[tipo] = {a: int(v) for a, v in areas.items()}
+        except (TypeError, ValueError): errores.append(f"camaras.{tipo}: precio no numérico")
+    if not camaras: errores.append("camaras.precios vacío")
+    try:
+        descuentos = tuple(sorted(((int(q), float(f)) for q, f in ca.get("descuentos") or []), reverse=True))
+    except (TypeError, ValueError):
+        errores.append("camaras.descuentos: se esperaban pares [cantidad, factor]"); descuentos = ()
+    if errores: raise TablasInvalidas(errores)
+    return TablaPrecios(str(raw.get("version") or "sin-version"), hasta_m2, plagas, hasta_m3, piscinas,
+                        camaras, descuentos, fuente)
+
+class Precios:
+    def __init__(self, archivo: str = PRICE_TABLES_FILE, redis_cli=None):
+        self.archivo = archivo
+        self.r = redis_cli
+        self._tabla = compilar(TABLAS_INCLUIDAS, "incluida")
+        self._firma = None
+        self._revisado = 0.0
+        self._lock = threading.Lock()
+
+    def _leer_fuente(self):
+        # -> (firma, raw, fuente) o None si no hay fuente externa
+        if self.r is not None:
+            try:
+                raw = self.r.get(PRICE_TABLES_KEY)
+                if raw: return ("redis", raw), json.loads(raw), f"redis:{PRICE_TABLES_KEY}"
+            except Exception as e:
+                log.warning("No se pudieron leer precios de Redis: %s", e)
+        if self.archivo and os.path.exists(self.archivo):
+            st = os.stat(self.archivo)
+            firma = ("archivo", st.st_mtime_ns, st.st_size)
+            if firma == self._firma: return firma, None, None
+            with open(self.archivo, "r", encoding="utf-8") as f: return firma, json.load(f), self.archivo
+        return None
+
+    def recargar(self, forzar: bool = False) -> TablaPrecios:
+        # Compila y después reemplaza; con tablas inválidas queda la anterior y se propaga el error
+        with self._lock:
+            self._revisado = time.monotonic()
+            leido = self._leer_fuente()
+            if leido is None:
+                if self._firma is not None:
+                    self._tabla, self._firma = compilar(TABLAS_INCLUIDAS, "incluida"), None
+                return self._tabla
+            firma, raw, fuente = leido
+            if firma == self._firma and not forzar: return self._tabla
+            if raw is None:
+                with open(self.archivo, "r", encoding="utf-8") as f: raw = json.load(f)
+                fuente = self.archivo
+            try:
+                tabla = compilar(raw, fuente)
+            finally:
+                self._firma = firma      # no reintentar la misma versión inválida en cada request
+            if tabla.version != self._tabla.version or tabla.fuente != self._tabla.fuente:
+                log.info("Tablas de precios %s cargadas desde %s", tabla.version, fuente)
+            self._tabla = tabla
+            return tabla
+
+    def actual(self) -> TablaPrecios:
+        if time.monotonic() - self._revisado >= PRICE_RELOAD_EVERY:
+            try: self.recargar()
+            except Exception as e: log.warning("Tablas de precios inválidas, se mantiene %s: %s", self._tabla.version, e)
+        return self._tabla
+
+    def estado(self) -> dict:
+        return self._tabla.estado()
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Sesiones del webhook (Redis + respaldo en memoria)
+#
+# - abrir() hace dedup (SET NX del MessageSid) y carga la sesión en un solo
+#   viaje a Redis (pipeline); guardar() la escribe una vez al final del turno.
+#   abrir_async()/guardar_async() son lo mismo con redis.asyncio (asgi.py).
+# - Circuito sobre Redis: errores o respuestas lentas seguidas lo abren y,
+#   mientras está abierto, no se toca Redis por REDIS_BREAKER_COOLDOWN_SECONDS.
+# - Cada sesión guardada queda también en un almacén local TTL/LRU acotado:
+#   sin Redis (o con el circuito abierto) las conversaciones siguen en este
+#   nodo. Las escritas solo en local se suben a Redis en su próximo turno.
+#   Ojo: sin Redis el estado es por proceso (usar un solo worker).
+# - Formato: hash Redis `s:<clave>` con códigos de campo cortos (n, q, o, m,
+#   f...), una entrada `.<variable>` por respuesta y los ids de nodo en base36.
+#   Los hashes chicos quedan en listpack: ~la mitad de bytes que el JSON.
+#   Cada turno escribe solo los campos que cambiaron (HSET/HDEL + EXPIRE en el
+#   mismo viaje). Ver bench/bench_sesiones.py para el reporte de memoria.
+# -----------------------------------------------------------------------------
+import os, sys, json, time, logging, threading, collections
+
+log = logging.getLogger("sesiones")
+
+SESSION_TTL        = int(os.getenv("SESSION_TTL_SECONDS", str(60*60*12)))
+SESSION_LOCAL_MAX  = int(os.getenv("SESSION_LOCAL_MAX", "10000"))
+DEDUP_TTL          = int(os.getenv("DEDUP_TTL_SECONDS", "300"))
+REDIS_SLOW_MS      = float(os.getenv("REDIS_SLOW_MS", "250"))
+BREAKER_FAILURES   = max(1, int(os.getenv("REDIS_BREAKER_FAILURES", "3")))
+BREAKER_COOLDOWN   = float(os.getenv("REDIS_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Campo de la sesión -> código en el hash. Las respuestas van como ".<variable>",
+# otras claves como "~<clave>"; los valores que no son str llevan prefijo "#" (JSON).
+CODIGOS = {"node_id": "n", "last_question": "q", "awaiting_option_for": "o", "pending_next_id": "p",
+           "last_msg_sid": "m", "from_wa": "f", "finished": "x"}
+_CAMPOS = {v: k for k, v in CODIGOS.items()}
+_NODOS = ("n", "q", "o", "p")
+_B36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+def _id_corto(v: str) -> str:
+    # "1748909520753" -> "mbfq8w2x" (estable entre recargas del flujo)
+    if v.isdigit() and v[0] != "0":
+        n, out = int(v), ""
+        while n: n, r = divmod(n, 36); out = _B36[r] + out
+        return out
+    return "!" + v
+
+def _id_largo(v: str) -> str:
+    return sys.intern(v[1:] if v.startswith("!") else str(int(v, 36)))
+
+class Sesion(dict):
+    # dict normal + los campos tal como se leyeron (base para escribir solo el diff)
+    __slots__ = ("base",)
+
+def codificar(sess: dict) -> dict:
+    plano = {}
+    for k, v in sess.items():
+        if k == "data":
+            for dk, dv in (v or {}).items():
+                if dv is None: continue
+                if isinstance(dv, str): plano[sys.intern("." + dk)] = dv
+                else: plano[sys.intern("#." + dk)] = json.dumps(dv, ensure_ascii=False)
+            continue
+        if v is None: continue
+        c = CODIGOS.get(k) or "~" + k
+        if isinstance(v, str):
+            plano[c] = sys.intern(_id_corto(v)) if c in _NODOS and v else v
+        else:
+            plano["#" + c] = json.dumps(v, ensure_ascii=False)
+    return plano
+
+def decodificar(plano: dict) -> Sesion:
+    sess, data = Sesion(), {}
+    for c, v in plano.items():
+        crudo = c.startswith("#")
+        if crudo: c, v = c[1:], json.loads(v)
+        if c.startswith("."):
+            data[sys.intern(c[1:])] = v; continue
+        k = _CAMPOS.get(c) or c[1:]
+        if c in _NODOS and v and not crudo: v = _id_largo(v)
+        sess[k] = v
+    for k in CODIGOS:
+        sess.setdefault(k, None)
+    sess["data"] = data
+    sess.base = dict(plano)
+    return sess
+
+class MemoriaTTL:
+    # Diccionario con TTL por entrada y tope de tamaño (desaloja lo menos usado)
+    def __init__(self, max_items: int, ttl: float):
+        self.max_items = max(1, max_items)
+        self.ttl = ttl
+        self._d = collections.OrderedDict()   # clave -> (vence, valor)
+        self._lock = threading.Lock()
+
+    def get(self, k):
+        with self._lock:
+            item = self._d.get(k)
+            if item is None: return None
+            if item[0] < time.monotonic():
+                del self._d[k]; return None
+            self._d.move_to_end(k)
+            return item[1]
+
+    def set(self, k, v, ttl: float = None):
+        with self._lock:
+            self._d[k] = (time.monotonic() + (self.ttl if ttl is None else ttl), v)
+            self._d.move_to_end(k)
+            while len(self._d) > self.max_items: self._d.popitem(last=False)
+
+    def set_nx(self, k, v, ttl: float = None) -> bool:
+        with self._lock:
+            item = self._d.get(k)
+            if item is not None and item[0] >= time.monotonic(): return False
+            self._d[k] = (time.monotonic() + (self.ttl if ttl is None else ttl), v)
+            while len(self._d) > self.max_items: self._d.popitem(last=False)
+            return True
+
+    def pop(self, k):
+        with self._lock:
+            item = self._d.pop(k, None)
+        return item[1] if item else None
+
+    def __len__(self):
+        return len(self._d)
+
+class Circuito:
+    # cerrado -> (N fallos/lentos seguidos) -> abierto -> (cooldown) -> medio abierto (1 prueba)
+    def __init__(self, fallos: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN, lento_ms: float = REDIS_SLOW_MS):
+        self.fallos_max = fallos
+        self.cooldown = cooldown
+        self.lento = lento_ms / 1000.0
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+        self.aperturas = 0
+        self._probando = False
+        self._lock = threading.Lock()
+
+    def permitir(self) -> bool:
+        with self._lock:
+            if self.fallos < self.fallos_max: return True
+            if time.monotonic() < self.abierto_hasta or self._probando: return False
+            self._probando = True
+            return True
+
+    def registrar(self, ok: bool, segundos: float = 0.0):
+        with self._lock:
+            self._probando = False
+            if ok and segundos <= self.lento:
+                self.fallos = 0; return
+            self.fallos += 1
+            if self.fallos >= self.fallos_max:
+                if time.monotonic() >= self.abierto_hasta:
+                    self.aperturas += 1
+                    log.warning("Circuito Redis abierto (%s); sesiones en memoria local por %ss",
+                                "lento" if ok else "error", self.cooldown)
+                self.abierto_hasta = time.monotonic() + self.cooldown
+
+    def estado(self) -> str:
+        if self.fallos < self.fallos_max: return "closed"
+        return "open" if time.monotonic() < self.abierto_hasta else "half_open"
+
+class AlmacenSesiones:
+    def __init__(self, redis_cli=None, ttl: int = SESSION_TTL, max_local: int = SESSION_LOCAL_MAX):
+        self.r = redis_cli
+        self.redis_async = None      # cliente redis.asyncio; lo instala asgi.py al arrancar
+        self.ttl = ttl
+        self.local = MemoriaTTL(max_local, ttl)
+        self.dedup_local = MemoriaTTL(max_local * 4, DEDUP_TTL)
+        self.circuito = Circuito()
+        self._solo_local = set()     # claves escritas con Redis caído (se suben al volver)
+        self.redis_ok = 0
+        self.redis_err = 0
+        self.locales = 0
+
+    def _redis(self, fn):
+        # Ejecuta fn(cliente) bajo el circuito; None si no hay Redis o falló
+        if self.r is None or not self.circuito.permitir(): return None
+        t0 = time.monotonic()
+        try:
+            res = fn(self.r)
+        except Exception as e:
+            return self._fallo(e)
+        return self._exito(res, t0)
+
+    async def _redis_async(self, fn):
+        # Igual que _redis() pero con el cliente redis.asyncio (modo ASGI)
+        if self.redis_async is None or not self.circuito.permitir(): return None
+        t0 = time.monotonic()
+        try:
+            res = await fn(self.redis_async)
+        except Exception as e:
+            return self._fallo(e)
+        return self._exito(res, t0)
+
+    def _fallo(self, e):
+        self.circuito.registrar(False)
+        self.redis_err += 1
+        log.warning("Redis (sesiones) falló: %s", e)
+        return None
+
+    def _exito(self, res, t0: float):
+        self.circuito.registrar(True, time.monotonic() - t0)
+        self.redis_ok += 1
+        return res
+
+    # Los comandos se encolan igual en un pipeline síncrono o asíncrono; solo
+    # cambia quién hace execute(). abrir/guardar y sus versiones _async comparten esto.
+    def _pipeline_abrir(self, r, key: str, msg_sid: str):
+        p = r.pipeline(transaction=False)
+        if msg_sid: p.set(f"dedup:{msg_sid}", "1", nx=True, ex=DEDUP_TTL)
+        p.hgetall(f"s:{key}")
+        p.get(f"sess:{key}")          # formato JSON anterior (sesiones abiertas antes del cambio)
+        return p
+
+    def _tras_abrir(self, key: str, msg_sid: str, res):
+        if res is None:
+            self.locales += 1
+            if msg_sid and not self.dedup_local.set_nx(msg_sid, 1): return False, None
+            plano = self.local.get(key)
+            return True, (decodificar(plano) if plano else None)
+        if msg_sid and not res[0]: return False, None
+        if key in self._solo_local:
+            plano = self.local.get(key)
+            if plano: return True, decodificar(plano)
+        plano, legado = res[-2], res[-1]
+        if plano: return True, decodificar(plano)
+        if legado:
+            sess = Sesion(json.loads(legado)); sess.base = None
+            return True, sess
+        return True, None
+
+    def abrir(self, key: str, msg_sid: str = ""):
+        # -> (procesar, Sesion o None). procesar=False: MessageSid repetido (reintento de Twilio)
+        res = self._redis(lambda r: self._pipeline_abrir(r, key, msg_sid).execute())
+        return self._tras_abrir(key, msg_sid, res)
+
+    async def abrir_async(self, key: str, msg_sid: str = ""):
+        res = await self._redis_async(lambda r: self._pipeline_abrir(r, key, msg_sid).execute())
+        return self._tras_abrir(key, msg_sid, res)
+
+    def _preparar_guardar(self, key: str, sess: dict):
+        # -> (plano, llenar(r) -> pipeline o None si no hay Redis configurado)
+        plano = codificar(sess)
+        base = getattr(sess, "base", None)
+        self.local.set(key, plano)
+        if self.r is None and self.redis_async is None: return plano, None
+        hk = f"s:{key}"
+        if base is None or key in self._solo_local:
+            def _llenar(r):
+                # Sesión nueva/reiniciada o base desconocida: reemplazo completo
+                p = r.pipeline(transaction=True)
+                p.delete(hk, f"sess:{key}")
+                if plano: p.hset(hk, mapping=plano)
+                p.expire(hk, self.ttl)
+                return p
+        else:
+            cambios = {c: v for c, v in plano.items() if base.get(c) != v}
+            borrados = [c for c in base if c not in plano]
+            def _llenar(r):
+                p = r.pipeline(transaction=True)
+                if cambios: p.hset(hk, mapping=cambios)
+                if borrados: p.hdel(hk, *borrados)
+                p.expire(hk, self.ttl)
+                return p
+        return plano, _llenar
+
+    def _tras_guardar(self, key: str, sess: dict, plano: dict, res):
+        if res is None:
+            if len(self._solo_local) > self.local.max_items: self._solo_local.clear()
+            self._solo_local.add(key)
+        else:
+            self._solo_local.discard(key)
+            if isinstance(sess, Sesion): sess.base = plano
+
+    def guardar(self, key: str, sess: dict):
+        plano, llenar = self._preparar_guardar(key, sess)
+        if llenar is None: return
+        self._tras_guardar(key, sess, plano, self._redis(lambda r: llenar(r).execute()))
+
+    async def guardar_async(self, key: str, sess: dict):
+        plano, llenar = self._preparar_guardar(key, sess)
+        if llenar is None: return
+        self._tras_guardar(key, sess, plano, await self._redis_async(lambda r: llenar(r).execute()))
+
+    def borrar(self, key: str):
+        self.local.pop(key)
+        self._solo_local.discard(key)
+        self._redis(lambda r: r.delete(f"s:{key}", f"sess:{key}"))
+
+    def estado(self) -> dict:
+        con_redis = self.r is not None or self.redis_async is not None
+        return {"backend": "redis" if con_redis else "memory", "breaker": self.circuito.estado() if con_redis else None,
+                "breaker_opens": self.circuito.aperturas, "redis_ok": self.redis_ok, "redis_errors": self.redis_err,
+                "local_fallbacks": self.locales, "local_sessions": len(self.local), "pending_sync": len(self._solo_local)}
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Cola de trabajos para cotizaciones (render -> PDF -> envío) fuera del request
+#
+# Backend "local": pool de hilos por proceso con cola acotada.
+# Backend "redis": la cola es una lista Redis que consumen los hilos de
+# cualquier worker/nodo. BLMOVE (Redis >= 6.2) pasa cada trabajo a la lista
+# "en proceso" del worker (jobs:procesando:<host>:<pid>) y se quita de ahí al
+# terminar. Cada worker renueva un latido (jobs:vivo:<host>:<pid>, vence a los
+# JOBS_LEASE_SECONDS); el que encuentra vencido el de otro devuelve sus
+# trabajos al frente de la cola (si ya mataron JOBS_MAX_ATTEMPTS workers,
+# quedan "failed"). Entrega al menos una vez: un worker vivo que no pudo
+# renovar su latido puede ver su trabajo repetido. El tope JOBS_QUEUE_MAX se
+# aplica empujando y retirando lo que se pasó: el largo puede excederlo un
+# instante, pero no queda excedido ni se rechaza un trabajo que ya se tomó.
+# En ambos casos el estado de cada trabajo vive en Redis si está disponible
+# (así GET /jobs/<id> responde desde cualquier worker) y si no, en memoria del
+# proceso. Si Redis no responde al encolar, ColaNoDisponible (el trabajo queda
+# "failed", no "queued") y quien llama responde 503.
+# Un error con `reintentar_en` (p. ej. conversor_lo.ConversorSaturado) no gasta
+# intentos: el trabajo espera ese tiempo, hasta JOBS_BUSY_MAX_SECONDS en total.
+# -----------------------------------------------------------------------------
+import os, time, json, uuid, queue, random, socket, logging, threading, datetime
+
+log = logging.getLogger("trabajos")
+
+JOBS_BACKEND      = (os.getenv("JOBS_BACKEND", "local") or "local").strip().lower()   # local | redis
+JOBS_WORKERS      = max(1, int(os.getenv("JOBS_WORKERS", "2")))
+JOBS_QUEUE_MAX    = max(1, int(os.getenv("JOBS_QUEUE_MAX", "100")))
+JOBS_MAX_ATTEMPTS = max(1, int(os.getenv("JOBS_MAX_ATTEMPTS", "3")))
+JOBS_RETRY_BASE   = float(os.getenv("JOBS_RETRY_BASE_SECONDS", "2"))
+JOBS_TTL          = int(os.getenv("JOBS_TTL_SECONDS", str(60*60*24)))
+JOBS_BUSY_MAX     = float(os.getenv("JOBS_BUSY_MAX_SECONDS", "600"))
+JOBS_LEASE        = max(5, int(os.getenv("JOBS_LEASE_SECONDS", "60")))
+
+REDIS_QUEUE_KEY = "jobs:pendientes"
+REDIS_CONSUMERS_KEY = "jobs:consumidores"
+ESPERA_COLA = 5     # segundos de BLMOVE; el socket del cliente bloqueante debe esperar más
+
+class ColaLlena(Exception):
+    pass
+
+class ColaNoDisponible(Exception):
+    # Redis (JOBS_BACKEND=redis) no respondió al encolar; el trabajo no quedó en cola
+    pass
+
+def _ahora() -> str:
+    return datetime.datetime.utcnow().isoformat() + "Z"
+
+class ColaTrabajos:
+    def __init__(self, redis_cli=None, backend: str = JOBS_BACKEND, workers: int = JOBS_WORKERS,
+                 maxsize: int = JOBS_QUEUE_MAX, redis_bloqueo=None):
+        # redis_bloqueo: cliente para BLMOVE con socket_timeout > ESPERA_COLA (ver conexiones.bloqueante)
+        self.pid = os.getpid()
+        self._r = redis_cli
+        self._rb = redis_bloqueo or redis_cli
+        if backend == "redis" and redis_cli is None:
+            log.warning("JOBS_BACKEND=redis sin Redis disponible; usando cola local.")
+            backend = "local"
+        self.backend = backend
+        self.workers = workers
+        self.maxsize = maxsize
+        self._handlers = {}
+        self._cola = queue.Queue(maxsize=maxsize)
+        self._estados = {}
+        self._lock = threading.Lock()
+        self._arrancado = False
+        self._detener = threading.Event()
+        self.consumidor = f"{socket.gethostname()}:{self.pid}"
+        self._procesando = f"jobs:procesando:{self.consumidor}"
+        self.recuperados = 0
+
+    # ---- registro / arranque ------------------------------------------------
+    def registrar(self, tipo: str, fn):
+        # fn(payload: dict, progreso: callable) -> dict (resultado serializable)
+        self._handlers[tipo] = fn
+
+    def arrancar(self):
+        with self._lock:
+            if self._arrancado: return
+            self._arrancado = True
+        if self.backend == "redis":
+            self._latir()
+            # Lo que quedó en proceso con este mismo nombre es de una vida anterior del worker
+            try: self._recuperar_de(self.consumidor)
+            except Exception as e: log.warning("Recuperación de trabajos falló: %s", e)
+            threading.Thread(target=self._loop_latido, name="jobs-lease", daemon=True).start()
+        for i in range(self.workers):
+            threading.Thread(target=self._loop, name=f"jobs-{i}", daemon=True).start()
+
+    # ---- latido / recuperación (backend redis) ------------------------------
+    def _latir(self):
+        try:
+            self._r.set(f"jobs:vivo:{self.consumidor}", "1", ex=JOBS_LEASE)
+            self._r.hset(REDIS_CONSUMERS_KEY, self.consumidor, _ahora())
+        except Exception as e:
+            log.warning("No se pudo renovar el latido de %s: %s", self.consumidor, e)
+
+    def _loop_latido(self):
+        while not self._detener.wait(JOBS_LEASE / 3):
+            self._latir()
+            try: self.recuperar()
+            except Exception as e: log.warning("Recuperación de trabajos falló: %s", e)
+
+    def recuperar(self) -> int:
+        # Devuelve a la cola los trabajos en proceso de consumidores sin latido (worker muerto)
+        n = 0
+        for otro in self._r.hgetall(REDIS_CONSUMERS_KEY) or {}:
+            if otro == self.consumidor or self._r.get(f"jobs:vivo:{otro}"): continue
+            n += self._recuperar_de(otro)
+            self._r.hdel(REDIS_CONSUMERS_KEY, otro)
+        return n
+
+    def _recuperar_de(self, consumidor: str) -> int:
+        # Los que ya mataron JOBS_MAX_ATTEMPTS workers se descartan; el resto vuelve al frente
+        procesando, n = f"jobs:procesando:{consumidor}", 0
+        while True:
+            raw = self._r.lindex(procesando, -1)
+            if not raw: break
+            d = json.loads(raw)
+            job = self.obtener(d["id"]) or {"id": d["id"], "tipo": d["tipo"], "creado": _ahora(), "intentos": 0}
+            if int(job.get("intentos") or 0) >= JOBS_MAX_ATTEMPTS:
+                if self._r.lrem(procesando, 1, raw):
+                    self._actualizar(job, estado="failed", error="el worker murió durante el trabajo")
+                    log.error("Trabajo %s descartado: su worker murió %s veces", d["id"], job.get("intentos"))
+                continue
+            if self._r.lmove(procesando, REDIS_QUEUE_KEY, "RIGHT", "LEFT") != raw: continue   # otro lo movió
+            self._actualizar(job, estado="queued", progreso="reencolado (worker caído)")
+            log.warning("Trabajo %s reencolado: su worker (%s) murió", d["id"], consumidor)
+            n += 1
+        self.recuperados += n
+        return n
+
+    # ---- estado -------------------------------------------------------------
+    def _guardar(self, job: dict):
+        job["actualizado"] = _ahora()
+        # En memoria solo queda el último estado que no se pudo escribir en Redis
+        if self._r is not None:
+            try:
+                self._r.set(f"job:{job['id']}", json.dumps(job), ex=JOBS_TTL)
+                with self._lock: self._estados.pop(job["id"], None)
+                return
+            except Exception as e:
+                log.warning("No se pudo guardar job %s en Redis: %s", job["id"], e)
+        with self._lock:
+            self._estados[job["id"]] = job
+
+    def obtener(self, job_id: str):
+        with self._lock:
+            local = self._estados.get(job_id)
+        if local is not None: return local
+        if self._r is not None:
+            try:
+                v = self._r.get(f"job:{job_id}")
+                if v: return json.loads(v)
+            except Exception as e:
+                log.warning("No se pudo leer job %s de Redis: %s", job_id, e)
+        return None
+
+    def _actualizar(self, job: dict, **campos):
+        job.update(campos); self._guardar(job)
+
+    # ---- encolar ------------------------------------------------------------
+    def _vigente(self, job: dict, ventana: float) -> bool:
+        # Trabajo con el mismo id que sirve de respuesta: en curso, o listo hace menos de `ventana` s
+        if job.get("estado") in ("queued", "running", "retrying"): return True
+        if job.get("estado") != "done": return False
+        try: fin = datetime.datetime.fromisoformat((job.get("actualizado") or "").rstrip("Z"))
+        except ValueError: return False
+        return (datetime.datetime.utcnow() - fin).total_seconds() < ventana
+
+    def _reservar(self, job: dict, ventana: float):
+        # -> trabajo existente con ese id si sigue vigente; si no, None y `job` queda guardado
+        if self._r is not None:
+            try:
+                job["actualizado"] = _ahora()
+                if self._r.set(f"job:{job['id']}", json.dumps(job), ex=JOBS_TTL, nx=True):
+                    with self._lock: self._estados.pop(job["id"], None)
+                    return None
+                previo = self.obtener(job["id"])
+                if previo and self._vigente(previo, ventana): return previo
+                self._guardar(job); return None
+            except Exception as e:
+                log.warning("No se pudo reservar job %s en Redis: %s", job["id"], e)
+        with self._lock:
+            previo = self._estados.get(job["id"])
+            if previo and self._vigente(previo, ventana): return previo
+            job["actualizado"] = _ahora()
+            self._estados[job["id"]] = job
+        return None
+
+    def encolar(self, tipo: str, payload: dict, job_id: str = "", ventana: float = 0) -> dict:
+        # job_id fijo (idempotente): si ya hay un trabajo vigente con ese id se devuelve ese,
+        # marcado con "repetido": True, sin encolar de nuevo
+        if tipo not in self._handlers:
+            raise KeyError(f"Tipo de trabajo no registrado: {tipo}")
+        self.arrancar()
+        job = {"id": job_id or uuid.uuid4().hex, "tipo": tipo, "estado": "queued", "progreso": "en cola",
+               "intentos": 0, "resultado": None, "error": None, "creado": _ahora()}
+        if job_id:
+            previo = self._reservar(job, ventana)
+            if previo: return {**previo, "repetido": True}
+        else:
+            self._guardar(job)
+        if self.backend == "redis":
+            raw = json.dumps({"id": job["id"], "tipo": tipo, "payload": payload})
+            try: largo = self._r.rpush(REDIS_QUEUE_KEY, raw)
+            except Exception as e:
+                log.warning("No se pudo encolar job %s en Redis: %s", job["id"], e)
+                self._actualizar(job, estado="failed", error="cola no disponible")
+                raise ColaNoDisponible("cola de trabajos no disponible") from e
+            # Tope sin carrera entre workers: si el push lo pasó, se retira (si un worker ya
+            # lo tomó, LREM no lo encuentra y el trabajo queda aceptado)
+            if largo > self.maxsize:
+                try: retirado = self._r.lrem(REDIS_QUEUE_KEY, -1, raw)
+                except Exception: retirado = 0
+                if retirado:
+                    self._actualizar(job, estado="rejected", error="cola llena")
+                    raise ColaLlena("cola de trabajos llena")
+        else:
+            try: self._cola.put_nowait((job["id"], tipo, payload))
+            except queue.Full:
+                self._actualizar(job, estado="rejected", error="cola llena")
+                raise ColaLlena("cola de trabajos llena")
+        return job
+
+    def pendientes(self) -> int:
+        if self.backend == "redis":
+            try: return int(self._r.llen(REDIS_QUEUE_KEY))
+            except Exception: return -1
+        return self._cola.qsize()
+
+    # ---- ejecución ----------------------------------------------------------
+    def _siguiente(self):
+        # -> (id, tipo, payload, raw); raw: el elemento en la lista "en proceso" (solo redis)
+        if self.backend == "redis":
+            try:
+                raw = self._rb.blmove(REDIS_QUEUE_KEY, self._procesando, ESPERA_COLA, "LEFT", "RIGHT")
+            except Exception as e:
+                log.warning("BLMOVE falló: %s", e); time.sleep(1); return None
+            if not raw: return None
+            d = json.loads(raw)
+            return d["id"], d["tipo"], d.get("payload") or {}, raw
+        try: return (*self._cola.get(timeout=5), None)
+        except queue.Empty: return None
+
+    def _loop(self):
+        while not self._detener.is_set():
+            item = self._siguiente()
+            if item is None: continue
+            job_id, tipo, payload, raw = item
+            job = self.obtener(job_id) or {"id": job_id, "tipo": tipo, "creado": _ahora(), "intentos": 0}
+            try: self._ejecutar(job, tipo, payload)
+            finally:
+                if raw is not None: self._terminado(raw)
+
+    def _terminado(self, raw: str):
+        for _ in range(3):
+            try: self._r.lrem(self._procesando, 1, raw); return
+            except Exception as e:
+                log.warning("No se pudo sacar un trabajo de %s: %s", self._procesando, e); time.sleep(1)
+
+    def _ejecutar(self, job: dict, tipo: str, payload: dict):
+        fn = self._handlers.get(tipo)
+        if fn is None:
+            self._actualizar(job, estado="failed", error=f"tipo desconocido: {tipo}"); return
+        def progreso(etapa: str):
+            self._actualizar(job, progreso=etapa)
+        inicio = time.monotonic()
+        while True:
+            job["intentos"] = int(job.get("intentos") or 0) + 1
+            self._actualizar(job, estado="running", progreso="iniciando", error=None)
+            try:
+                resultado = fn(payload, progreso)
+                self._actualizar(job, estado="done", progreso="listo", resultado=resultado)
+                return
+            except Exception as e:
+                ocupado = getattr(e, "reintentar_en", None)
+                if ocupado is not None and time.monotonic() - inicio < JOBS_BUSY_MAX:
+                    # Recurso saturado: esperar sin gastar el intento
+                    job["intentos"] -= 1
+                    espera = float(ocupado) * (0.5 + random.random())
+                    self._actualizar(job, estado="retrying", error=str(e), progreso=f"en espera {espera:.1f}s")
+                    time.sleep(espera); continue
+                log.exception("Trabajo %s (%s) falló en intento %s", job["id"], tipo, job["intentos"])
+                if job["intentos"] >= JOBS_MAX_ATTEMPTS:
+                    self._actualizar(job, estado="failed", error=str(e)); return
+                espera = JOBS_RETRY_BASE * (2 ** (job["intentos"] - 1)) * (0.5 + random.random())
+                self._actualizar(job, estado="retrying", error=str(e), progreso=f"reintento en {espera:.1f}s")
+                time.sleep(espera)
+
+    def cerrar(self):
+        self._detener.set()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Respuestas TwiML del webhook sin el constructor XML de twilio
+#
+# Produce los mismos bytes que str(MessagingResponse()) con un .message() por
+# texto. Los nodos del flujo se precompilan al cargarlo (flujo.py): los que no
+# tienen {variables} quedan como el <Message> ya serializado y los
+# personalizados como una Plantilla (trozos ya escapados + nombres de
+# variable). Por mensaje solo se escapan los valores de la sesión y se
+# concatenan bytes.
+# -----------------------------------------------------------------------------
+import re
+from functools import lru_cache
+
+CABECERA = b'<?xml version="1.0" encoding="UTF-8"?>'
+VACIA = CABECERA + b"<Response />"
+_RE_VARIABLE = re.compile(r"\{([^}]+)\}")
+
+def escapar(texto: str) -> str:
+    # Lo mismo que ElementTree para texto de un elemento
+    if "&" in texto: texto = texto.replace("&", "&amp;")
+    if "<" in texto: texto = texto.replace("<", "&lt;")
+    if ">" in texto: texto = texto.replace(">", "&gt;")
+    return texto
+
+@lru_cache(maxsize=512)
+def mensaje(texto: str) -> bytes:
+    # Textos fijos (avisos, menús) se serializan una vez por proceso
+    return b"<Message>" + escapar(texto).encode("utf-8") + b"</Message>" if texto else b""
+
+class Plantilla:
+    __slots__ = ("trozos", "variables", "fija")
+
+    def __init__(self, texto: str):
+        partes = _RE_VARIABLE.split(texto or "")
+        self.trozos = tuple(escapar(p) for p in partes[0::2])
+        self.variables = tuple(v.strip() for v in partes[1::2])
+        self.fija = None if self.variables else mensaje(texto or "")
+
+    def render(self, data: dict) -> bytes:
+        if self.fija is not None: return self.fija
+        salida = [self.trozos[0]]
+        for var, trozo in zip(self.variables, self.trozos[1:]):
+            salida.append(escapar(str(data.get(var, "")))); salida.append(trozo)
+        texto = "".join(salida)
+        return b"<Message>" + texto.encode("utf-8") + b"</Message>" if texto else b""
+
+class Respuesta:
+    __slots__ = ("partes",)
+
+    def __init__(self):
+        self.partes = []
+
+    def message(self, texto: str):
+        if texto: self.partes.append(mensaje(texto))
+
+    def agregar(self, fragmento: bytes):
+        if fragmento: self.partes.append(fragmento)
+
+    def bytes(self) -> bytes:
+        if not self.partes: return VACIA
+        return CABECERA + b"<Response>" + b"".join(self.partes) + b"</Response>"